@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "spotifywrapped.middleware.ServerTimingMiddleware",
+    "spotifywrapped.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -57,6 +59,126 @@ ROOT_URLCONF = "SpotfyWrapped.urls"
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_SECURE = False
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "spotifywrapped",
+        "OPTIONS": {
+            "MAX_ENTRIES": 5000,
+        },
+    }
+}
+
+# Spotify API fetching
+# Independent Spotify requests run in parallel; the deadline bounds the whole batch and the
+# timeout bounds each individual request (both in seconds).
+SPOTIFY_FETCH_WORKERS = 8
+SPOTIFY_FETCH_DEADLINE = 8
+SPOTIFY_REQUEST_TIMEOUT = 5
+
+# Shared Spotify HTTP client: keep-alive pool size, retry policy for 429/5xx responses
+# (SPOTIFY_MAX_RETRY_WAIT caps the total seconds spent backing off per request) and the
+# per-client-ID token bucket (requests per second and burst size).
+# The token bucket lives in each process's memory, so SPOTIFY_RATE_LIMIT is a per-process budget:
+# every web server process, run_wrap_worker and generate_season_wraps gets the full rate. Divide
+# the client ID's allowance by the number of processes sending requests when setting it.
+SPOTIFY_POOL_SIZE = 10
+SPOTIFY_MAX_RETRIES = 3
+SPOTIFY_BACKOFF_BASE = 0.5
+SPOTIFY_MAX_RETRY_WAIT = 10
+SPOTIFY_RATE_LIMIT = 10
+SPOTIFY_RATE_BURST = 20
+
+# Spotify OAuth: the callback URL registered with Spotify, the scopes requested, how many seconds
+# before expiry a stored access token is refreshed, and how long one refresh may hold its lease before
+# another process takes over
+SPOTIFY_REDIRECT_URI = 'http://localhost:8000/callback/'
+SPOTIFY_SCOPES = "user-top-read user-read-recently-played"
+SPOTIFY_TOKEN_REFRESH_MARGIN = 300
+SPOTIFY_TOKEN_REFRESH_LEASE = 30
+
+# Spotify Web API transport: 'live', 'record' (also save every response under SPOTIFY_FIXTURE_DIR)
+# or 'replay' (serve the saved responses without any network I/O, for load tests and debugging).
+# Fixtures are keyed by endpoint, query parameters and a pseudonymous key derived from the user's ID.
+SPOTIFY_TRANSPORT = 'live'
+SPOTIFY_FIXTURE_DIR = BASE_DIR / 'spotify_fixtures'
+
+# Circuit breaker: after SPOTIFY_BREAKER_THRESHOLD consecutive failed requests, calls to Spotify fail
+# immediately for SPOTIFY_BREAKER_RESET_AFTER seconds, and spotify_wrapped serves the latest saved wrap
+SPOTIFY_BREAKER_THRESHOLD = 5
+SPOTIFY_BREAKER_RESET_AFTER = 30
+
+# Seconds a track's audio features stay cached, shared by every user (None: until evicted, as they never change)
+SPOTIFY_AUDIO_FEATURES_TTL = None
+
+# Number of scrambled questions prepared for the guess-the-song game when a deck is shown
+SONG_QUESTION_POOL_SIZE = 20
+
+# Seconds a saved wrap's rendered slides stay cached; deleting the wrap evicts them
+WRAP_DECK_CACHE_TTL = 86400
+
+# Seconds within which generating an identical wrap reuses the saved one instead of adding a duplicate (0 disables)
+WRAP_DEDUP_WINDOW = 86400
+
+# Track and artist catalog rows kept in each process's memory, so saving a wrap full of popular
+# tracks and artists does not read or rewrite the catalog tables
+CATALOG_CACHE_SIZE = 20000
+
+# Number of wraps per page in the saved-wraps listing
+SAVED_WRAPS_PER_PAGE = 20
+
+# Wrap generation jobs
+# When async, spotify_wrapped only queues a job; run `python manage.py run_wrap_worker` to process them.
+# It is off under DEBUG, so `runserver` alone generates wraps (within the request) during development.
+# Running jobs not updated for WRAP_JOB_STALE_AFTER seconds are assumed abandoned: the worker re-queues
+# them, and a new request for the same time range fails and replaces them. Pending jobs never expire.
+# When not async, a request joining a generation already in flight waits up to WRAP_JOB_WAIT_TIMEOUT
+# seconds for it before falling back to the progress page.
+WRAP_JOBS_ASYNC = not DEBUG
+WRAP_JOB_STALE_AFTER = 300
+WRAP_JOB_WAIT_TIMEOUT = 30
+
+# Per-request performance instrumentation
+# ServerTimingMiddleware logs one line per request to the 'spotifywrapped.performance' logger
+# (printed to the console when DEBUG is on);
+# set SERVER_TIMING_ENABLED to False to stop exposing the same numbers in the Server-Timing header.
+SERVER_TIMING_ENABLED = True
+
+# Opt-in request profiling: a PROFILING_SAMPLE_RATE fraction of requests is profiled with cProfile,
+# and any other request slower than PROFILING_SLOW_THRESHOLD seconds (None disables) has its sampled
+# stacks saved for flame graphs. Only the newest PROFILING_MAX_FILES profiles in PROFILING_DIR are kept.
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.01
+PROFILING_SLOW_THRESHOLD = 2.0
+PROFILING_SAMPLE_INTERVAL = 0.005
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_FILES = 200
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "require_debug_true": {
+            "()": "django.utils.log.RequireDebugTrue",
+        },
+    },
+    "handlers": {
+        "console": {
+            "filters": ["require_debug_true"],
+            "class": "logging.StreamHandler",
+        },
+    },
+    "loggers": {
+        "spotifywrapped.performance": {
+            "handlers": ["console"],
+            "level": "INFO",
+        },
+    },
+}
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -84,6 +206,14 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Transactions take the write lock up front, so concurrent ones that read and then write (saving
+        # a batch of wraps, ingesting plays) wait their turn: with SQLite's default deferred mode, the one
+        # that tries to upgrade its read lock fails at once with "database is locked", whatever the timeout.
+        # Transactions only ever do database work, never Spotify requests, so the lock is held briefly.
+        "OPTIONS": {
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
     }
 }
 
@@ -9,3 +9,9 @@ class SpotifywrappedConfig(AppConfig):
     """
     default_auto_field = "django.db.models.BigAutoField"
     name = "spotifywrapped"
+
+    def ready(self):
+        """
+        Connects the app's signal receivers.
+        """
+        from . import signals  # noqa: F401
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache:
+    """
+    A thread-safe in-process mapping that evicts its least recently used entries once full.
+
+    Attributes:
+        maxsize (int): The most entries kept.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """
+        Returns the cached values for the given keys, marking them as recently used.
+
+        Args:
+            keys (iterable): The keys to look up.
+
+        Returns:
+            dict: Maps each key found to its value; missing keys are left out.
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def set_many(self, mapping):
+        """
+        Stores the given values, evicting the least recently used entries beyond maxsize.
+
+        Args:
+            mapping (dict): Maps keys to the values to store.
+        """
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Catalog rows by (model label, Spotify ID): their primary key and catalog field values. Popular tracks
+# and artists appear in most users' wraps, so saving a wrap rarely has to touch the catalog tables.
+catalog_cache = LRUCache(getattr(settings, 'CATALOG_CACHE_SIZE', 20000))
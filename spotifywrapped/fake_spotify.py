@@ -0,0 +1,226 @@
+import hashlib
+import itertools
+import json
+import random
+import string
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from . import spotify_client
+
+GENRES = (
+    'pop', 'dance pop', 'hip hop', 'rap', 'trap', 'r&b', 'alternative r&b', 'indie rock', 'indie pop',
+    'modern rock', 'edm', 'house', 'latin pop', 'reggaeton', 'k-pop', 'country', 'lo-fi beats', 'jazz',
+)
+WORDS = (
+    'midnight', 'city', 'lights', 'golden', 'hour', 'summer', 'rain', 'heart', 'echo', 'blue', 'fire',
+    'dreams', 'wild', 'paper', 'moon', 'ocean', 'neon', 'velvet', 'gravity', 'electric', 'silver', 'static',
+)
+
+
+def _spotify_id(rng):
+    return ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(22))
+
+
+def _title(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).title()
+
+
+def _images(rng, kind):
+    image_id = hashlib.sha1(str(rng.random()).encode()).hexdigest()[:24]
+    return [
+        {'url': f'https://i.scdn.co/image/{kind}{size}{image_id}', 'height': size, 'width': size}
+        for size in (640, 300, 64)
+    ]
+
+
+def top_items_payload(access_token, item_type, time_range, limit=50):
+    """
+    Builds a /me/top/{tracks,artists} response body shaped like Spotify's. The payload is derived from
+    the access token and time range, so each fake user gets their own, stable listening history.
+
+    Args:
+        access_token (str): The access token the request was made with.
+        item_type (str): Either 'tracks' or 'artists'.
+        time_range (str): The requested time range.
+        limit (int, optional): Number of items to return. Defaults to 50.
+
+    Returns:
+        dict: The response body.
+    """
+    rng = random.Random(f'{access_token}:{time_range}')
+    artists = []
+    for _ in range(limit):
+        artists.append({
+            'id': _spotify_id(rng),
+            'name': _title(rng, rng.randint(1, 2)),
+            'genres': rng.sample(GENRES, rng.randint(0, 3)),
+            'images': _images(rng, 'ab6761610000'),
+            'popularity': rng.randint(5, 95),
+            'followers': {'href': None, 'total': rng.randint(100, 5_000_000)},
+            'type': 'artist',
+        })
+    if item_type == 'artists':
+        items = artists
+    else:
+        items = []
+        for _ in range(limit):
+            artist = rng.choice(artists)
+            track_id = _spotify_id(rng)
+            items.append({
+                'id': track_id,
+                'name': _title(rng, rng.randint(1, 4)),
+                'artists': [{'id': artist['id'], 'name': artist['name'], 'type': 'artist'}],
+                'album': {'id': _spotify_id(rng), 'name': _title(rng, 2), 'images': _images(rng, 'ab67616d0000')},
+                'preview_url': f'https://p.scdn.co/mp3-preview/{track_id}' if rng.random() < 0.7 else None,
+                'popularity': rng.randint(5, 95),
+                'duration_ms': rng.randint(120_000, 320_000),
+                'explicit': rng.random() < 0.3,
+                'type': 'track',
+            })
+    return {'items': items, 'total': limit, 'limit': limit, 'offset': 0, 'next': None, 'previous': None}
+
+
+def audio_features_payload(track_ids):
+    """
+    Builds an /audio-features response body shaped like Spotify's, with stable features per track.
+
+    Args:
+        track_ids (list): The requested track IDs.
+
+    Returns:
+        dict: The response body.
+    """
+    features = []
+    for track_id in track_ids:
+        rng = random.Random(track_id)
+        features.append({
+            'id': track_id,
+            'danceability': round(rng.random(), 3),
+            'energy': round(rng.random(), 3),
+            'valence': round(rng.random(), 3),
+            'tempo': round(rng.uniform(60, 180), 3),
+            'type': 'audio_features',
+        })
+    return {'audio_features': features}
+
+
+class FakeSpotifyServer:
+    """
+    A local stand-in for api.spotify.com and accounts.spotify.com, serving canned top tracks, top
+    artists and audio features with a configurable latency and error rate. Used as a context
+    manager, it points spotify_client at itself for the duration of the block.
+
+    Attributes:
+        latency (float): Seconds to wait before answering each request.
+        error_rate (float): Fraction of API requests answered with a 503.
+        requests (Counter): Number of requests received, by path.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self._random = random.Random(seed)
+        self._token_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self._saved_urls = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._httpd.server_port}'
+
+    def total_requests(self):
+        """
+        Returns the number of requests received so far.
+        """
+        with self._lock:
+            return sum(self.requests.values())
+
+    def _should_fail(self, path):
+        with self._lock:
+            self.requests[path] += 1
+            return self._random.random() < self.error_rate
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = parse_qs(url.query)
+                if url.path.startswith('/v1/me/top/'):
+                    token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+                    item_type = url.path.rsplit('/', 1)[-1]
+                    time_range = params.get('time_range', ['medium_term'])[0]
+                    limit = int(params.get('limit', ['20'])[0])
+                    self.answer(url.path, lambda: top_items_payload(token, item_type, time_range, limit))
+                elif url.path == '/v1/audio-features':
+                    track_ids = params.get('ids', [''])[0].split(',')
+                    self.answer(url.path, lambda: audio_features_payload(track_ids))
+                elif url.path == '/authorize':
+                    self.answer(url.path, lambda: {})
+                else:
+                    self.send_json(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if url.path == '/api/token':
+                    self.answer(url.path, lambda: {
+                        'access_token': f'fake-token-{next(server._token_ids)}',
+                        'token_type': 'Bearer',
+                        'scope': 'user-top-read user-read-recently-played',
+                        'expires_in': 3600,
+                        'refresh_token': 'fake-refresh',
+                    })
+                else:
+                    self.send_json(404, {'error': 'not_found'})
+
+            def answer(self, path, build_body):
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._should_fail(path):
+                    self.send_json(503, {'error': {'status': 503, 'message': 'Service unavailable'}})
+                else:
+                    self.send_json(200, build_body())
+
+            def send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-spotify', daemon=True)
+        self._thread.start()
+
+        self._saved_urls = (spotify_client.SPOTIFY_API_URL, spotify_client.SPOTIFY_ACCOUNTS_URL)
+        spotify_client.SPOTIFY_API_URL = f'{self.url}/v1'
+        spotify_client.SPOTIFY_ACCOUNTS_URL = self.url
+        return self
+
+    def stop(self):
+        spotify_client.SPOTIFY_API_URL, spotify_client.SPOTIFY_ACCOUNTS_URL = self._saved_urls
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
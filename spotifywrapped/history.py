@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from . import spotify_client
+from .instrumentation import phase
+from .models import ListeningCursor, ListeningEvent, Track, catalog_key, upsert_catalog
+from .spotify_data import TOP_LIST_SIZE, format_track
+
+RECENTLY_PLAYED_LIMIT = 50
+# Upper bound on pages per poll; Spotify only keeps a user's last 50 plays, so one page is the norm
+RECENTLY_PLAYED_MAX_PAGES = 5
+# Approximate length of each Spotify time range, used to pick the plays a wrap's statistics cover
+TIME_RANGE_DAYS = {'short_term': 28, 'medium_term': 182, 'long_term': 365}
+
+
+def parse_played_at(value):
+    """
+    Parses a played_at timestamp from the recently played endpoint, e.g. '2024-10-18T14:25:01.123Z'.
+
+    Args:
+        value (str): The ISO 8601 timestamp.
+
+    Returns:
+        datetime: The aware datetime.
+    """
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def fetch_recently_played(access_token, after=0, user_id=None):
+    """
+    Fetches the plays made after the given cursor from the recently played endpoint, following the
+    'after' cursor from page to page so only plays not seen yet are transferred.
+
+    Args:
+        access_token (str): The Spotify access token to authenticate the API request.
+        after (int, optional): Spotify's cursor: a Unix time in milliseconds. Defaults to 0.
+        user_id (int, optional): The ID of the user whose plays they are. Defaults to None.
+
+    Returns:
+        tuple: The raw play history items (None if the first request fails) and the cursor to send
+        on the next poll.
+    """
+    items = []
+    for _ in range(RECENTLY_PLAYED_MAX_PAGES):
+        params = {'limit': RECENTLY_PLAYED_LIMIT, 'after': after}
+        response = spotify_client.api_get(access_token, '/me/player/recently-played', params=params, user_id=user_id)
+        if response is None or response.status_code != 200:
+            # Keep the pages already fetched; the next poll resumes from the last cursor reached
+            return (items or None), after
+        with phase('parse'):
+            body = response.json()
+        page = body.get('items', [])
+        items.extend(page)
+        next_after = int((body.get('cursors') or {}).get('after') or after)
+        if len(page) < RECENTLY_PLAYED_LIMIT or next_after <= after:
+            return items, next_after
+        after = next_after
+    return items, after
+
+
+def ingest_recently_played(user, access_token):
+    """
+    Adds the user's new plays to their listening history and advances their cursor. Tracks are
+    saved to the shared catalog and the plays are written with a single bulk insert; plays already
+    stored (an overlapping page, a concurrent poll) are skipped.
+
+    Args:
+        user (User): The user whose history is ingested.
+        access_token (str): The user's Spotify access token.
+
+    Returns:
+        int or None: The number of new plays stored, or None if Spotify could not be reached.
+    """
+    cursor, _ = ListeningCursor.objects.get_or_create(user=user)
+    items, after = fetch_recently_played(access_token, cursor.after, user_id=user.id)
+    if items is None:
+        return None
+
+    plays = [item for item in items if item.get('track') and item.get('played_at')]
+    with phase('save'), transaction.atomic():
+        tracks = [format_track(item['track']) for item in plays]
+        track_ids = upsert_catalog(Track, tracks)
+        events = {}
+        for item, track in zip(plays, tracks):
+            played_at = parse_played_at(item['played_at'])
+            events[played_at] = ListeningEvent(
+                user=user,
+                track_id=track_ids[catalog_key(track, Track.KEY_FIELDS)],
+                played_at=played_at,
+                duration_ms=item['track'].get('duration_ms') or 0,
+            )
+        existing = set(ListeningEvent.objects.filter(user=user, played_at__in=events).values_list('played_at', flat=True))
+        new_events = [event for played_at, event in events.items() if played_at not in existing]
+        ListeningEvent.objects.bulk_create(new_events, ignore_conflicts=True)
+        if after > cursor.after:
+            cursor.after = after
+            cursor.save(update_fields=['after', 'updated_at'])
+    return len(new_events)
+
+
+def listening_stats(user, since=None, size=TOP_LIST_SIZE):
+    """
+    Computes listening statistics from the user's stored history, without any Spotify request.
+
+    Args:
+        user (User): The user whose history is summarized.
+        since (datetime, optional): Only count plays from this moment on. Defaults to None (all plays).
+        size (int, optional): Number of most played tracks and artists to list. Defaults to TOP_LIST_SIZE.
+
+    Returns:
+        dict or None: The number of plays, the minutes listened, and the most played tracks and
+        artists with their play counts; None if there are no plays in the period.
+    """
+    events = ListeningEvent.objects.filter(user=user)
+    if since is not None:
+        events = events.filter(played_at__gte=since)
+    totals = events.aggregate(plays=Count('id'), duration_ms=Sum('duration_ms'))
+    if not totals['plays']:
+        return None
+
+    top_tracks = events.values('track__spotify_id', 'track__name', 'track__artist', 'track__image_url') \
+        .annotate(plays=Count('id')).order_by('-plays', 'track__name')[:size]
+    top_artists = events.values('track__artist').annotate(plays=Count('id')).order_by('-plays', 'track__artist')[:size]
+    return {
+        'plays': totals['plays'],
+        'minutes': round((totals['duration_ms'] or 0) / 60000),
+        'top_tracks': [
+            {
+                'id': row['track__spotify_id'],
+                'name': row['track__name'],
+                'artist': row['track__artist'],
+                'image_url': row['track__image_url'],
+                'plays': row['plays'],
+            }
+            for row in top_tracks
+        ],
+        'top_artists': [{'name': row['track__artist'], 'plays': row['plays']} for row in top_artists],
+    }
+
+
+def listening_stats_for_range(user, time_range):
+    """
+    Computes the user's listening statistics over the period a Spotify time range covers.
+
+    Args:
+        user (User): The user whose history is summarized.
+        time_range (str): The time range, e.g. 'short_term'.
+
+    Returns:
+        dict or None: The statistics, as returned by listening_stats.
+    """
+    return listening_stats(user, since=timezone.now() - timedelta(days=TIME_RANGE_DAYS.get(time_range, 182)))
@@ -0,0 +1,132 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+_current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Timings and counters collected while serving one request.
+
+    Phases recorded from the Spotify fetch pool run in parallel, so their durations can add up to more
+    than the request's wall-clock time.
+
+    Attributes:
+        phases (dict): Maps a phase name to the seconds spent in it.
+        spotify_calls (int): Number of HTTP requests sent to Spotify, retries included.
+        spotify_time (float): Seconds spent waiting on those requests.
+        db_queries (int): Number of database queries executed.
+        db_time (float): Seconds spent executing them.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.spotify_calls = 0
+        self.spotify_time = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_spotify_call(self, seconds):
+        with self._lock:
+            self.spotify_calls += 1
+            self.spotify_time += seconds
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper (see connection.execute_wrapper) counting and timing each query.
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.db_queries += 1
+                self.db_time += elapsed
+
+    def elapsed(self):
+        """
+        Returns the seconds since the metrics were started.
+        """
+        return time.perf_counter() - self.started
+
+
+def start_request_metrics():
+    """
+    Starts collecting metrics for the current request.
+
+    Returns:
+        tuple: The new RequestMetrics and the token to pass to finish_request_metrics.
+    """
+    metrics = RequestMetrics()
+    return metrics, _current_metrics.set(metrics)
+
+
+def finish_request_metrics(token):
+    """
+    Stops collecting metrics for the current request.
+
+    Args:
+        token: The token returned by start_request_metrics.
+    """
+    _current_metrics.reset(token)
+
+
+def current_metrics():
+    """
+    Returns the metrics of the request being served, or None outside of a request.
+    """
+    return _current_metrics.get()
+
+
+@contextmanager
+def phase(name):
+    """
+    Times the enclosed block and adds it to the named phase of the current request, if any.
+
+    Args:
+        name (str): The phase name, e.g. 'parse' or 'render'.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current_metrics.get()
+        if metrics is not None:
+            metrics.add_phase(name, time.perf_counter() - started)
+
+
+def record_spotify_call(seconds):
+    """
+    Counts one HTTP request to Spotify against the current request, if any.
+
+    Args:
+        seconds (float): How long the request took.
+    """
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.add_spotify_call(seconds)
+
+
+def run_in_context(fn):
+    """
+    Wraps a callable so it runs in a copy of the caller's context. Thread pools do not carry
+    context variables over by themselves, so work submitted through this is still attributed to
+    the request that submitted it.
+
+    Args:
+        fn (callable): A zero-argument callable.
+
+    Returns:
+        callable: A zero-argument callable running fn in the captured context.
+    """
+    context = contextvars.copy_context()
+    return lambda: context.run(fn)
@@ -0,0 +1,257 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .history import listening_stats_for_range
+from .instrumentation import phase
+from .metrics import wraps_saved
+from .models import SpotifyWrap, WrapJob
+from .spotify_data import load_all_wrap_data, load_wrap_data
+from .tokens import get_access_token
+
+logger = logging.getLogger(__name__)
+
+# Runs revalidation jobs outside the request when there is no worker (settings.WRAP_JOBS_ASYNC is False)
+_background_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='wrap-revalidate')
+
+
+def stale_before():
+    """
+    Returns the moment before which a running job's last update means it was abandoned: a running
+    job is a lease on its (user, time range) that its runner renews with every progress update.
+    Pending jobs have no runner to renew anything, so their age says nothing about them.
+    """
+    return timezone.now() - timedelta(seconds=getattr(settings, 'WRAP_JOB_STALE_AFTER', 300))
+
+
+def fail_abandoned_job(job):
+    """
+    Marks an abandoned active job as failed, freeing its (user, time range) for a new job.
+    The update only applies if the job has not made progress since it was read, so a runner that
+    is merely slow keeps its job.
+
+    Args:
+        job (WrapJob): The abandoned job, as read from the database.
+
+    Returns:
+        bool: True if the job was failed by this call.
+    """
+    return bool(WrapJob.objects.filter(
+        id=job.id, status__in=WrapJob.ACTIVE_STATUSES, updated_at=job.updated_at,
+    ).update(
+        status=WrapJob.STATUS_FAILED,
+        access_token='',
+        message="The generation was interrupted. Please try again.",
+        updated_at=timezone.now(),
+    ))
+
+
+def latest_wrap_id(user, time_range):
+    """
+    Returns the ID of the user's most recent wrap for a time range, shown when a fresh one is not
+    available yet. For WrapJob.TIME_RANGE_ALL this is the short-term wrap, the one such a job points at.
+
+    Args:
+        user (User): The wrap's owner.
+        time_range (str): The time range of the wrap, or WrapJob.TIME_RANGE_ALL.
+
+    Returns:
+        int or None: The wrap's ID, or None if the user has no wrap for the time range.
+    """
+    if time_range == WrapJob.TIME_RANGE_ALL:
+        time_range = 'short_term'
+    return SpotifyWrap.objects.filter(user=user, time_range=time_range) \
+        .order_by('-created_at').values_list('id', flat=True).first()
+
+
+def enqueue_wrap_job(user, time_range, access_token):
+    """
+    Queues a wrap generation for the given user, unless one for the same time range is already
+    pending or running. Generation is single-flight: the unique constraint on active jobs lets exactly
+    one request create the job (the leader), and every concurrent request gets that same job back
+    (a follower) and shares its result instead of fetching from Spotify again.
+
+    A running job not updated for settings.WRAP_JOB_STALE_AFTER seconds was left behind by a crashed
+    process; it is failed and replaced rather than joined, so it cannot block the time range forever.
+    A pending job is always joined, however long it has been waiting for a worker.
+
+    Args:
+        user (User): The user the wrap is generated for.
+        time_range (str): The time range for the wrap.
+        access_token (str): The Spotify access token the worker uses to fetch the user's data.
+
+    Returns:
+        tuple: The active job and a boolean that is True if this call queued it.
+    """
+    retried = False
+    while True:
+        try:
+            with transaction.atomic():
+                return WrapJob.objects.create(user=user, time_range=time_range, access_token=access_token), True
+        except IntegrityError:
+            job = WrapJob.objects.filter(
+                user=user, time_range=time_range, status__in=WrapJob.ACTIVE_STATUSES,
+            ).first()
+            if job is None:
+                # Either the active job just finished, or the insert failed for another reason
+                if retried:
+                    raise
+                retried = True
+            elif job.status == WrapJob.STATUS_RUNNING and job.updated_at < stale_before():
+                fail_abandoned_job(job)
+            else:
+                return job, False
+
+
+def wait_for_job(job, timeout=None, poll_interval=0.2):
+    """
+    Waits for a job run by another request or worker to finish.
+
+    Args:
+        job (WrapJob): The job to wait for; refreshed in place.
+        timeout (float, optional): Seconds to wait at most. Defaults to settings.WRAP_JOB_WAIT_TIMEOUT.
+        poll_interval (float, optional): Seconds between checks. Defaults to 0.2.
+
+    Returns:
+        bool: True if the job finished within the timeout.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'WRAP_JOB_WAIT_TIMEOUT', 30)
+    deadline = time.monotonic() + timeout
+    while not job.is_finished:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll_interval)
+        job.refresh_from_db(fields=['status', 'progress', 'message', 'wrap'])
+    return True
+
+
+def update_job(job, **fields):
+    """
+    Saves progress on a job, touching only the given fields.
+
+    Args:
+        job (WrapJob): The job to update.
+        **fields: Field values to set on the job.
+    """
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save(update_fields=[*fields, 'updated_at'])
+
+
+def claim_next_job():
+    """
+    Atomically claims the oldest pending job, so several worker processes can share the queue.
+    Jobs left running by a crashed worker become claimable again after settings.WRAP_JOB_STALE_AFTER seconds.
+
+    Returns:
+        WrapJob or None: The claimed job, now marked as running, or None if the queue is empty.
+    """
+    WrapJob.objects.filter(status=WrapJob.STATUS_RUNNING, updated_at__lt=stale_before()).update(
+        status=WrapJob.STATUS_PENDING,
+    )
+
+    for job_id in WrapJob.objects.filter(status=WrapJob.STATUS_PENDING).order_by('created_at').values_list('id', flat=True)[:10]:
+        claimed = WrapJob.objects.filter(id=job_id, status=WrapJob.STATUS_PENDING).update(
+            status=WrapJob.STATUS_RUNNING,
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            return WrapJob.objects.select_related('user').get(id=job_id)
+    return None
+
+
+def run_wrap_job(job, max_retry_wait=None, deadline=None):
+    """
+    Generates and saves the wrap for a claimed job, recording progress as it goes. A job for
+    WrapJob.TIME_RANGE_ALL fetches every time range at once and saves their wraps in a single
+    transaction; the job then points at the short-term wrap.
+
+    Args:
+        job (WrapJob): The job to run.
+        max_retry_wait (float, optional): Seconds each Spotify request may spend waiting for the rate
+            limiter and between retries. Defaults to settings.SPOTIFY_MAX_RETRY_WAIT.
+        deadline (float, optional): Seconds to wait for the top items. Defaults to settings.SPOTIFY_FETCH_DEADLINE.
+
+    When nothing at all could be fetched from Spotify (an outage, or this process's circuit breaker
+    is open), the job fails but points at the user's latest wrap for the time range, if any, so
+    whoever waits on it can show that wrap instead.
+
+    Returns:
+        WrapJob: The finished job, either done (with its wrap set) or failed.
+    """
+    update_job(job, status=WrapJob.STATUS_RUNNING, progress=10, message="Fetching your Spotify data...")
+    try:
+        # A job may wait in the queue past its token's expiry, so prefer the user's refreshed token
+        access_token = get_access_token(job.user) or job.access_token
+        if job.time_range == WrapJob.TIME_RANGE_ALL:
+            wraps_data, failed = load_all_wrap_data(
+                access_token, user_id=job.user_id, max_retry_wait=max_retry_wait, deadline=deadline,
+            )
+        else:
+            wrap_data, range_failed = load_wrap_data(
+                access_token, job.time_range, user_id=job.user_id, max_retry_wait=max_retry_wait, deadline=deadline,
+            )
+            wraps_data, failed = {job.time_range: wrap_data}, {job.time_range: range_failed}
+
+        # A range is only worth saving if at least its tracks or its artists loaded
+        ranges = [time_range for time_range in wraps_data if len(failed[time_range]) < 2]
+        if not ranges:
+            fallback_id = latest_wrap_id(job.user, job.time_range)
+            if fallback_id is None:
+                update_job(job, status=WrapJob.STATUS_FAILED, access_token='',
+                           message="Failed to fetch your Spotify data. Please try again.")
+            else:
+                update_job(job, status=WrapJob.STATUS_FAILED, access_token='', wrap_id=fallback_id,
+                           message="Spotify is unavailable right now, so here is your latest wrap.")
+            return job
+
+        # Real play counts and listening minutes come from the stored history, not from Spotify
+        with phase('build'):
+            for time_range in ranges:
+                stats = listening_stats_for_range(job.user, time_range)
+                if stats:
+                    wraps_data[time_range]['listening_stats'] = stats
+
+        update_job(job, progress=80, message="Saving your wrap...")
+        wraps = []
+        with phase('save'), transaction.atomic():
+            for time_range in ranges:
+                wrap, created = SpotifyWrap.objects.get_or_create_wrap(job.user, time_range, wraps_data[time_range])
+                wraps_saved.inc(outcome='created' if created else 'reused')
+                wraps.append(wrap)
+    except Exception:
+        update_job(job, status=WrapJob.STATUS_FAILED, access_token='', message="Something went wrong while building your wrap.")
+        raise
+
+    problems = [
+        f"top {' and '.join(failed[time_range])}" + (f" ({time_range.replace('_', ' ')})" if len(failed) > 1 else '')
+        for time_range in wraps_data if failed[time_range]
+    ]
+    message = f"Failed to fetch {', '.join(problems)}." if problems else "Your wrap is ready!"
+    update_job(job, status=WrapJob.STATUS_DONE, progress=100, wrap=wraps[0], access_token='', message=message)
+    return job
+
+
+def _run_detached(job_id):
+    try:
+        run_wrap_job(WrapJob.objects.select_related('user').get(id=job_id))
+    except Exception:
+        logger.exception("Background wrap job %s failed", job_id)
+    finally:
+        connections.close_all()
+
+
+def run_wrap_job_in_background(job):
+    """
+    Runs a job on a background thread of this process, for when no worker processes the queue.
+
+    Args:
+        job (WrapJob): The job to run.
+    """
+    _background_executor.submit(_run_detached, job.id)
@@ -0,0 +1,180 @@
+import json
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from spotifywrapped import spotify_client
+from spotifywrapped.fake_spotify import FakeSpotifyServer
+from spotifywrapped.models import DuoWrapped, SpotifyWrap
+
+
+def percentile(values, fraction):
+    """
+    Returns the given percentile of the values, interpolating between the closest ranks.
+
+    Args:
+        values (list): The measured values.
+        fraction (float): The percentile as a fraction, e.g. 0.95.
+
+    Returns:
+        float: The percentile.
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Command(BaseCommand):
+    """
+    Management command that benchmarks the main views offline, against a local fake Spotify API.
+
+    It runs in a throwaway test database and prints p50/p95 latency, Spotify calls and database
+    queries per request for each scenario:
+        python manage.py benchmark_wraps --iterations 50 --latency 80 --output results.json
+        python manage.py benchmark_wraps --iterations 50 --latency 80 --baseline results.json
+
+    Random choices (fake listening histories, injected errors, game questions) are seeded, so two
+    runs with the same options issue the same requests and their results can be compared directly.
+    """
+    help = "Benchmarks the wrap, duo and game views against a local fake Spotify API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20,
+                            help="Measured requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=2,
+                            help="Unmeasured requests per scenario before measuring.")
+        parser.add_argument('--latency', type=float, default=50.0,
+                            help="Milliseconds the fake Spotify API waits before each response.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="Fraction of fake Spotify API requests answered with a 503.")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Seed for every random choice made during the run.")
+        parser.add_argument('--output',
+                            help="Write the results as JSON to this file.")
+        parser.add_argument('--baseline',
+                            help="Compare against results previously written with --output.")
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(WRAP_JOBS_ASYNC=False, SPOTIFY_RATE_LIMIT=1000, SPOTIFY_RATE_BURST=1000):
+                spotify_client.reset_rate_limiters()
+                spotify_client.reset_circuit_breaker()
+                with FakeSpotifyServer(options['latency'] / 1000, options['error_rate'], options['seed']) as server:
+                    results = self.run_scenarios(server, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            spotify_client.reset_rate_limiters()
+            spotify_client.reset_circuit_breaker()
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['scenarios']
+        self.report(results, baseline)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'options': {key: options[key] for key in ('iterations', 'warmup', 'latency', 'error_rate', 'seed')},
+                           'scenarios': results}, f, indent=2)
+
+    def run_scenarios(self, server, options):
+        """
+        Prepares users, wraps and a Duo Wrapped, then measures each scenario in turn.
+
+        Returns:
+            dict: Maps each scenario name to its summary statistics.
+        """
+        random.seed(options['seed'])
+        cache.clear()
+        runs = options['warmup'] + options['iterations']
+
+        # spotify_wrapped gets a new user each time, so every request builds and saves a new wrap
+        clients = []
+        for i in range(runs):
+            user = User.objects.create_user(f'bench{i}', first_name=f'Bench{i}')
+            client = Client()
+            client.force_login(user)
+            session = client.session
+            session['spotify_access_token'] = f'bench-token-{i}'
+            session.save()
+            clients.append(client)
+
+        results = {'spotify_wrapped': self.measure(
+            server, lambda i: clients[i].get(reverse('spotify_wrapped'), {'time_range': 'medium_term'}), options,
+        )}
+
+        wrap = SpotifyWrap.objects.filter(user__username='bench0').defer('wrap_data').first()
+        invitee_wrap = SpotifyWrap.objects.filter(user__username='bench1').first()
+        duo = DuoWrapped.objects.create(
+            inviter=wrap.user, invitee=invitee_wrap.user, is_accepted=True, invitee_wrap_data=invitee_wrap.get_wrap_data(),
+        )
+        owner = clients[0]
+        scenarios = {
+            'display_selected_wrap': lambda i: owner.get(reverse('display_selected_wrap', args=[wrap.id])),
+            'view_duo_wrapped': lambda i: owner.get(reverse('view_duo_wrapped', args=[duo.id])),
+            'song_questions': lambda i: owner.get(reverse('song_questions'), {'wrap_id': wrap.id, 'count': 5}),
+            'validate_song_guess': lambda i: owner.post(
+                reverse('validate_song_guess'), json.dumps({'user_guess': 'song', 'correct_name': 'Song'}),
+                content_type='application/json',
+            ),
+        }
+        for name, scenario in scenarios.items():
+            results[name] = self.measure(server, scenario, options)
+        return results
+
+    def measure(self, server, scenario, options):
+        """
+        Runs one scenario, discarding the warm-up requests, and summarizes the measured ones.
+
+        Returns:
+            dict: p50/p95/mean latency in milliseconds, mean Spotify calls and database queries per
+            request, and the number of error responses.
+        """
+        latencies, spotify_calls, queries, errors = [], [], [], 0
+        for i in range(options['warmup'] + options['iterations']):
+            calls_before = server.total_requests()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = scenario(i)
+                elapsed = time.perf_counter() - started
+            if i < options['warmup']:
+                continue
+            latencies.append(elapsed * 1000)
+            spotify_calls.append(server.total_requests() - calls_before)
+            queries.append(len(captured))
+            errors += response.status_code >= 400
+
+        return {
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'mean_ms': round(statistics.fmean(latencies), 2),
+            'spotify_calls': round(statistics.fmean(spotify_calls), 2),
+            'db_queries': round(statistics.fmean(queries), 2),
+            'errors': errors,
+        }
+
+    def report(self, results, baseline=None):
+        columns = ('p50_ms', 'p95_ms', 'mean_ms', 'spotify_calls', 'db_queries', 'errors')
+        self.stdout.write(f"{'scenario':<24}" + ''.join(f'{column:>16}' for column in columns))
+        for name, result in results.items():
+            cells = []
+            for column in columns:
+                cell = f'{result[column]:g}'
+                previous = (baseline or {}).get(name, {}).get(column)
+                if previous:
+                    cell += f' ({(result[column] - previous) / previous:+.0%})'
+                cells.append(f'{cell:>16}')
+            self.stdout.write(f'{name:<24}' + ''.join(cells))
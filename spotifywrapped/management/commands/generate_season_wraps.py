@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from spotifywrapped import spotify_client
+from spotifywrapped.fake_spotify import FakeSpotifyServer
+from spotifywrapped.jobs import enqueue_wrap_job, fail_abandoned_job, run_wrap_job, wait_for_job
+from spotifywrapped.metrics import spotify_requests
+from spotifywrapped.models import WrapJob
+from spotifywrapped.spotify_data import TIME_RANGES
+from spotifywrapped.tokens import get_access_token
+
+# Checkpoint outcomes; users recorded with a final outcome are skipped when the run is resumed.
+# 'started' is recorded, with the job's ID, when the run begins a generation of its own
+OUTCOME_STARTED = 'started'
+OUTCOME_DONE = 'done'
+OUTCOME_FAILED = 'failed'
+OUTCOME_UNAUTHORIZED = 'unauthorized'
+FINAL_OUTCOMES = (OUTCOME_DONE, OUTCOME_UNAUTHORIZED)
+
+
+def read_checkpoint(path):
+    """
+    Reads the outcome recorded for each user by a previous run. Later lines win, so a user who
+    failed and then succeeded on a resumed run counts as done.
+
+    Args:
+        path (str): The checkpoint file.
+
+    Returns:
+        tuple: A dictionary mapping user IDs to their last recorded outcome (empty if the file does
+        not exist), and the IDs of the jobs the previous run started but never finished.
+    """
+    outcomes, started = {}, {}
+    if not os.path.exists(path):
+        return outcomes, []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.split()
+            # A crash can leave a half-written last line behind
+            if len(fields) not in (2, 3) or not all(field.isdigit() for field in fields[::2]):
+                continue
+            user_id = int(fields[0])
+            outcomes[user_id] = fields[1]
+            if fields[1] == OUTCOME_STARTED and len(fields) == 3:
+                started[user_id] = int(fields[2])
+    return outcomes, [job_id for user_id, job_id in started.items() if outcomes[user_id] == OUTCOME_STARTED]
+
+
+class Checkpoint:
+    """
+    Append-only record of finished users, written one line per user and flushed to disk right
+    away, so a crashed run loses at most the users that were in flight.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, user_id, outcome, job_id=None):
+        with self._lock:
+            self._file.write(f"{user_id} {outcome}{f' {job_id}' if job_id is not None else ''}\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class Command(BaseCommand):
+    """
+    Management command that pre-generates wraps for every user with stored Spotify credentials,
+    e.g. ahead of the year-end launch:
+        python manage.py generate_season_wraps --workers 8 --rate 20
+        python manage.py generate_season_wraps --fake-spotify --latency 80
+
+    Users are processed by a pool of threads that share the process's Spotify rate limiter, so
+    --rate caps the whole run rather than each thread. Every finished user is appended to the
+    checkpoint file; running the command again resumes where it stopped, retrying failed users.
+    Generations go through the wrap job queue, so a user generating their wrap on the site at the
+    same time shares that job instead of fetching twice. The jobs a crashed run left active are
+    failed when it is resumed, so they do not hold up their users.
+    """
+    help = "Generates and saves wraps for every user with stored Spotify credentials."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--time-range', default=WrapJob.TIME_RANGE_ALL,
+                            choices=(*TIME_RANGES, WrapJob.TIME_RANGE_ALL),
+                            help="Time range to generate; 'all' builds every range in one batch per user.")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Users processed concurrently.")
+        parser.add_argument('--rate', type=float,
+                            help="Spotify requests per second for the whole run, on top of what other processes "
+                                 "send. Defaults to settings.SPOTIFY_RATE_LIMIT.")
+        parser.add_argument('--max-retry-wait', type=float, default=120.0,
+                            help="Seconds each Spotify request may wait for the rate budget and between retries.")
+        parser.add_argument('--checkpoint', default='season_wraps.checkpoint',
+                            help="File recording finished users, used to resume an interrupted run.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore an existing checkpoint and process every user again.")
+        parser.add_argument('--limit', type=int,
+                            help="Process at most this many users, e.g. for a trial run.")
+        parser.add_argument('--report-every', type=float, default=10.0,
+                            help="Seconds between progress reports.")
+        parser.add_argument('--fake-spotify', action='store_true',
+                            help="Run against a local fake Spotify API instead of the real one.")
+        parser.add_argument('--latency', type=float, default=50.0,
+                            help="With --fake-spotify, milliseconds the fake API waits before each response.")
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help="With --fake-spotify, fraction of requests answered with a 503.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+        if options['restart'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+        outcomes, interrupted_jobs = read_checkpoint(options['checkpoint'])
+        if interrupted_jobs:
+            # The previous run crashed while running these; nobody will finish them
+            abandoned = WrapJob.objects.filter(id__in=interrupted_jobs, status__in=WrapJob.ACTIVE_STATUSES)
+            failed = sum(fail_abandoned_job(job) for job in abandoned)
+            self.stdout.write(f"Failed {failed} jobs left active by the previous run.")
+        users = User.objects.filter(spotify_token__isnull=False).exclude(
+            id__in=[user_id for user_id, outcome in outcomes.items() if outcome in FINAL_OUTCOMES],
+        ).order_by('id')
+        if options['limit']:
+            users = users[:options['limit']]
+        users = list(users)
+        self.stdout.write(f"{len(users)} users to process ({len(outcomes)} already in the checkpoint).")
+        if not users:
+            return
+
+        # Offline runs favour finishing over latency: each request waits up to --max-retry-wait for the
+        # shared rate budget, and the top items fetch waits for requests that use all of it
+        rate = options['rate'] or getattr(settings, 'SPOTIFY_RATE_LIMIT', 10)
+        attempts = getattr(settings, 'SPOTIFY_MAX_RETRIES', 3) + 1
+        options['deadline'] = options['max_retry_wait'] + attempts * getattr(settings, 'SPOTIFY_REQUEST_TIMEOUT', 5)
+        checkpoint = Checkpoint(options['checkpoint'])
+        try:
+            spotify_client.configure_rate_limiter(rate, capacity=max(rate, 1))
+            if options['fake_spotify']:
+                with FakeSpotifyServer(options['latency'] / 1000, options['error_rate']):
+                    totals = self.process(users, checkpoint, options)
+            else:
+                totals = self.process(users, checkpoint, options)
+        finally:
+            checkpoint.close()
+            spotify_client.reset_rate_limiters()
+
+        self.report(totals, final=True)
+
+    def process(self, users, checkpoint, options):
+        """
+        Generates the users' wraps on a thread pool, recording each outcome in the checkpoint.
+
+        Returns:
+            dict: The run's totals, as passed to report().
+        """
+        totals = {
+            'total': len(users),
+            'processed': 0,
+            'outcomes': dict.fromkeys((OUTCOME_DONE, OUTCOME_FAILED, OUTCOME_UNAUTHORIZED), 0),
+            'started': time.monotonic(),
+            'spotify_requests': spotify_requests.total(),
+        }
+        breaker = spotify_client.get_circuit_breaker()
+        pending = set()
+        next_report = time.monotonic() + options['report_every']
+        remaining = iter(users)
+
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='season-wraps') as executor:
+            while True:
+                while len(pending) < options['workers']:
+                    # While Spotify is down every generation would fail fast; hold off until it recovers
+                    while breaker.is_open():
+                        time.sleep(1)
+                    user = next(remaining, None)
+                    if user is None:
+                        break
+                    pending.add(executor.submit(self.generate, user, checkpoint, options))
+                if not pending:
+                    break
+
+                done, pending = wait(pending, timeout=options['report_every'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    user, outcome, reason = future.result()
+                    checkpoint.record(user.id, outcome)
+                    totals['outcomes'][outcome] += 1
+                    totals['processed'] += 1
+                    if outcome == OUTCOME_FAILED:
+                        self.stderr.write(f"Wrap for {user.username} failed: {reason}")
+                if time.monotonic() >= next_report:
+                    self.report(totals)
+                    next_report = time.monotonic() + options['report_every']
+        return totals
+
+    def generate(self, user, checkpoint, options):
+        """
+        Generates one user's wrap on a pool thread. A job this run leads is recorded in the checkpoint
+        before it starts, so a resumed run can fail it if this one crashes.
+
+        Returns:
+            tuple: The user, the outcome to record in the checkpoint, and the reason for a failure.
+        """
+        try:
+            access_token = get_access_token(user)
+            if access_token is None:
+                # The user revoked access or never finished authorizing; they have to connect again
+                return user, OUTCOME_UNAUTHORIZED, ''
+
+            job, created = enqueue_wrap_job(user, options['time_range'], access_token)
+            if created:
+                checkpoint.record(user.id, OUTCOME_STARTED, job.id)
+                run_wrap_job(job, max_retry_wait=options['max_retry_wait'], deadline=options['deadline'])
+            elif not wait_for_job(job):
+                return user, OUTCOME_FAILED, "Timed out waiting for a generation already in progress."
+            if job.status != WrapJob.STATUS_DONE:
+                return user, OUTCOME_FAILED, job.message
+            return user, OUTCOME_DONE, ''
+        except Exception as exc:
+            return user, OUTCOME_FAILED, str(exc)
+        finally:
+            connections.close_all()
+
+    def report(self, totals, final=False):
+        elapsed = time.monotonic() - totals['started']
+        calls = spotify_requests.total() - totals['spotify_requests']
+        outcomes = ', '.join(f"{count} {outcome}" for outcome, count in totals['outcomes'].items())
+        self.stdout.write(
+            f"{'Finished' if final else 'Progress'}: {totals['processed']}/{totals['total']} users ({outcomes}) "
+            f"in {elapsed:.1f}s, {totals['processed'] / elapsed * 60 if elapsed else 0:.1f} users/min, "
+            f"{calls / elapsed if elapsed else 0:.1f} Spotify requests/s"
+        )
@@ -0,0 +1,48 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from spotifywrapped.history import ingest_recently_played
+from spotifywrapped.tokens import get_access_token
+
+
+class Command(BaseCommand):
+    """
+    Management command that keeps every connected user's listening history up to date.
+
+    Spotify only remembers a user's last 50 plays, so run it often enough that nobody plays more
+    than that between two polls, e.g. every half hour:
+        python manage.py poll_listening_history --interval 1800
+    Each poll only transfers the plays made since the previous one.
+    """
+    help = "Ingests new plays from the Spotify recently played history of every connected user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1800.0,
+                            help="Seconds between polls.")
+        parser.add_argument('--once', action='store_true',
+                            help="Poll every user once and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            self.poll()
+            if options['once']:
+                return
+            time.sleep(max(options['interval'] - (time.monotonic() - started), 0))
+
+    def poll(self):
+        """
+        Ingests the new plays of every user with stored Spotify credentials.
+        """
+        users, plays, failed = 0, 0, 0
+        for user in User.objects.filter(spotify_token__isnull=False).order_by('id'):
+            access_token = get_access_token(user)
+            new_plays = ingest_recently_played(user, access_token) if access_token else None
+            if new_plays is None:
+                failed += 1
+                continue
+            users += 1
+            plays += new_plays
+        self.stdout.write(f"Ingested {plays} new plays for {users} users ({failed} could not be polled).")
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from spotifywrapped.jobs import claim_next_job, run_wrap_job
+
+
+class Command(BaseCommand):
+    """
+    Management command that works the queue of wrap generation jobs.
+
+    Run one or more of these processes alongside the web server:
+        python manage.py run_wrap_worker
+    """
+    help = "Processes queued Spotify wrap generation jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit as soon as the queue is empty instead of polling.")
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            try:
+                run_wrap_job(job)
+            except Exception as exc:
+                self.stderr.write(f"Wrap job {job.id} failed: {exc}")
+            else:
+                self.stdout.write(f"Wrap job {job.id} for {job.user.username}: {job.status}")
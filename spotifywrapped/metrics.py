@@ -0,0 +1,195 @@
+import bisect
+import threading
+
+# Upper bounds, in seconds, of the view latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing count, kept separately for each combination of label values.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): The description shown in the exposition output.
+        labels (tuple): The label names.
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Adds to the count for the given label values.
+
+        Args:
+            amount (int, optional): How much to add. Defaults to 1.
+            **labels: A value for each of the counter's labels.
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """
+        Returns the current count for the given label values.
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def total(self):
+        """
+        Returns the count summed over every combination of label values.
+        """
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}' for key, value in values]
+
+
+class Histogram:
+    """
+    Counts observations into cumulative buckets, kept separately for each combination of label values.
+
+    Attributes:
+        name (str): The metric name.
+        help (str): The description shown in the exposition output.
+        labels (tuple): The label names.
+        buckets (tuple): The sorted bucket upper bounds.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Records one observation for the given label values.
+
+        Args:
+            value (float): The observed value, e.g. a duration in seconds.
+            **labels: A value for each of the histogram's labels.
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        lines = []
+        bucket_labels = (*self.labels, 'le')
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_labels, (*key, le))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    A set of metrics rendered together in the Prometheus text exposition format.
+
+    Every metric guards its own values with a lock, so it can be updated from any thread of a
+    multi-threaded worker. Values live in process memory: each worker process reports its own.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+view_latency = registry.register(Histogram(
+    'spotifywrapped_view_latency_seconds',
+    'Time spent serving a request, by view.',
+    labels=('view',),
+))
+spotify_requests = registry.register(Counter(
+    'spotifywrapped_spotify_requests_total',
+    'HTTP requests to Spotify, retries included, by endpoint and response status '
+    '(error: no response, breaker_open: rejected by the circuit breaker).',
+    labels=('endpoint', 'status'),
+))
+breaker_trips = registry.register(Counter(
+    'spotifywrapped_spotify_breaker_trips_total',
+    'Times the Spotify circuit breaker opened.',
+))
+cache_requests = registry.register(Counter(
+    'spotifywrapped_cache_requests_total',
+    'Cache lookups, by cache and result (hit or miss).',
+    labels=('cache', 'result'),
+))
+wraps_saved = registry.register(Counter(
+    'spotifywrapped_wraps_saved_total',
+    'Generated wraps, by outcome (created, or reused from an identical recent wrap).',
+    labels=('outcome',),
+))
+
+
+def record_cache_lookup(cache_name, hit):
+    """
+    Counts one cache lookup as a hit or a miss.
+
+    Args:
+        cache_name (str): Which cache was consulted, e.g. 'wrap_deck' or 'audio_features'.
+        hit (bool): Whether the value was found.
+    """
+    cache_requests.inc(cache=cache_name, result='hit' if hit else 'miss')
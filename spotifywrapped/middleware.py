@@ -0,0 +1,150 @@
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .instrumentation import finish_request_metrics, start_request_metrics
+from .metrics import view_latency
+from .profiling import StackSampler, profile_filename, rotate_profiles, write_folded
+
+logger = logging.getLogger('spotifywrapped.performance')
+
+
+def server_timing_header(metrics, total):
+    """
+    Formats request metrics as a Server-Timing header value.
+
+    Args:
+        metrics (RequestMetrics): The metrics collected for the request.
+        total (float): The request's total duration in seconds.
+
+    Returns:
+        str: The header value, with durations in milliseconds.
+    """
+    entries = [
+        f'spotify;dur={metrics.spotify_time * 1000:.1f};desc="{metrics.spotify_calls} calls"',
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.db_queries} queries"',
+    ]
+    entries += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in sorted(metrics.phases.items())]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    Records per-phase timings, Spotify call counts and database query counts for each request,
+    returns them in a Server-Timing header and logs one structured line per request. The request's
+    duration is also added to the view latency histogram served by the metrics view.
+
+    The header is only added when settings.SERVER_TIMING_ENABLED is True; the log line is always written.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics, token = start_request_metrics()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.db_wrapper))
+                response = self.get_response(request)
+        finally:
+            finish_request_metrics(token)
+        total = metrics.elapsed()
+        if request.resolver_match is not None and request.resolver_match.url_name:
+            view_latency.observe(total, view=request.resolver_match.url_name)
+
+        if getattr(settings, 'SERVER_TIMING_ENABLED', True):
+            response['Server-Timing'] = server_timing_header(metrics, total)
+
+        fields = [
+            f'method={request.method}',
+            f'path={request.path}',
+            f'status={response.status_code}',
+            f'total_ms={total * 1000:.1f}',
+            f'spotify_calls={metrics.spotify_calls}',
+            f'spotify_ms={metrics.spotify_time * 1000:.1f}',
+            f'db_queries={metrics.db_queries}',
+            f'db_ms={metrics.db_time * 1000:.1f}',
+        ]
+        fields += [f'{name}_ms={seconds * 1000:.1f}' for name, seconds in sorted(metrics.phases.items())]
+        logger.info('request %s', ' '.join(fields))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in production profiler, enabled with settings.PROFILING_ENABLED.
+
+    A random PROFILING_SAMPLE_RATE fraction of requests runs under cProfile and is saved as a .prof
+    file. Every other request is watched by a shared stack sampler taking a sample every
+    PROFILING_SAMPLE_INTERVAL seconds; when the request takes longer than PROFILING_SLOW_THRESHOLD
+    seconds, its samples are saved as a .folded file in the collapsed-stack format flame graph tools read.
+    Only the request's own thread is profiled, not the Spotify fetch pool.
+
+    Profiles are written to PROFILING_DIR, named after the time, the view and the request's duration,
+    and only the newest PROFILING_MAX_FILES are kept.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.01)
+        self.slow_threshold = getattr(settings, 'PROFILING_SLOW_THRESHOLD', 2.0)
+        self.directory = str(getattr(settings, 'PROFILING_DIR', 'profiles'))
+        self.max_files = getattr(settings, 'PROFILING_MAX_FILES', 200)
+        self.sampler = StackSampler(getattr(settings, 'PROFILING_SAMPLE_INTERVAL', 0.005))
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, request):
+        if random.random() < self.sample_rate:
+            return self.profile_request(request)
+        if self.slow_threshold is not None:
+            return self.sample_request(request)
+        return self.get_response(request)
+
+    def profile_request(self, request):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        profiler.dump_stats(self.filename(request, time.perf_counter() - started, 'prof'))
+        rotate_profiles(self.directory, self.max_files)
+        return response
+
+    def sample_request(self, request):
+        ident = threading.get_ident()
+        samples = self.sampler.track(ident)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.sampler.untrack(ident)
+        elapsed = time.perf_counter() - started
+
+        if elapsed >= self.slow_threshold and samples:
+            write_folded(self.filename(request, elapsed, 'folded'), samples)
+            rotate_profiles(self.directory, self.max_files)
+        return response
+
+    def filename(self, request, elapsed, extension):
+        match = request.resolver_match
+        view_name = match.url_name if match is not None and match.url_name else 'unresolved'
+        return profile_filename(self.directory, view_name, elapsed, extension)
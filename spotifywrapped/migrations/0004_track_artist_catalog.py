@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0003_spotifywrap_time_range_wrapjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('genre', models.CharField(blank=True, max_length=100, null=True)),
+                ('image_url', models.URLField(blank=True, max_length=500, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('artist', models.CharField(max_length=255)),
+                ('image_url', models.URLField(blank=True, max_length=500, null=True)),
+                ('preview_url', models.URLField(blank=True, max_length=500, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WrapArtist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(max_length=30)),
+                ('position', models.PositiveSmallIntegerField()),
+                ('popularity', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='spotifywrapped.artist')),
+                ('wrap', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='artist_entries', to='spotifywrapped.spotifywrap')),
+            ],
+            options={
+                'ordering': ['section', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('wrap', 'section', 'position'), name='unique_wrap_artist_position')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WrapTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(max_length=30)),
+                ('position', models.PositiveSmallIntegerField()),
+                ('popularity', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='spotifywrapped.track')),
+                ('wrap', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_entries', to='spotifywrapped.spotifywrap')),
+            ],
+            options={
+                'ordering': ['section', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('wrap', 'section', 'position'), name='unique_wrap_track_position')],
+            },
+        ),
+    ]
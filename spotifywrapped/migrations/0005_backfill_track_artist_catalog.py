@@ -0,0 +1,119 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:43
+
+import hashlib
+
+from django.db import migrations
+
+TRACK_SECTIONS = {'top_tracks': True, 'tracks_game': True, 'least_popular_song': False, 'most_popular_song': False}
+ARTIST_SECTIONS = {'top_artists': True, 'least_popular_artist': False, 'most_popular_artist': False}
+TRACK_KEY_FIELDS = ('name', 'artist', 'image_url')
+TRACK_FIELDS = ('name', 'artist', 'image_url', 'preview_url')
+ARTIST_KEY_FIELDS = ('name', 'genre', 'image_url')
+ARTIST_FIELDS = ('name', 'genre', 'image_url')
+
+
+def catalog_key(item, fields):
+    """
+    Mirrors spotifywrapped.models.catalog_key as of this migration.
+    """
+    if item.get('id'):
+        return item['id']
+    digest = hashlib.sha1("|".join(str(item.get(field)) for field in fields).encode()).hexdigest()
+    return f"legacy-{digest[:24]}"
+
+
+def section_items(wrap_data, section):
+    value = wrap_data.get(section)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def backfill_catalog(apps, schema_editor):
+    """
+    Moves the tracks and artists of every saved wrap out of its JSON and into the shared catalog,
+    replacing them with ordered references.
+    """
+    SpotifyWrap = apps.get_model('spotifywrapped', 'SpotifyWrap')
+    Track = apps.get_model('spotifywrapped', 'Track')
+    Artist = apps.get_model('spotifywrapped', 'Artist')
+    WrapTrack = apps.get_model('spotifywrapped', 'WrapTrack')
+    WrapArtist = apps.get_model('spotifywrapped', 'WrapArtist')
+
+    kinds = (
+        (TRACK_SECTIONS, Track, TRACK_KEY_FIELDS, TRACK_FIELDS, WrapTrack, 'track'),
+        (ARTIST_SECTIONS, Artist, ARTIST_KEY_FIELDS, ARTIST_FIELDS, WrapArtist, 'artist'),
+    )
+    for wrap in SpotifyWrap.objects.iterator():
+        wrap_data = wrap.wrap_data or {}
+        if not any(section in wrap_data for section in {**TRACK_SECTIONS, **ARTIST_SECTIONS}):
+            continue
+
+        for sections, catalog_model, key_fields, fields, entry_model, fk_name in kinds:
+            entries = []
+            for section in sections:
+                for position, item in enumerate(section_items(wrap_data, section)):
+                    key = catalog_key(item, key_fields)
+                    catalog_item, _ = catalog_model.objects.get_or_create(
+                        spotify_id=key,
+                        defaults={field: item.get(field) for field in fields},
+                    )
+                    # Fill in details missing from an earlier, sparser copy (e.g. a game track without a preview)
+                    missing = {field: item[field] for field in fields if item.get(field) and not getattr(catalog_item, field)}
+                    if missing:
+                        catalog_model.objects.filter(id=catalog_item.id).update(**missing)
+                    entries.append(entry_model(
+                        wrap_id=wrap.id,
+                        section=section,
+                        position=position,
+                        popularity=item.get('popularity'),
+                        **{f"{fk_name}_id": catalog_item.id},
+                    ))
+            entry_model.objects.bulk_create(entries)
+
+        wrap.wrap_data = {
+            key: value for key, value in wrap_data.items()
+            if key not in TRACK_SECTIONS and key not in ARTIST_SECTIONS
+        }
+        wrap.save(update_fields=['wrap_data'])
+
+
+def restore_json(apps, schema_editor):
+    """
+    Copies the referenced tracks and artists back into each wrap's JSON and drops the references,
+    so the backfill can run again.
+    """
+    SpotifyWrap = apps.get_model('spotifywrapped', 'SpotifyWrap')
+    WrapTrack = apps.get_model('spotifywrapped', 'WrapTrack')
+    WrapArtist = apps.get_model('spotifywrapped', 'WrapArtist')
+
+    for wrap in SpotifyWrap.objects.iterator():
+        wrap_data = dict(wrap.wrap_data or {})
+        for sections, entry_model, fk_name, fields in (
+            (TRACK_SECTIONS, WrapTrack, 'track', TRACK_FIELDS),
+            (ARTIST_SECTIONS, WrapArtist, 'artist', ARTIST_FIELDS),
+        ):
+            for section, many in sections.items():
+                items = []
+                for entry in entry_model.objects.filter(wrap_id=wrap.id, section=section).select_related(fk_name).order_by('position'):
+                    catalog_item = getattr(entry, fk_name)
+                    item = {'id': catalog_item.spotify_id, **{field: getattr(catalog_item, field) for field in fields}}
+                    if entry.popularity is not None:
+                        item['popularity'] = entry.popularity
+                    items.append(item)
+                wrap_data[section] = items if many else (items[0] if items else None)
+        wrap.wrap_data = wrap_data
+        wrap.save(update_fields=['wrap_data'])
+    WrapTrack.objects.all().delete()
+    WrapArtist.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0004_track_artist_catalog'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_catalog, restore_json),
+    ]
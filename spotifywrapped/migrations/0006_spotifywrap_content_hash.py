@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0005_backfill_track_artist_catalog'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='spotifywrap',
+            index=models.Index(fields=['user', 'content_hash'], name='wrap_user_content_hash_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+def backfill_summaries(apps, schema_editor):
+    """
+    Fills the summary columns of existing wraps from their first top track and top artist.
+    """
+    SpotifyWrap = apps.get_model('spotifywrapped', 'SpotifyWrap')
+    WrapTrack = apps.get_model('spotifywrapped', 'WrapTrack')
+    WrapArtist = apps.get_model('spotifywrapped', 'WrapArtist')
+
+    top_tracks = {
+        entry.wrap_id: entry.track
+        for entry in WrapTrack.objects.filter(section='top_tracks', position=0).select_related('track')
+    }
+    top_artists = {
+        entry.wrap_id: entry.artist
+        for entry in WrapArtist.objects.filter(section='top_artists', position=0).select_related('artist')
+    }
+    for wrap in SpotifyWrap.objects.only('id').iterator():
+        track = top_tracks.get(wrap.id)
+        artist = top_artists.get(wrap.id)
+        SpotifyWrap.objects.filter(id=wrap.id).update(
+            top_track_name=track.name if track else '',
+            top_artist_name=artist.name if artist else '',
+            cover_url=track.image_url if track else None,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0006_spotifywrap_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='cover_url',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='top_artist_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='spotifywrap',
+            name='top_track_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0007_spotifywrap_summary_fields'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='duowrapped',
+            index=models.Index(fields=['invitee', 'is_accepted'], name='duo_invitee_accepted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='duowrapped',
+            index=models.Index(fields=['inviter', 'invitee', 'is_accepted'], name='duo_pair_accepted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='spotifywrap',
+            index=models.Index(fields=['user', '-created_at'], name='wrap_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    """
+    Marks all but the newest pending or running job of each user and time range as failed,
+    so the constraint can be added.
+    """
+    WrapJob = apps.get_model('spotifywrapped', 'WrapJob')
+    seen = set()
+    for job in WrapJob.objects.filter(status__in=['pending', 'running']).order_by('-created_at', '-id'):
+        key = (job.user_id, job.time_range)
+        if key in seen:
+            WrapJob.objects.filter(id=job.id).update(
+                status='failed', access_token='', message="Superseded by a newer generation.",
+            )
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0009_spotifytoken'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='wrapjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('user', 'time_range'), name='wrapjob_one_active_per_range'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0011_listeningevent_listeningcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spotifytoken',
+            name='refreshing_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
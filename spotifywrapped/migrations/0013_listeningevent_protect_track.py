@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0012_spotifytoken_refreshing_since'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listeningevent',
+            name='track',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='spotifywrapped.track'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:00
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_previews_to_entries(apps, schema_editor):
+    """
+    Gives every wrap's track entries the preview URL of their catalog track, the best record left of
+    the preview each wrap was created with, and clears the display placeholder that the most popular
+    artist used to write into the shared catalog.
+    """
+    Track = apps.get_model('spotifywrapped', 'Track')
+    WrapTrack = apps.get_model('spotifywrapped', 'WrapTrack')
+    Artist = apps.get_model('spotifywrapped', 'Artist')
+
+    WrapTrack.objects.update(
+        preview_url=Subquery(Track.objects.filter(id=OuterRef('track_id')).values('preview_url')[:1]),
+    )
+    Artist.objects.filter(genre="Unknown Genre").update(genre=None)
+
+
+def copy_previews_to_catalog(apps, schema_editor):
+    """
+    Gives every catalog track the preview URL of its most recent wrap entry that has one.
+    """
+    Track = apps.get_model('spotifywrapped', 'Track')
+    WrapTrack = apps.get_model('spotifywrapped', 'WrapTrack')
+
+    Track.objects.update(
+        preview_url=Subquery(
+            WrapTrack.objects.filter(track_id=OuterRef('id'), preview_url__isnull=False)
+            .order_by('-wrap__created_at').values('preview_url')[:1]
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotifywrapped', '0013_listeningevent_protect_track'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wraptrack',
+            name='preview_url',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.RunPython(copy_previews_to_entries, copy_previews_to_catalog),
+        migrations.RemoveField(
+            model_name='track',
+            name='preview_url',
+        ),
+    ]
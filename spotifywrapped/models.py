@@ -1,5 +1,268 @@
-from django.db import models
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .catalog_cache import catalog_cache
+from .metrics import record_cache_lookup
+
+# Wrap data sections holding tracks and artists, and whether each holds a single item or an ordered list
+TRACK_SECTIONS = {'top_tracks': True, 'tracks_game': True, 'least_popular_song': False, 'most_popular_song': False}
+ARTIST_SECTIONS = {'top_artists': True, 'least_popular_artist': False, 'most_popular_artist': False}
+
+
+def catalog_key(item, fields):
+    """
+    Returns the catalog key of a track or artist dictionary: its Spotify ID, or for entries saved
+    without one, a stable hash of its descriptive fields.
+
+    Args:
+        item (dict): The track or artist dictionary from wrap data.
+        fields (tuple): The fields hashed when the item has no Spotify ID.
+
+    Returns:
+        str: The catalog key.
+    """
+    if item.get('id'):
+        return item['id']
+    digest = hashlib.sha1("|".join(str(item.get(field)) for field in fields).encode()).hexdigest()
+    return f"legacy-{digest[:24]}"
+
+
+def wrap_content_hash(time_range, wrap_data):
+    """
+    Returns a canonical SHA-256 hash of a wrap's time range and data, identifying identical snapshots.
+
+    Args:
+        time_range (str): The time range of the wrap.
+        wrap_data (dict): The full wrap data.
+
+    Returns:
+        str: The hex digest.
+    """
+    canonical = json.dumps({'time_range': time_range, 'wrap_data': wrap_data}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def upsert_catalog(model, items):
+    """
+    Inserts or refreshes catalog rows for the given items and returns their primary keys by catalog key.
+
+    Rows are looked up in the in-process catalog cache first, then in the database with one query;
+    only items that are new or whose details changed are written. A detail an item lacks never
+    clears one already stored, since every wrap referencing the row shows it. Rows are cached once
+    the surrounding transaction commits, so a rolled back insert is never served from the cache.
+
+    Args:
+        model (Model): The catalog model, Track or Artist.
+        items (list): Track or artist dictionaries, as stored in wrap data.
+
+    Returns:
+        dict: Maps each item's catalog key to the primary key of its row.
+    """
+    rows = {}
+    for item in items:
+        rows[catalog_key(item, model.KEY_FIELDS)] = tuple(item.get(field) for field in model.CATALOG_FIELDS)
+    if not rows:
+        return {}
+
+    label = model._meta.label_lower
+    cached = catalog_cache.get_many((label, key) for key in rows)
+    ids = {}
+    for key, values in rows.items():
+        pk, cached_values = cached.get((label, key), (None, None))
+        hit = cached_values is not None and _merge_catalog_values(values, cached_values) == cached_values
+        record_cache_lookup('catalog', hit)
+        if hit:
+            ids[key] = pk
+
+    missing = [key for key in rows if key not in ids]
+    if not missing:
+        return ids
+    stored = {
+        spotify_id: (pk, tuple(values))
+        for spotify_id, pk, *values in model.objects.filter(spotify_id__in=missing)
+        .values_list('spotify_id', 'id', *model.CATALOG_FIELDS)
+    }
+    for key in missing:
+        if key in stored:
+            rows[key] = _merge_catalog_values(rows[key], stored[key][1])
+    changed = [key for key in missing if key not in stored or stored[key][1] != rows[key]]
+    if changed:
+        model.objects.bulk_create(
+            [model(spotify_id=key, **dict(zip(model.CATALOG_FIELDS, rows[key]))) for key in changed],
+            update_conflicts=True,
+            unique_fields=['spotify_id'],
+            update_fields=list(model.CATALOG_FIELDS),
+        )
+        for spotify_id, pk in model.objects.filter(spotify_id__in=changed).values_list('spotify_id', 'id'):
+            stored[spotify_id] = (pk, rows[spotify_id])
+
+    entries = {(label, key): stored[key] for key in missing}
+    transaction.on_commit(lambda: catalog_cache.set_many(entries))
+    ids.update({key: stored[key][0] for key in missing})
+    return ids
+
+
+def _merge_catalog_values(values, stored):
+    """
+    Returns an item's catalog values with the stored value kept wherever the item has none.
+    """
+    return tuple(stored_value if value is None else value for value, stored_value in zip(values, stored))
+
+
+class Track(models.Model):
+    """
+    Model to store a Spotify track once, shared by every wrap that references it. Catalog rows are
+    shared, so everything that references one protects it from deletion.
+
+    Attributes:
+        spotify_id (CharField): The track's Spotify ID (or a legacy hash for tracks saved without one).
+        name (CharField): The track's name.
+        artist (CharField): The name of the track's main artist.
+        image_url (URLField): The album cover of the track.
+
+    Methods:
+        __str__: Returns the track's name and main artist.
+    """
+    KEY_FIELDS = ('name', 'artist', 'image_url')
+    CATALOG_FIELDS = ('name', 'artist', 'image_url')
+
+    spotify_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    artist = models.CharField(max_length=255)
+    image_url = models.URLField(max_length=500, blank=True, null=True)
+
+    def __str__(self):
+        """
+        Returns a readable string representation of the Track instance.
+        """
+        return f"{self.name} by {self.artist}"
+
+
+class Artist(models.Model):
+    """
+    Model to store a Spotify artist once, shared by every wrap that references it.
+
+    Attributes:
+        spotify_id (CharField): The artist's Spotify ID (or a legacy hash for artists saved without one).
+        name (CharField): The artist's name.
+        genre (CharField): The artist's normalized main genre, if any.
+        image_url (URLField): The artist's image.
+
+    Methods:
+        __str__: Returns the artist's name.
+    """
+    KEY_FIELDS = ('name', 'genre', 'image_url')
+    CATALOG_FIELDS = ('name', 'genre', 'image_url')
+
+    spotify_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    genre = models.CharField(max_length=100, blank=True, null=True)
+    image_url = models.URLField(max_length=500, blank=True, null=True)
+
+    def __str__(self):
+        """
+        Returns a readable string representation of the Artist instance.
+        """
+        return self.name
+
+
+class SpotifyWrapManager(models.Manager):
+    """
+    Manager for SpotifyWrap that stores tracks and artists in the shared catalog rather than in each wrap's JSON.
+    """
+
+    def create_wrap(self, user, time_range, wrap_data):
+        """
+        Saves a wrap, storing its tracks and artists as ordered references to the shared catalog.
+
+        Args:
+            user (User): The wrap's owner.
+            time_range (str): The time range of the wrap.
+            wrap_data (dict): The full wrap data, as built by spotify_data.build_wrap_data.
+
+        Returns:
+            SpotifyWrap: The saved wrap.
+        """
+        compact_data = {key: value for key, value in wrap_data.items() if key not in TRACK_SECTIONS and key not in ARTIST_SECTIONS}
+        entries = {
+            WrapTrack: [(section, item) for section in TRACK_SECTIONS for item in _section_items(wrap_data, section)],
+            WrapArtist: [(section, item) for section in ARTIST_SECTIONS for item in _section_items(wrap_data, section)],
+        }
+
+        top_tracks = wrap_data.get('top_tracks') or []
+        top_artists = wrap_data.get('top_artists') or []
+
+        with transaction.atomic():
+            wrap = self.create(
+                user=user,
+                time_range=time_range,
+                wrap_data=compact_data,
+                content_hash=wrap_content_hash(time_range, wrap_data),
+                top_track_name=top_tracks[0]['name'] if top_tracks else '',
+                top_artist_name=top_artists[0]['name'] if top_artists else '',
+                cover_url=top_tracks[0]['image_url'] if top_tracks else None,
+            )
+            for entry_model, section_items in entries.items():
+                catalog_model = entry_model.catalog_model()
+                ids = upsert_catalog(catalog_model, [item for _, item in section_items])
+                positions = {}
+                rows = []
+                for section, item in section_items:
+                    position = positions[section] = positions.get(section, -1) + 1
+                    rows.append(entry_model(
+                        wrap=wrap,
+                        section=section,
+                        position=position,
+                        **{field: item.get(field) for field in entry_model.SNAPSHOT_FIELDS},
+                        **{f"{catalog_model._meta.model_name}_id": ids[catalog_key(item, catalog_model.KEY_FIELDS)]},
+                    ))
+                entry_model.objects.bulk_create(rows)
+        return wrap
+
+    def get_or_create_wrap(self, user, time_range, wrap_data):
+        """
+        Returns the user's identical wrap saved within settings.WRAP_DEDUP_WINDOW seconds, if any,
+        and otherwise saves a new one. Reloading the wrap page therefore does not pile up duplicate snapshots.
+        A reused wrap is re-dated to now, so lookups of the latest wrap by created_at still find the
+        latest generation.
+
+        Args:
+            user (User): The wrap's owner.
+            time_range (str): The time range of the wrap.
+            wrap_data (dict): The full wrap data, as built by spotify_data.build_wrap_data.
+
+        Returns:
+            tuple: The wrap and a boolean that is True if it was newly created.
+        """
+        window = getattr(settings, 'WRAP_DEDUP_WINDOW', 86400)
+        if window:
+            existing = self.filter(
+                user=user,
+                content_hash=wrap_content_hash(time_range, wrap_data),
+                created_at__gte=timezone.now() - timedelta(seconds=window),
+            ).defer('wrap_data').order_by('-created_at').first()
+            if existing:
+                existing.created_at = timezone.now()
+                self.filter(pk=existing.pk).update(created_at=existing.created_at)
+                return existing, False
+        return self.create_wrap(user, time_range, wrap_data), True
+
+
+def _section_items(wrap_data, section):
+    """
+    Returns the items stored in a wrap data section as a list, whether the section holds a list or a single item.
+    """
+    value = wrap_data.get(section)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
 
 class SpotifyWrap(models.Model):
     """
@@ -10,14 +273,35 @@ class SpotifyWrap(models.Model):
         wrap_data (JSONField): JSON-encoded data containing details of the Spotify wrap (e.g., top songs, artists).
         time_range (CharField): Time range for the wrap (e.g., 'short_term', 'medium_term', 'long_term').
         created_at (DateTimeField): Timestamp when the SpotifyWrap instance was created.
+        content_hash (CharField): Canonical hash of the full wrap data and time range, used to skip duplicate snapshots.
+        top_track_name (CharField): Name of the wrap's top track, shown in the saved-wraps listing.
+        top_artist_name (CharField): Name of the wrap's top artist, shown in the saved-wraps listing.
+        cover_url (URLField): Album cover of the wrap's top track, shown in the saved-wraps listing.
 
     Methods:
         __str__: Returns a string representation of the wrap, including the user, time range, and creation date.
+        deck_cache_key: Returns the cache key of the wrap's rendered slide deck.
+        get_wrap_data: Returns the full wrap data, with tracks and artists expanded from the catalog.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    wrap_data = models.JSONField()  # Store wrap details in JSON format
+    wrap_data = models.JSONField()  # Store wrap details not kept in the track/artist catalog, in JSON format
     time_range = models.CharField(max_length=20, default='medium_term')
     created_at = models.DateTimeField(auto_now_add=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    top_track_name = models.CharField(max_length=255, blank=True)
+    top_artist_name = models.CharField(max_length=255, blank=True)
+    cover_url = models.URLField(max_length=500, blank=True, null=True)
+
+    # Columns needed to list wraps without loading their data
+    SUMMARY_FIELDS = ('id', 'time_range', 'created_at', 'top_track_name', 'top_artist_name', 'cover_url')
+
+    objects = SpotifyWrapManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'content_hash'], name='wrap_user_content_hash_idx'),
+            models.Index(fields=['user', '-created_at'], name='wrap_user_created_idx'),
+        ]
 
     def __str__(self):
         """
@@ -25,6 +309,141 @@ class SpotifyWrap(models.Model):
         """
         return f"Spotify Wrap for {self.user.username} ({self.time_range}) on {self.created_at.strftime('%Y-%m-%d')}"
 
+    @property
+    def deck_cache_key(self):
+        """
+        Returns the cache key of this wrap's rendered slide deck.
+        """
+        return f"wrap-deck:{self.pk}"
+
+    def get_wrap_data(self):
+        """
+        Returns the full wrap data, in the format built by spotify_data.build_wrap_data, with the
+        tracks and artists expanded from the catalog.
+        """
+        wrap_data = dict(self.wrap_data)
+        for section, many in {**TRACK_SECTIONS, **ARTIST_SECTIONS}.items():
+            wrap_data[section] = [] if many else None
+
+        for entry in self.track_entries.select_related('track'):
+            item = entry.as_dict()
+            if TRACK_SECTIONS[entry.section]:
+                wrap_data[entry.section].append(item)
+            else:
+                wrap_data[entry.section] = item
+        for entry in self.artist_entries.select_related('artist'):
+            item = entry.as_dict()
+            if ARTIST_SECTIONS[entry.section]:
+                wrap_data[entry.section].append(item)
+            else:
+                wrap_data[entry.section] = item
+        return wrap_data
+
+
+class WrapTrack(models.Model):
+    """
+    Model to store a wrap's ordered reference to a catalog track.
+
+    Attributes:
+        wrap (ForeignKey): The wrap the reference belongs to.
+        track (ForeignKey): The referenced catalog track.
+        section (CharField): The wrap data section, e.g. 'top_tracks' or 'least_popular_song'.
+        position (PositiveSmallIntegerField): The track's position within the section.
+        popularity (PositiveSmallIntegerField): The track's popularity when the wrap was created, if recorded.
+        preview_url (URLField): The track's audio preview when the wrap was created, if available.
+
+    Methods:
+        as_dict: Returns the track in the format stored in wrap data.
+    """
+    # Details that change over time, kept per wrap so a saved wrap shows them as they were
+    SNAPSHOT_FIELDS = ('popularity', 'preview_url')
+
+    wrap = models.ForeignKey(SpotifyWrap, related_name='track_entries', on_delete=models.CASCADE)
+    track = models.ForeignKey(Track, on_delete=models.PROTECT)
+    section = models.CharField(max_length=30)
+    position = models.PositiveSmallIntegerField()
+    popularity = models.PositiveSmallIntegerField(blank=True, null=True)
+    preview_url = models.URLField(max_length=500, blank=True, null=True)
+
+    class Meta:
+        ordering = ['section', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['wrap', 'section', 'position'], name='unique_wrap_track_position'),
+        ]
+
+    @staticmethod
+    def catalog_model():
+        """
+        Returns the catalog model referenced by this entry model.
+        """
+        return Track
+
+    def as_dict(self):
+        """
+        Returns the referenced track in the format stored in wrap data.
+        """
+        item = {
+            'id': self.track.spotify_id,
+            'name': self.track.name,
+            'artist': self.track.artist,
+            'image_url': self.track.image_url,
+            'preview_url': self.preview_url,
+        }
+        if self.popularity is not None:
+            item['popularity'] = self.popularity
+        return item
+
+
+class WrapArtist(models.Model):
+    """
+    Model to store a wrap's ordered reference to a catalog artist.
+
+    Attributes:
+        wrap (ForeignKey): The wrap the reference belongs to.
+        artist (ForeignKey): The referenced catalog artist.
+        section (CharField): The wrap data section, e.g. 'top_artists' or 'most_popular_artist'.
+        position (PositiveSmallIntegerField): The artist's position within the section.
+        popularity (PositiveSmallIntegerField): The artist's popularity when the wrap was created, if recorded.
+
+    Methods:
+        as_dict: Returns the artist in the format stored in wrap data.
+    """
+    # Details that change over time, kept per wrap so a saved wrap shows them as they were
+    SNAPSHOT_FIELDS = ('popularity',)
+
+    wrap = models.ForeignKey(SpotifyWrap, related_name='artist_entries', on_delete=models.CASCADE)
+    artist = models.ForeignKey(Artist, on_delete=models.PROTECT)
+    section = models.CharField(max_length=30)
+    position = models.PositiveSmallIntegerField()
+    popularity = models.PositiveSmallIntegerField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['section', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['wrap', 'section', 'position'], name='unique_wrap_artist_position'),
+        ]
+
+    @staticmethod
+    def catalog_model():
+        """
+        Returns the catalog model referenced by this entry model.
+        """
+        return Artist
+
+    def as_dict(self):
+        """
+        Returns the referenced artist in the format stored in wrap data.
+        """
+        item = {
+            'id': self.artist.spotify_id,
+            'name': self.artist.name,
+            'genre': self.artist.genre,
+            'image_url': self.artist.image_url,
+        }
+        if self.popularity is not None:
+            item['popularity'] = self.popularity
+        return item
+
 
 class DuoWrapped(models.Model):
     """
@@ -46,8 +465,182 @@ class DuoWrapped(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_accepted = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['invitee', 'is_accepted'], name='duo_invitee_accepted_idx'),
+            models.Index(fields=['inviter', 'invitee', 'is_accepted'], name='duo_pair_accepted_idx'),
+        ]
+
     def __str__(self):
         """
         Returns a readable string representation of the DuoWrapped instance.
         """
         return f"Duo-Wrapped between {self.inviter.username} and {self.invitee.username}"
+
+
+class WrapJob(models.Model):
+    """
+    Model to store a queued Spotify wrap generation, worked by the `run_wrap_worker` management command.
+
+    Attributes:
+        user (ForeignKey): The user the wrap is generated for.
+        time_range (CharField): Time range for the wrap (e.g., 'short_term', 'medium_term', 'long_term'),
+            or 'all' to generate a wrap for every time range at once.
+        access_token (TextField): Spotify access token used by the worker; cleared once the job finishes.
+        status (CharField): One of 'pending', 'running', 'done' or 'failed'.
+        progress (PositiveSmallIntegerField): Completion percentage reported to the status endpoint.
+        message (CharField): Human-readable progress or error message.
+        wrap (ForeignKey): The SpotifyWrap produced by the job, once done; for a job that failed because
+            Spotify was unavailable, the user's latest earlier wrap, shown instead.
+        created_at (DateTimeField): Timestamp when the job was queued.
+        updated_at (DateTimeField): Timestamp of the job's last progress update.
+
+    Only one pending or running job may exist per user and time range; see jobs.enqueue_wrap_job.
+
+    Methods:
+        is_finished: Returns whether the job is done or has failed.
+        __str__: Returns a string representation of the job, including the user, time range, and status.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    TIME_RANGE_ALL = 'all'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    time_range = models.CharField(max_length=20, default='medium_term')
+    access_token = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    wrap = models.ForeignKey(SpotifyWrap, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
+    class Meta:
+        constraints = [
+            # At most one generation in flight per user and time range, across every worker process
+            models.UniqueConstraint(
+                fields=['user', 'time_range'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='wrapjob_one_active_per_range',
+            ),
+        ]
+
+    @property
+    def is_finished(self):
+        """
+        Returns True once the job is done or has failed.
+        """
+        return self.status not in self.ACTIVE_STATUSES
+
+    def __str__(self):
+        """
+        Returns a readable string representation of the WrapJob instance.
+        """
+        return f"Wrap job for {self.user.username} ({self.time_range}): {self.status}"
+
+
+class SpotifyToken(models.Model):
+    """
+    Represents a user's Spotify OAuth credentials, kept so the access token can be refreshed
+    without sending the user through the authorization flow again.
+
+    Attributes:
+        user (OneToOneField): The user the credentials belong to.
+        access_token (TextField): The current Spotify access token.
+        refresh_token (TextField): The refresh token used to obtain new access tokens.
+        scope (CharField): The scopes the user granted.
+        expires_at (DateTimeField): When the access token expires.
+        updated_at (DateTimeField): Timestamp of the last authorization or refresh.
+        refreshing_since (DateTimeField): When the refresh in progress took its lease, if any.
+
+    Methods:
+        expires_within: Returns whether the access token expires within the given number of seconds.
+        __str__: Returns a string representation of the token, including the user and expiry.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='spotify_token')
+    access_token = models.TextField()
+    refresh_token = models.TextField(blank=True)
+    scope = models.CharField(max_length=255, blank=True)
+    expires_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+    refreshing_since = models.DateTimeField(null=True, blank=True)
+
+    def expires_within(self, seconds):
+        """
+        Returns True if the access token expires within the given number of seconds.
+        """
+        return self.expires_at <= timezone.now() + timedelta(seconds=seconds)
+
+    def __str__(self):
+        """
+        Returns a readable string representation of the SpotifyToken instance.
+        """
+        return f"Spotify token for {self.user.username} (expires {self.expires_at:%Y-%m-%d %H:%M})"
+
+
+class ListeningEvent(models.Model):
+    """
+    Represents one play of a track, ingested from the user's Spotify recently played history.
+
+    Attributes:
+        user (ForeignKey): The user who played the track.
+        track (ForeignKey): The track played, from the shared catalog.
+        played_at (DateTimeField): When the play started.
+        duration_ms (PositiveIntegerField): The track's length in milliseconds.
+
+    A user cannot play two tracks at the same instant, so (user, played_at) identifies a play and
+    re-ingesting an overlapping page of history adds nothing.
+
+    Methods:
+        __str__: Returns a string representation of the play, including the user, track and time.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listening_events')
+    track = models.ForeignKey(Track, on_delete=models.PROTECT)
+    played_at = models.DateTimeField()
+    duration_ms = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'played_at'], name='unique_listening_event_play'),
+        ]
+
+    def __str__(self):
+        """
+        Returns a readable string representation of the ListeningEvent instance.
+        """
+        return f"{self.user.username} played {self.track} at {self.played_at:%Y-%m-%d %H:%M}"
+
+
+class ListeningCursor(models.Model):
+    """
+    Remembers how far a user's listening history has been ingested, so each poll of the recently
+    played endpoint only transfers plays that are new since the last one.
+
+    Attributes:
+        user (OneToOneField): The user whose history is ingested.
+        after (BigIntegerField): Spotify's 'after' cursor: the Unix time, in milliseconds, of the
+            latest ingested play. Zero before the first poll.
+        updated_at (DateTimeField): Timestamp of the last poll that found new plays.
+
+    Methods:
+        __str__: Returns a string representation of the cursor, including the user.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='listening_cursor')
+    after = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """
+        Returns a readable string representation of the ListeningCursor instance.
+        """
+        return f"Listening history cursor for {self.user.username}"
@@ -0,0 +1,127 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+def collapse_stack(frame):
+    """
+    Formats a frame's call stack as one line of the collapsed-stack format read by flame graph tools
+    (flamegraph.pl, speedscope): function names from the outermost call inwards, separated by ';'.
+
+    Args:
+        frame (frame): The innermost frame.
+
+    Returns:
+        str: The collapsed stack.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    Low-overhead sampling profiler. A single background thread periodically records the call stack
+    of every thread being tracked, so requests pay nothing beyond registering and unregistering.
+
+    Attributes:
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._tracked = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, ident):
+        """
+        Starts sampling a thread.
+
+        Args:
+            ident (int): The thread's identifier, as returned by threading.get_ident().
+
+        Returns:
+            Counter: Collects how many times each collapsed stack was seen; filled until untrack() is called.
+        """
+        samples = Counter()
+        with self._lock:
+            self._tracked[ident] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        return samples
+
+    def untrack(self, ident):
+        """
+        Stops sampling a thread.
+        """
+        with self._lock:
+            self._tracked.pop(ident, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                tracked = list(self._tracked.items())
+            if not tracked:
+                continue
+            frames = sys._current_frames()
+            for ident, samples in tracked:
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples[collapse_stack(frame)] += 1
+
+
+def profile_filename(directory, view_name, elapsed, extension):
+    """
+    Builds a profile's file name from the time, the view and the request's duration, e.g.
+    '20241018-142501-123456-spotify_wrapped-2315ms.prof'.
+
+    Args:
+        directory (str): The directory profiles are written to.
+        view_name (str): The URL name of the profiled view.
+        elapsed (float): The request's duration in seconds.
+        extension (str): 'prof' for cProfile output, 'folded' for collapsed stacks.
+
+    Returns:
+        str: The full path of the new profile.
+    """
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    view = re.sub(r'[^\w-]', '_', view_name)
+    return os.path.join(directory, f"{stamp}-{view}-{elapsed * 1000:.0f}ms.{extension}")
+
+
+def rotate_profiles(directory, keep):
+    """
+    Deletes the oldest profiles so that at most `keep` remain.
+
+    Args:
+        directory (str): The directory profiles are written to.
+        keep (int): The number of most recent profiles to keep.
+    """
+    profiles = sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and entry.name.endswith(('.prof', '.folded'))
+    )
+    for path in profiles[:max(len(profiles) - keep, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def write_folded(filename, samples):
+    """
+    Writes stack samples in the collapsed-stack format, one 'stack count' line per distinct stack.
+    """
+    with open(filename, 'w', encoding='utf-8') as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
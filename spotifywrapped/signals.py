@@ -0,0 +1,14 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import SpotifyWrap
+
+
+@receiver(post_delete, sender=SpotifyWrap)
+def evict_wrap_deck(sender, instance, **kwargs):
+    """
+    Drops a wrap's rendered slide deck from the cache once the wrap is deleted, whether directly
+    through delete_saved_wrap or by cascade when the owner's account is deleted.
+    """
+    cache.delete(instance.deck_cache_key)
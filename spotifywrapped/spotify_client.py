@@ -0,0 +1,476 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from app_secrets import SPOTIFY_CLIENT_ID
+from .instrumentation import record_spotify_call
+from .metrics import breaker_trips, spotify_requests
+
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+SPOTIFY_ACCOUNTS_URL = "https://accounts.spotify.com"
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Transport modes for Web API requests: 'live' only talks to Spotify, 'record' also saves each response
+# as a fixture, and 'replay' serves saved fixtures without touching the network
+TRANSPORT_LIVE = 'live'
+TRANSPORT_RECORD = 'record'
+TRANSPORT_REPLAY = 'replay'
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how fast this process sends requests to Spotify.
+    Its state is not shared with other processes, which each get their own bucket and full rate.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): Maximum number of tokens, i.e. the allowed burst size.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """
+        Stops handing out tokens for the given number of seconds, e.g. after Spotify answers 429.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def acquire(self, timeout):
+        """
+        Takes one token, waiting for the bucket to refill if needed.
+
+        Args:
+            timeout (float): The longest time, in seconds, the caller is willing to wait.
+
+        Returns:
+            bool: True if a token was taken, False if it would not be available within the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker that stops calls to Spotify while it is failing.
+
+    After `threshold` consecutive failed requests the breaker opens and requests fail immediately,
+    without touching the network. Once `reset_after` seconds have passed, a single trial request is
+    let through (half-open): if it succeeds the breaker closes, otherwise it stays open for another
+    `reset_after` seconds.
+
+    Attributes:
+        threshold (int): Consecutive failures that open the breaker.
+        reset_after (float): Seconds the breaker stays open before a trial request.
+    """
+
+    def __init__(self, threshold, reset_after):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """
+        Returns True while requests are being rejected, i.e. the breaker is open and not yet due a trial.
+        """
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_after
+
+    def allow_request(self):
+        """
+        Returns True if a request may be sent now. In the half-open state only one caller gets True.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_after:
+                return False
+            self._trial_running = True
+            return True
+
+    def release_trial(self):
+        """
+        Gives up a trial request that was allowed but never sent, so another caller can make it.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    breaker_trips.inc()
+                    logger.warning("Spotify circuit breaker opened after %d failures", self._failures)
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_breaker = None
+_breaker_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_rate_limiter(client_id=SPOTIFY_CLIENT_ID):
+    """
+    Returns the token bucket shared by every request this process makes with the given Spotify client ID.
+    Other processes have their own bucket, so settings.SPOTIFY_RATE_LIMIT applies per process.
+
+    Args:
+        client_id (str, optional): The Spotify application's client ID. Defaults to SPOTIFY_CLIENT_ID.
+
+    Returns:
+        TokenBucket: The bucket for that client ID.
+    """
+    with _buckets_lock:
+        if client_id not in _buckets:
+            _buckets[client_id] = TokenBucket(
+                rate=getattr(settings, 'SPOTIFY_RATE_LIMIT', 10),
+                capacity=getattr(settings, 'SPOTIFY_RATE_BURST', 20),
+            )
+        return _buckets[client_id]
+
+
+def get_circuit_breaker():
+    """
+    Returns the process-wide circuit breaker guarding requests to Spotify.
+
+    Returns:
+        CircuitBreaker: The shared breaker.
+    """
+    global _breaker
+    with _breaker_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                threshold=getattr(settings, 'SPOTIFY_BREAKER_THRESHOLD', 5),
+                reset_after=getattr(settings, 'SPOTIFY_BREAKER_RESET_AFTER', 30),
+            )
+        return _breaker
+
+
+def reset_circuit_breaker():
+    """
+    Drops the circuit breaker, so the next request builds a closed one from the current settings.
+    """
+    global _breaker
+    with _breaker_lock:
+        _breaker = None
+
+
+def configure_rate_limiter(rate, capacity, client_id=SPOTIFY_CLIENT_ID):
+    """
+    Replaces the token bucket for the given Spotify client ID with one using the given rate,
+    e.g. for a batch run with its own request budget.
+
+    Args:
+        rate (float): Requests per second.
+        capacity (float): The allowed burst size.
+        client_id (str, optional): The Spotify application's client ID. Defaults to SPOTIFY_CLIENT_ID.
+
+    Returns:
+        TokenBucket: The new bucket.
+    """
+    with _buckets_lock:
+        _buckets[client_id] = TokenBucket(rate=rate, capacity=capacity)
+        return _buckets[client_id]
+
+
+def reset_rate_limiters():
+    """
+    Drops every token bucket, so the next request builds new ones from the current settings.
+    Used by benchmarks that change the rate limit settings.
+    """
+    with _buckets_lock:
+        _buckets.clear()
+
+
+def get_session():
+    """
+    Returns the process-wide requests session, whose connection pool keeps TCP+TLS
+    connections to Spotify alive between requests.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = getattr(settings, 'SPOTIFY_POOL_SIZE', 10)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def _retry_delay(response, attempt):
+    """
+    Computes how long to wait before retrying, honoring Spotify's Retry-After header when present
+    and otherwise backing off exponentially with jitter.
+    """
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                pass
+    backoff = getattr(settings, 'SPOTIFY_BACKOFF_BASE', 0.5) * (2 ** attempt)
+    return backoff + random.uniform(0, backoff / 2)
+
+
+def request(method, url, max_retry_wait=None, until=None, **kwargs):
+    """
+    Sends a request to Spotify through the shared session, retrying rate-limited and transient
+    failures with backoff. The total time spent waiting is bounded by max_retry_wait, so callers
+    get a short, predictable delay rather than an unbounded stall. While the circuit breaker is
+    open, no request is sent at all and None is returned immediately.
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The full URL to request.
+        max_retry_wait (float, optional): Seconds the request may spend waiting for the rate
+            limiter and between retries. Defaults to settings.SPOTIFY_MAX_RETRY_WAIT.
+        until (float, optional): A time.monotonic() value the caller stops waiting at. Waits are cut
+            short and each attempt's timeout shrinks to the time left, and no attempt starts after it.
+            Defaults to None (no limit beyond the timeouts).
+        **kwargs: Extra arguments passed to requests.Session.request.
+
+    Returns:
+        requests.Response or None: The final response, or None if no response could be obtained.
+    """
+    kwargs.setdefault('timeout', getattr(settings, 'SPOTIFY_REQUEST_TIMEOUT', 5))
+    max_retries = getattr(settings, 'SPOTIFY_MAX_RETRIES', 3)
+    wait_budget = max_retry_wait if max_retry_wait is not None else getattr(settings, 'SPOTIFY_MAX_RETRY_WAIT', 10)
+    limiter = get_rate_limiter()
+    session = get_session()
+    endpoint = urlsplit(url).path
+    breaker = get_circuit_breaker()
+    if not breaker.allow_request():
+        spotify_requests.inc(endpoint=endpoint, status='breaker_open')
+        return None
+
+    response = None
+    sent_any = False
+    for attempt in range(max_retries + 1):
+        if until is not None:
+            wait_budget = min(wait_budget, until - time.monotonic())
+        started = time.monotonic()
+        if wait_budget < 0 or not limiter.acquire(timeout=wait_budget):
+            break
+        wait_budget -= time.monotonic() - started
+        if until is not None:
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                break
+            kwargs['timeout'] = min(kwargs['timeout'], remaining)
+
+        sent = time.perf_counter()
+        sent_any = True
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            response = None
+        record_spotify_call(time.perf_counter() - sent)
+        spotify_requests.inc(endpoint=endpoint, status=response.status_code if response is not None else 'error')
+
+        if response is not None and response.status_code not in RETRY_STATUS_CODES:
+            break
+        if attempt == max_retries:
+            break
+
+        delay = _retry_delay(response, attempt)
+        if until is not None:
+            wait_budget = min(wait_budget, until - time.monotonic())
+        if delay > wait_budget:
+            break
+        if response is not None and response.status_code == 429:
+            # Hold back every thread sharing this client ID; the next acquire() waits out the pause
+            limiter.pause(delay)
+        else:
+            time.sleep(delay)
+            wait_budget -= delay
+
+    # Only unreachable or erroring servers count towards opening the breaker, not rate limiting
+    if not sent_any:
+        breaker.release_trial()
+    elif response is None or response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+# Fixture directory for responses that are the same for every user, e.g. /audio-features
+SHARED_FIXTURE_KEY = 'shared'
+
+
+def pseudonymous_user_key(user_id):
+    """
+    Derives a stable key for a user that does not reveal their ID. Unlike their access token, it
+    stays the same across token refreshes, so recordings keep replaying for that user.
+
+    Args:
+        user_id (int): The Django user's ID.
+
+    Returns:
+        str: A short hex digest keyed with the project's SECRET_KEY.
+    """
+    return hmac.new(settings.SECRET_KEY.encode(), str(user_id).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def fixture_path(user_id, path, params=None):
+    """
+    Returns the file a Web API response is recorded to and replayed from. Fixtures are keyed by the
+    pseudonymous user key, the endpoint and the query parameters.
+
+    Args:
+        user_id (int or None): The ID of the user the request is made for, or None if the response
+            does not depend on the user.
+        path (str): The API path, e.g. '/me/top/tracks'.
+        params (dict, optional): Query string parameters. Defaults to None.
+
+    Returns:
+        str: The fixture's path under settings.SPOTIFY_FIXTURE_DIR.
+    """
+    query = json.dumps(params or {}, sort_keys=True, default=str)
+    digest = hashlib.sha256(f"{path}?{query}".encode()).hexdigest()[:16]
+    endpoint = path.strip('/').replace('/', '-') or 'root'
+    return os.path.join(
+        str(getattr(settings, 'SPOTIFY_FIXTURE_DIR', 'spotify_fixtures')),
+        pseudonymous_user_key(user_id) if user_id is not None else SHARED_FIXTURE_KEY,
+        f"{endpoint}-{digest}.json",
+    )
+
+
+def save_fixture(filename, path, params, response):
+    """
+    Writes a response to a fixture file, replacing any previous recording atomically.
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fixture = {
+        'path': path,
+        'params': params or {},
+        'status_code': response.status_code,
+        'headers': {name: response.headers[name] for name in ('Content-Type', 'Retry-After') if name in response.headers},
+        'body': response.text,
+    }
+    temporary = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(fixture, f)
+    os.replace(temporary, filename)
+
+
+def load_fixture(filename, url):
+    """
+    Builds a response from a fixture file.
+
+    Returns:
+        requests.Response or None: The recorded response, or None if nothing was recorded.
+    """
+    try:
+        with open(filename, encoding='utf-8') as f:
+            fixture = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    response = requests.Response()
+    response.status_code = fixture['status_code']
+    response.headers.update(fixture['headers'])
+    response._content = fixture['body'].encode('utf-8')
+    response.encoding = 'utf-8'
+    response.url = url
+    return response
+
+
+def api_get(access_token, path, params=None, user_id=None, max_retry_wait=None, until=None):
+    """
+    Sends an authenticated GET request to the Spotify Web API.
+
+    Depending on settings.SPOTIFY_TRANSPORT, the response is also recorded as a fixture ('record') or
+    served from a previously recorded fixture without any network I/O ('replay'). A replay with no
+    matching fixture behaves like a request that got no response.
+
+    Args:
+        access_token (str): The Spotify access token to authenticate the API request.
+        path (str): The API path, e.g. '/me/top/tracks'.
+        params (dict, optional): Query string parameters. Defaults to None.
+        user_id (int, optional): The ID of the user the request is made for, which keys its fixture.
+            Defaults to None, for endpoints whose response is the same for every user.
+        max_retry_wait (float, optional): Passed on to request(). Defaults to None.
+        until (float, optional): Passed on to request(). Defaults to None.
+
+    Returns:
+        requests.Response or None: The final response, or None if no response could be obtained.
+    """
+    url = f"{SPOTIFY_API_URL}{path}"
+    mode = getattr(settings, 'SPOTIFY_TRANSPORT', TRANSPORT_LIVE)
+    if mode == TRANSPORT_REPLAY:
+        filename = fixture_path(user_id, path, params)
+        response = load_fixture(filename, url)
+        if response is None:
+            logger.warning("No Spotify fixture recorded for %s (%s)", path, filename)
+        return response
+
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = request('GET', url, headers=headers, params=params, max_retry_wait=max_retry_wait, until=until)
+    if mode == TRANSPORT_RECORD and response is not None:
+        save_fixture(fixture_path(user_id, path, params), path, params, response)
+    return response
+
+
+def accounts_post(path, data):
+    """
+    Sends a form-encoded POST request to the Spotify Accounts service.
+
+    Args:
+        path (str): The Accounts service path, e.g. '/api/token'.
+        data (dict): The form payload.
+
+    Returns:
+        requests.Response or None: The final response, or None if no response could be obtained.
+    """
+    return request('POST', f"{SPOTIFY_ACCOUNTS_URL}{path}", data=data)
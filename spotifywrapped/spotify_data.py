@@ -0,0 +1,466 @@
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core.cache import cache
+from . import spotify_client
+from .instrumentation import phase, run_in_context
+from .metrics import record_cache_lookup
+
+TOP_ITEMS_LIMIT = 50
+TOP_LIST_SIZE = 10
+TIME_RANGES = ('short_term', 'medium_term', 'long_term')
+AUDIO_FEATURES_BATCH_SIZE = 100
+AUDIO_FEATURES = ('danceability', 'energy', 'valence')
+# Overall mood of a set of tracks, by whether their average energy and valence are high
+MOODS = {
+    (True, True): "Euphoric",
+    (True, False): "Intense",
+    (False, True): "Laid-back",
+    (False, False): "Melancholic",
+}
+
+# Shared pool for independent Spotify round-trips, so a page waits for the slowest call rather than their sum
+_fetch_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'SPOTIFY_FETCH_WORKERS', 8),
+    thread_name_prefix='spotify-fetch',
+)
+
+
+def normalize_genre(genre):
+    """
+    Normalizes the genre string to a standard format. If the genre matches common categories,
+    it will be converted to a standard form. Otherwise, it returns a capitalized version of the genre.
+
+    Args:
+        genre (str): The genre to be normalized.
+
+    Returns:
+        str: The normalized genre.
+    """
+    if not genre:
+        return "Unknown Genre"
+    genre_lower = genre.lower()
+    if "hip hop" in genre_lower:
+        return "Hip Hop"
+    elif "r&b" in genre_lower or "rnb" in genre_lower:
+        return "R&B"
+    else:
+        return " ".join(word.capitalize() for word in genre.split())
+
+
+def fetch_top_items(access_token, item_type, time_range, user_id=None, max_retry_wait=None, until=None):
+    """
+    Fetches the user's top tracks or artists from Spotify for the given time range.
+    Always requests the maximum page size so every derived list can share one payload.
+
+    Args:
+        access_token (str): The Spotify access token to authenticate the API request.
+        item_type (str): Either 'tracks' or 'artists'.
+        time_range (str): The time range for fetching the items (e.g., 'short_term', 'medium_term', 'long_term').
+        user_id (int, optional): The ID of the user whose items they are. Defaults to None.
+        max_retry_wait (float, optional): Passed on to spotify_client.request. Defaults to None.
+        until (float, optional): Passed on to spotify_client.request. Defaults to None.
+
+    Returns:
+        list or None: The raw Spotify items, or None if the request fails.
+    """
+    params = {'limit': TOP_ITEMS_LIMIT, 'time_range': time_range}
+    response = spotify_client.api_get(access_token, f"/me/top/{item_type}", params=params, user_id=user_id,
+                                      max_retry_wait=max_retry_wait, until=until)
+    if response is None or response.status_code != 200:
+        return None
+    with phase('parse'):
+        return response.json().get("items", [])
+
+
+def audio_features_cache_key(track_id):
+    """
+    Builds the cache key for one track's audio features. Features describe the recording, not the
+    listener, so the entry is shared by every user.
+
+    Args:
+        track_id (str): The track's Spotify ID.
+
+    Returns:
+        str: The cache key.
+    """
+    return f"spotify:audio-features:{track_id}"
+
+
+def fetch_audio_features(access_token, track_ids, max_retry_wait=None):
+    """
+    Returns the danceability, energy and valence of the given tracks. Features are served from the
+    shared cache when possible; the rest are fetched with the batched /audio-features endpoint, up
+    to AUDIO_FEATURES_BATCH_SIZE tracks per request, and cached for every user.
+
+    Args:
+        access_token (str): The Spotify access token to authenticate the API requests.
+        track_ids (list): The tracks' Spotify IDs.
+        max_retry_wait (float, optional): Passed on to spotify_client.request. Defaults to None.
+
+    Returns:
+        dict: Maps each track ID to its features. Tracks Spotify has no features for, or whose
+        batch failed to load, are left out.
+    """
+    track_ids = [track_id for track_id in dict.fromkeys(track_ids) if track_id]
+    cached = cache.get_many([audio_features_cache_key(track_id) for track_id in track_ids])
+    features, missing = {}, []
+    for track_id in track_ids:
+        entry = cached.get(audio_features_cache_key(track_id))
+        record_cache_lookup('audio_features', entry is not None)
+        if entry is None:
+            missing.append(track_id)
+        elif entry:
+            features[track_id] = entry
+
+    fetched = {}
+    for start in range(0, len(missing), AUDIO_FEATURES_BATCH_SIZE):
+        batch = missing[start:start + AUDIO_FEATURES_BATCH_SIZE]
+        response = spotify_client.api_get(access_token, '/audio-features', params={'ids': ','.join(batch)},
+                                          max_retry_wait=max_retry_wait)
+        if response is None or response.status_code != 200:
+            continue
+        with phase('parse'):
+            items = response.json().get('audio_features') or []
+        # Results come back in request order, with null for tracks that have no features; those are
+        # cached as empty so they are not requested again
+        for track_id, item in zip(batch, items):
+            entry = {name: item[name] for name in AUDIO_FEATURES} if item else {}
+            fetched[audio_features_cache_key(track_id)] = entry
+            if entry:
+                features[track_id] = entry
+    if fetched:
+        cache.set_many(fetched, getattr(settings, 'SPOTIFY_AUDIO_FEATURES_TTL', None))
+    return features
+
+
+def fetch_concurrently(tasks, deadline=None):
+    """
+    Runs independent Spotify fetches in parallel and collects whatever finishes before the deadline.
+    A task that raises or is still running when the deadline passes is reported as None, so one slow
+    endpoint only empties its own slides instead of stalling the whole deck.
+
+    Python threads cannot be interrupted: a task still running at the deadline is abandoned, not
+    cancelled, and its thread carries on in the background. Each task is therefore handed the
+    deadline as a time.monotonic() value to pass to spotify_client.request as `until`, which stops
+    its retries and shortens its timeouts so the abandoned thread finishes around the deadline too.
+
+    Args:
+        tasks (dict): Maps a key to a callable performing one fetch, called with the deadline.
+        deadline (float, optional): Seconds to wait for all tasks. Defaults to settings.SPOTIFY_FETCH_DEADLINE.
+
+    Returns:
+        dict: Maps each key to its callable's result, or None if it failed or timed out.
+    """
+    if deadline is None:
+        deadline = getattr(settings, 'SPOTIFY_FETCH_DEADLINE', 8)
+
+    until = time.monotonic() + deadline
+    futures = {key: _fetch_executor.submit(run_in_context(lambda task=task: task(until))) for key, task in tasks.items()}
+    wait(futures.values(), timeout=deadline)
+
+    results = {}
+    for key, future in futures.items():
+        if future.done() and not future.cancelled() and future.exception() is None:
+            results[key] = future.result()
+        else:
+            # Only stops a task that has not started yet; a running one is left to finish on its own
+            future.cancel()
+            results[key] = None
+    return results
+
+
+def format_track(track, include_preview=True):
+    """
+    Converts a raw Spotify track object into the dictionary stored in wrap data.
+
+    Args:
+        track (dict): The raw Spotify track object.
+        include_preview (bool, optional): Whether to include the preview URL. Defaults to True.
+
+    Returns:
+        dict: The track's Spotify ID, name, main artist, album cover and (optionally) preview URL.
+    """
+    formatted = {
+        'id': track.get('id'),
+        'name': track['name'],
+        'artist': track['artists'][0]['name'] if track['artists'] else "Unknown",
+        'image_url': track['album']['images'][0]['url'] if track['album']['images'] else None,
+    }
+    if include_preview:
+        formatted['preview_url'] = track['preview_url']
+    return formatted
+
+
+def format_artist(artist):
+    """
+    Converts a raw Spotify artist object into the dictionary stored in wrap data.
+
+    Args:
+        artist (dict): The raw Spotify artist object.
+
+    Returns:
+        dict: The artist's Spotify ID, name, normalized main genre and image.
+    """
+    return {
+        'id': artist.get('id'),
+        'name': artist['name'],
+        'genre': normalize_genre(artist['genres'][0]) if artist['genres'] else None,
+        'image_url': artist['images'][0]['url'] if artist['images'] else None,
+    }
+
+
+def top_genres(artist_data):
+    """
+    Computes the top genres from the user's top artists, along with the percentage of each genre.
+
+    Args:
+        artist_data (list): The raw Spotify artist objects from the user's top artists.
+
+    Returns:
+        list: A list of dictionaries containing the top genres and their percentages.
+    """
+    genres = []
+    for artist in artist_data:
+        if artist.get('genres'):
+            first_genre = artist['genres'][0]
+            normalized_genre = normalize_genre(first_genre)
+            genres.append(normalized_genre)
+
+    genre_counts = Counter(genres)
+    top_genres = []
+    for genre, count in genre_counts.most_common(5):
+        percentage = int(round((count / TOP_ITEMS_LIMIT) * 100, 1))
+        top_genres.append({'genre': genre, 'count': count, 'percentage': percentage})
+
+    return top_genres
+
+
+def get_least_popular(track_data, artist_data):
+    """
+    Picks the least popular song and artist based on popularity from the user's top tracks and artists.
+
+    Args:
+        track_data (list): The raw Spotify track objects from the user's top tracks.
+        artist_data (list): The raw Spotify artist objects from the user's top artists.
+
+    Returns:
+        tuple: A tuple containing the least popular song and artist as dictionaries.
+    """
+    least_popular_song = None
+    if track_data:
+        track = min(track_data, key=lambda track: track.get("popularity", 101))
+        least_popular_song = format_track(track)
+        least_popular_song['popularity'] = track['popularity']
+
+    least_popular_artist = None
+    if artist_data:
+        artist = min(artist_data, key=lambda artist: artist.get("popularity", 101))
+        least_popular_artist = format_artist(artist)
+        least_popular_artist['popularity'] = artist['popularity']
+
+    return least_popular_song, least_popular_artist
+
+
+def get_most_popular(track_data, artist_data):
+    """
+    Picks the most popular song and artist based on popularity from the user's top tracks and artists.
+
+    Args:
+        track_data (list): The raw Spotify track objects from the user's top tracks.
+        artist_data (list): The raw Spotify artist objects from the user's top artists.
+
+    Returns:
+        tuple: A tuple containing the most popular song and artist as dictionaries.
+    """
+    most_popular_song = None
+    if track_data:
+        track = max(track_data, key=lambda track: track.get("popularity", -1))
+        most_popular_song = format_track(track)
+        most_popular_song['popularity'] = track['popularity']
+
+    most_popular_artist = None
+    if artist_data:
+        artist = max(artist_data, key=lambda artist: artist.get("popularity", -1))
+        most_popular_artist = format_artist(artist)
+        most_popular_artist['popularity'] = artist['popularity']
+
+    return most_popular_song, most_popular_artist
+
+
+def audio_profile(track_data, features):
+    """
+    Summarizes the danceability, energy and valence of the user's top tracks. Each feature is
+    pulled out as one column of values and summarized with plain Python and the statistics module:
+    the project does not depend on numpy, and for the few hundred values of one batch this takes
+    well under a millisecond.
+
+    Args:
+        track_data (list): The raw Spotify track objects from the user's top tracks.
+        features (dict): The tracks' audio features by track ID, as returned by fetch_audio_features.
+
+    Returns:
+        dict or None: The overall mood, the number of tracks summarized and, for each feature, its
+        mean and median as percentages, the share of tracks in each fifth of its range, and the
+        tracks with the highest and lowest value; None if no track has features.
+    """
+    tracks = [track for track in track_data if track.get('id') in features]
+    if not tracks:
+        return None
+
+    profile = {'tracks': len(tracks)}
+    for name in AUDIO_FEATURES:
+        values = [features[track['id']][name] for track in tracks]
+        buckets = Counter(min(int(value * 5), 4) for value in values)
+        highest = max(range(len(values)), key=values.__getitem__)
+        lowest = min(range(len(values)), key=values.__getitem__)
+        profile[name] = {
+            'mean': round(statistics.fmean(values) * 100),
+            'median': round(statistics.median(values) * 100),
+            'distribution': [round(buckets[bucket] / len(values) * 100) for bucket in range(5)],
+            'highest': format_track(tracks[highest], include_preview=False),
+            'lowest': format_track(tracks[lowest], include_preview=False),
+        }
+    profile['mood'] = MOODS[profile['energy']['mean'] >= 50, profile['valence']['mean'] >= 50]
+    return profile
+
+
+def build_wrap_data(track_data, artist_data, audio_features=None):
+    """
+    Derives every section of a wrap from a single page of top tracks and top artists.
+
+    Args:
+        track_data (list): The raw Spotify track objects from the user's top tracks.
+        artist_data (list): The raw Spotify artist objects from the user's top artists.
+        audio_features (dict, optional): The top tracks' audio features by track ID. Defaults to
+            None, in which case the wrap has no audio profile.
+
+    Returns:
+        dict: The wrap data, in the format saved on SpotifyWrap.wrap_data.
+    """
+    least_popular_song, least_popular_artist = get_least_popular(track_data, artist_data)
+    most_popular_song, most_popular_artist = get_most_popular(track_data, artist_data)
+
+    wrap_data = {
+        'top_tracks': [format_track(track) for track in track_data[:TOP_LIST_SIZE]],
+        'top_artists': [format_artist(artist) for artist in artist_data[:TOP_LIST_SIZE]],
+        'genres': top_genres(artist_data),
+        'least_popular_song': least_popular_song,
+        'least_popular_artist': least_popular_artist,
+        'most_popular_song': most_popular_song,
+        'most_popular_artist': most_popular_artist,
+        'tracks_game': [format_track(track) for track in track_data],
+    }
+    profile = audio_profile(track_data, audio_features) if audio_features else None
+    if profile:
+        wrap_data['audio_profile'] = profile
+    return wrap_data
+
+
+def load_wrap_data(access_token, time_range, user_id=None, max_retry_wait=None, deadline=None):
+    """
+    Fetches the user's top tracks and top artists once each, in parallel, and derives the full wrap data from them.
+    The top tracks' audio features then take one more request at most.
+
+    Args:
+        access_token (str): The Spotify access token to authenticate the API requests.
+        time_range (str): The time range for the wrap.
+        user_id (int, optional): The ID of the user the wrap is for. Defaults to None.
+        max_retry_wait (float, optional): Passed on to spotify_client.request. Defaults to None.
+        deadline (float, optional): Passed on to fetch_concurrently. Defaults to None.
+
+    Returns:
+        tuple: The wrap data dictionary and a list of the item types ('tracks', 'artists') that failed to load.
+    """
+    results = fetch_concurrently({
+        item_type: lambda until, item_type=item_type: fetch_top_items(
+            access_token, item_type, time_range, user_id=user_id, max_retry_wait=max_retry_wait, until=until,
+        )
+        for item_type in ('tracks', 'artists')
+    }, deadline=deadline)
+    track_data = results['tracks']
+    artist_data = results['artists']
+
+    failed = [item_type for item_type, items in (('tracks', track_data), ('artists', artist_data)) if items is None]
+    track_ids = [track.get('id') for track in track_data or []]
+    features = fetch_audio_features(access_token, track_ids, max_retry_wait=max_retry_wait) if track_ids else {}
+    with phase('build'):
+        return build_wrap_data(track_data or [], artist_data or [], features), failed
+
+
+def rank_movement(tracks_by_range, size=TOP_LIST_SIZE):
+    """
+    Compares where the user's current top tracks rank in each time range.
+
+    Args:
+        tracks_by_range (dict): Maps each time range to its raw Spotify top tracks, in rank order.
+        size (int, optional): Number of short-term top tracks to compare. Defaults to TOP_LIST_SIZE.
+
+    Returns:
+        list: For each short-term top track, its formatted details with its 1-based rank in every time
+        range (None if it is not in that range's top tracks) and 'movement', the number of places it
+        climbed compared to the long term (None if it is new).
+    """
+    positions = {
+        time_range: {track.get('id'): rank for rank, track in enumerate(tracks, start=1)}
+        for time_range, tracks in tracks_by_range.items()
+    }
+    movement = []
+    for rank, track in enumerate(tracks_by_range.get('short_term', [])[:size], start=1):
+        entry = format_track(track, include_preview=False)
+        entry['short_rank'] = rank
+        entry['medium_rank'] = positions.get('medium_term', {}).get(track.get('id'))
+        entry['long_rank'] = positions.get('long_term', {}).get(track.get('id'))
+        entry['movement'] = entry['long_rank'] - rank if entry['long_rank'] else None
+        movement.append(entry)
+    return movement
+
+
+def load_all_wrap_data(access_token, user_id=None, max_retry_wait=None, deadline=None):
+    """
+    Builds the wrap data for every time range in one pass: the six top tracks and top artists
+    requests are sent concurrently, so the whole batch costs about as much as a single range.
+    The audio features of every range's top tracks are fetched together, and each range's wrap
+    data also gets a 'rank_movement' section comparing the ranges.
+
+    Args:
+        access_token (str): The Spotify access token to authenticate the API requests.
+        user_id (int, optional): The ID of the user the wraps are for. Defaults to None.
+        max_retry_wait (float, optional): Passed on to spotify_client.request. Defaults to None.
+        deadline (float, optional): Passed on to fetch_concurrently. Defaults to None.
+
+    Returns:
+        tuple: A dictionary mapping each time range to its wrap data, and a dictionary mapping each
+        time range to the list of item types ('tracks', 'artists') that failed to load.
+    """
+    tasks = {}
+    for time_range in TIME_RANGES:
+        for item_type in ('tracks', 'artists'):
+            tasks[time_range, item_type] = (
+                lambda until, item_type=item_type, time_range=time_range: fetch_top_items(
+                    access_token, item_type, time_range, user_id=user_id, max_retry_wait=max_retry_wait, until=until,
+                )
+            )
+    results = fetch_concurrently(tasks, deadline=deadline)
+
+    tracks_by_range = {
+        time_range: results[time_range, 'tracks'] for time_range in TIME_RANGES if results[time_range, 'tracks'] is not None
+    }
+    movement = rank_movement(tracks_by_range) if len(tracks_by_range) > 1 else []
+    track_ids = [track.get('id') for tracks in tracks_by_range.values() for track in tracks]
+    features = fetch_audio_features(access_token, track_ids, max_retry_wait=max_retry_wait) if track_ids else {}
+
+    wraps_data, failed = {}, {}
+    with phase('build'):
+        for time_range in TIME_RANGES:
+            track_data = results[time_range, 'tracks']
+            artist_data = results[time_range, 'artists']
+            failed[time_range] = [
+                item_type for item_type, items in (('tracks', track_data), ('artists', artist_data)) if items is None
+            ]
+            wraps_data[time_range] = build_wrap_data(track_data or [], artist_data or [], features)
+            if movement:
+                wraps_data[time_range]['rank_movement'] = movement
+    return wraps_data, failed
@@ -1,3 +1,1023 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import spotify_client, tokens
+from .catalog_cache import catalog_cache
+from .history import ingest_recently_played, listening_stats
+from .jobs import claim_next_job, enqueue_wrap_job
+from .models import DuoWrapped, ListeningCursor, ListeningEvent, SpotifyToken, SpotifyWrap, WrapJob
+from .spotify_data import build_wrap_data, fetch_audio_features, fetch_concurrently, fetch_top_items
+
+
+def fake_tracks(count=50):
+    """
+    Returns raw Spotify track objects shaped like the /me/top/tracks payload.
+    """
+    return [
+        {
+            'id': f'track{i}',
+            'name': f'Song {i}',
+            'artists': [{'id': f'artist{i % 7}', 'name': f'Artist {i % 7}'}],
+            'album': {'images': [{'url': f'https://i.scdn.co/image/track{i}'}]},
+            'preview_url': None,
+            'popularity': (i * 37) % 100,
+        }
+        for i in range(count)
+    ]
+
+
+def fake_artists(count=50):
+    """
+    Returns raw Spotify artist objects shaped like the /me/top/artists payload.
+    """
+    return [
+        {
+            'id': f'artist{i}',
+            'name': f'Artist {i}',
+            'genres': ['hip hop', 'pop', 'indie rock'][i % 3:],
+            'images': [{'url': f'https://i.scdn.co/image/artist{i}'}],
+            'popularity': (i * 13) % 100,
+        }
+        for i in range(count)
+    ]
+
+
+def fake_audio_features(count=50):
+    """
+    Returns audio features for the fake tracks, keyed by track ID as returned by fetch_audio_features.
+    """
+    return {
+        f'track{i}': {'danceability': 0.8, 'energy': (i % 10) / 10, 'valence': i / count}
+        for i in range(count)
+    }
+
+
+def fake_wrap_data():
+    """
+    Returns wrap data built from the fake Spotify payloads.
+    """
+    return build_wrap_data(fake_tracks(), fake_artists())
+
+
+class QueryCountTestCase(TestCase):
+    """
+    Base test case with two users, a logged-in client and an empty cache.
+
+    The query counts pinned by the subclasses include the two queries every logged-in request
+    makes to load the session and the user.
+    """
+
+    def setUp(self):
+        cache.clear()
+        catalog_cache.clear()
+        self.alice = User.objects.create_user('alice', password='password', first_name='Alice')
+        self.bob = User.objects.create_user('bob', password='password', first_name='Bob')
+        self.client.force_login(self.alice)
+
+    def create_wrap(self, user, time_range='medium_term'):
+        """
+        Saves a wrap for the given user from the fake Spotify payloads.
+        """
+        return SpotifyWrap.objects.create_wrap(user, time_range, fake_wrap_data())
+
+
+class SpotifyWrapQueryTests(QueryCountTestCase):
+    """
+    Pins the number of queries issued by the saved wrap views.
+    """
+
+    def test_saved_wraps_listing_is_independent_of_wrap_count(self):
+        for _ in range(3):
+            self.create_wrap(self.alice)
+
+        # session, user, count, page
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('view_saved_wraps'))
+        self.assertEqual(response.status_code, 200)
+
+        for _ in range(10):
+            self.create_wrap(self.alice)
+        with self.assertNumQueries(4):
+            self.client.get(reverse('view_saved_wraps'))
+
+    def test_saved_wraps_listing_does_not_load_wrap_data(self):
+        self.create_wrap(self.alice)
+        response = self.client.get(reverse('view_saved_wraps'))
+        wrap = response.context['saved_wraps'][0]
+        self.assertIn('wrap_data', wrap.get_deferred_fields())
+        self.assertEqual(wrap.top_track_name, 'Song 0')
+
+    def test_saved_wraps_listing_redirects_when_empty(self):
+        # session, user, count
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('view_saved_wraps'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    def test_display_selected_wrap_uses_deck_cache(self):
+        wrap = self.create_wrap(self.alice)
+        url = reverse('display_selected_wrap', args=[wrap.id])
+
+        # session, user, validators, wrap, wrap data, track entries, artist entries
+        with self.assertNumQueries(7):
+            self.client.get(url)
+        # The rendered deck is cached, so the wrap's data, tracks and artists are not loaded again
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, 'Song 0')
+        # Showing the wrap does not build the game's question pool
+        self.assertNotIn('song_question_pool', self.client.session)
+
+    def test_song_questions_builds_the_pool_once(self):
+        wrap = self.create_wrap(self.alice)
+        url = reverse('song_questions')
+        response = self.client.get(url, {'wrap_id': wrap.id, 'count': 5})
+        self.assertEqual(len(response.json()['questions']), 5)
+        self.assertEqual(self.client.session['song_question_pool']['wrap_id'], wrap.id)
+
+        # session, user: later rounds are served from the pool in the session
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'wrap_id': wrap.id, 'count': 5})
+        self.assertEqual(len(response.json()['questions']), 5)
+
+    def test_deleting_a_wrap_evicts_its_cached_deck(self):
+        wrap = self.create_wrap(self.alice)
+        self.client.get(reverse('display_selected_wrap', args=[wrap.id]))
+        self.assertIsNotNone(cache.get(wrap.deck_cache_key))
+        self.client.get(reverse('delete_saved_wrap', args=[wrap.id]))
+        self.assertIsNone(cache.get(wrap.deck_cache_key))
+
+        # Also when the wraps go with their owner's account
+        wrap = self.create_wrap(self.alice)
+        self.client.get(reverse('display_selected_wrap', args=[wrap.id]))
+        self.alice.delete()
+        self.assertIsNone(cache.get(wrap.deck_cache_key))
+
+    def test_display_selected_wrap_not_modified(self):
+        wrap = self.create_wrap(self.alice)
+        url = reverse('display_selected_wrap', args=[wrap.id])
+        etag = self.client.get(url)['ETag']
+
+        # session, user, validators
+        with self.assertNumQueries(3):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_display_selected_wrap_of_another_user(self):
+        wrap = self.create_wrap(self.bob)
+        response = self.client.get(reverse('display_selected_wrap', args=[wrap.id]))
+        self.assertRedirects(response, reverse('view_saved_wraps'), fetch_redirect_response=False)
+
+    def test_tracks_game_keeps_preview_urls(self):
+        tracks = fake_tracks()
+        for track in tracks:
+            track['preview_url'] = f"https://p.scdn.co/mp3-preview/{track['id']}"
+        wrap_data = build_wrap_data(tracks, fake_artists())
+        self.assertEqual(set(wrap_data['tracks_game'][0]), {'id', 'name', 'artist', 'image_url', 'preview_url'})
+
+        wrap = SpotifyWrap.objects.create_wrap(self.alice, 'medium_term', wrap_data)
+        game = SpotifyWrap.objects.get(id=wrap.id).get_wrap_data()['tracks_game']
+        self.assertEqual([track['preview_url'] for track in game], [track['preview_url'] for track in tracks])
+
+    def test_saved_wraps_round_trip_through_the_shared_catalog(self):
+        # The top artist has no genre and is also the most popular one
+        artists = fake_artists()
+        artists[0].update(genres=[], popularity=100)
+        tracks = fake_tracks()
+        tracks[0]['preview_url'] = 'https://p.scdn.co/mp3-preview/track0'
+        first_data = build_wrap_data(tracks, artists)
+        self.assertIsNone(first_data['most_popular_artist']['genre'])
+        first = SpotifyWrap.objects.create_wrap(self.alice, 'medium_term', first_data)
+
+        # A later wrap where Spotify no longer has the preview, nor the top artist's image
+        tracks[0]['preview_url'] = None
+        artists[0]['images'] = []
+        second_data = build_wrap_data(tracks, artists)
+        second = SpotifyWrap.objects.create_wrap(self.alice, 'short_term', second_data)
+
+        catalog_cache.clear()
+        self.assertEqual(SpotifyWrap.objects.get(id=first.id).get_wrap_data(), first_data)
+        self.assertIsNone(SpotifyWrap.objects.get(id=second.id).get_wrap_data()['top_tracks'][0]['preview_url'])
+        self.assertEqual(
+            SpotifyWrap.objects.get(id=second.id).get_wrap_data()['top_artists'][0]['image_url'],
+            'https://i.scdn.co/image/artist0',
+        )
+
+        response = self.client.get(reverse('display_selected_wrap', args=[first.id]))
+        self.assertContains(response, 'Genre: Unknown Genre')
+
+    def test_identical_generation_reuses_the_wrap_and_dates_it_latest(self):
+        first, created = SpotifyWrap.objects.get_or_create_wrap(self.alice, 'medium_term', fake_wrap_data())
+        self.assertTrue(created)
+
+        # A changed payload is a new snapshot
+        changed = fake_wrap_data()
+        changed['tracks_game'] = changed['tracks_game'][:5]
+        second, created = SpotifyWrap.objects.get_or_create_wrap(self.alice, 'medium_term', changed)
+        self.assertTrue(created)
+        self.assertNotEqual(second.id, first.id)
+
+        # The same payload again reuses the first snapshot, which becomes the latest one
+        again, created = SpotifyWrap.objects.get_or_create_wrap(self.alice, 'medium_term', fake_wrap_data())
+        self.assertFalse(created)
+        self.assertEqual(again.id, first.id)
+        self.assertEqual(SpotifyWrap.objects.filter(user=self.alice).count(), 2)
+        self.assertEqual(SpotifyWrap.objects.filter(user=self.alice).order_by('-created_at').first().id, first.id)
+
+    def test_str_does_not_refetch_user(self):
+        for _ in range(3):
+            self.create_wrap(self.alice)
+        with self.assertNumQueries(1):
+            labels = [str(wrap) for wrap in SpotifyWrap.objects.select_related('user').defer('wrap_data')]
+        self.assertTrue(all(label.startswith('Spotify Wrap for alice') for label in labels))
+
+    def test_create_wrap_reuses_cached_catalog_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_wrap(self.alice)
+
+        # savepoint, wrap, track entries, artist entries, release: no catalog query at all
+        with self.assertNumQueries(5):
+            self.create_wrap(self.bob)
+
+        # Without the in-process cache the rows are read back in one query per model, but not rewritten
+        catalog_cache.clear()
+        with self.assertNumQueries(7):
+            wrap = self.create_wrap(self.bob)
+        self.assertEqual(wrap.get_wrap_data(), fake_wrap_data())
+
+    @override_settings(WRAP_JOBS_ASYNC=False)
+    def test_spotify_wrapped_generates_wrap_in_request(self):
+        session = self.client.session
+        session['spotify_access_token'] = 'token'
+        session.save()
+
+        payloads = {'tracks': fake_tracks(), 'artists': fake_artists()}
+        with mock.patch('spotifywrapped.spotify_data.fetch_top_items',
+                        side_effect=lambda token, item_type, time_range, **options: payloads[item_type]) as fetch, \
+                mock.patch('spotifywrapped.spotify_data.fetch_audio_features', return_value={}):
+            response = self.client.get(reverse('spotify_wrapped'), {'time_range': 'short_term'})
+
+        self.assertEqual(fetch.call_count, 2)
+        wrap = SpotifyWrap.objects.get(user=self.alice)
+        self.assertRedirects(response, reverse('display_selected_wrap', args=[wrap.id]), fetch_redirect_response=False)
+        self.assertEqual(wrap.get_wrap_data(), fake_wrap_data())
+
+    @override_settings(WRAP_JOBS_ASYNC=False)
+    def test_spotify_wrapped_generates_every_time_range_in_one_batch(self):
+        session = self.client.session
+        session['spotify_access_token'] = 'token'
+        session.save()
+
+        # The short-term list is the long-term list reversed, so Song 49 climbs from 50th to 1st
+        payloads = {
+            ('tracks', 'short_term'): fake_tracks()[::-1],
+            ('tracks', 'medium_term'): fake_tracks(),
+            ('tracks', 'long_term'): fake_tracks(),
+        }
+        with mock.patch('spotifywrapped.spotify_data.fetch_top_items',
+                        side_effect=lambda token, item_type, time_range, **options: payloads.get((item_type, time_range), fake_artists())) as fetch, \
+                mock.patch('spotifywrapped.spotify_data.fetch_audio_features', return_value=fake_audio_features()) as features:
+            response = self.client.get(reverse('spotify_wrapped'), {'time_range': 'all'})
+
+        self.assertEqual(fetch.call_count, 6)
+        # The three ranges' top tracks share one audio features lookup
+        features.assert_called_once()
+        wraps = {wrap.time_range: wrap for wrap in SpotifyWrap.objects.filter(user=self.alice)}
+        self.assertEqual(set(wraps), {'short_term', 'medium_term', 'long_term'})
+        self.assertRedirects(response, reverse('display_selected_wrap', args=[wraps['short_term'].id]),
+                             fetch_redirect_response=False)
+        movement = wraps['long_term'].get_wrap_data()['rank_movement']
+        self.assertEqual(movement[0]['name'], 'Song 49')
+        self.assertEqual((movement[0]['short_rank'], movement[0]['long_rank'], movement[0]['movement']), (1, 50, 49))
+
+        response = self.client.get(reverse('display_selected_wrap', args=[wraps['short_term'].id]))
+        self.assertContains(response, 'How Your Top Tracks Moved')
+        self.assertContains(response, 'Your Musical Mood')
+
+
+class DuoWrappedQueryTests(QueryCountTestCase):
+    """
+    Pins the number of queries issued by the Duo Wrapped views.
+    """
+
+    def test_profile_is_independent_of_invitation_count(self):
+        DuoWrapped.objects.create(inviter=self.bob, invitee=self.alice)
+
+        # session, user, invitations with their inviters
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('profile'))
+        self.assertContains(response, 'bob')
+
+        for i in range(5):
+            inviter = User.objects.create_user(f'friend{i}')
+            DuoWrapped.objects.create(inviter=inviter, invitee=self.alice)
+        with self.assertNumQueries(3):
+            self.client.get(reverse('profile'))
+
+    def test_invite_duo_wrapped(self):
+        # session, user, invitee, pending check, insert
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse('invite_duo_wrapped'), {'invitee': 'bob'})
+        self.assertRedirects(response, reverse('profile'), fetch_redirect_response=False)
+        self.assertTrue(DuoWrapped.objects.filter(inviter=self.alice, invitee=self.bob).exists())
+
+    def test_view_duo_wrapped(self):
+        self.create_wrap(self.alice)
+        duo = DuoWrapped.objects.create(
+            inviter=self.alice, invitee=self.bob, invitee_wrap_data=fake_wrap_data(), is_accepted=True,
+        )
+        url = reverse('view_duo_wrapped', args=[duo.id])
+
+        # session, user, validators (2), duo with both users, inviter wrap, track entries, artist entries
+        with self.assertNumQueries(8):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(4):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_str_does_not_refetch_users(self):
+        for _ in range(3):
+            DuoWrapped.objects.create(inviter=self.bob, invitee=self.alice)
+        with self.assertNumQueries(1):
+            labels = [str(duo) for duo in DuoWrapped.objects.select_related('inviter', 'invitee')]
+        self.assertEqual(labels, ["Duo-Wrapped between bob and alice"] * 3)
+
+
+class ServerTimingTests(QueryCountTestCase):
+    """
+    Checks the per-request metrics reported by ServerTimingMiddleware.
+    """
+
+    def test_reports_spotify_calls_and_queries(self):
+        session = self.client.session
+        session['spotify_access_token'] = 'token'
+        session.save()
+
+        def spotify_response(method, url, **kwargs):
+            if url.endswith('/audio-features'):
+                body = {'audio_features': [dict(features, id=track_id) for track_id, features in fake_audio_features().items()]}
+            else:
+                body = {'items': fake_tracks() if url.endswith('/tracks') else fake_artists()}
+            return mock.Mock(status_code=200, json=mock.Mock(return_value=body))
+
+        with override_settings(WRAP_JOBS_ASYNC=False), \
+                mock.patch('spotifywrapped.spotify_client.get_session') as get_session, \
+                self.assertLogs('spotifywrapped.performance', 'INFO') as logs:
+            get_session.return_value.request.side_effect = spotify_response
+            response = self.client.get(reverse('spotify_wrapped'))
+
+        self.assertIn('spotify;dur=', response['Server-Timing'])
+        self.assertIn('desc="3 calls"', response['Server-Timing'])
+        self.assertIn('save;dur=', response['Server-Timing'])
+        self.assertIn('spotify_calls=3', logs.output[0])
+        self.assertRegex(logs.output[0], r'db_queries=[1-9]')
+
+    @override_settings(SERVER_TIMING_ENABLED=False)
+    def test_header_can_be_disabled(self):
+        with self.assertLogs('spotifywrapped.performance', 'INFO'):
+            response = self.client.get(reverse('profile'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class MetricsViewTests(QueryCountTestCase):
+    """
+    Checks the Prometheus metrics endpoint.
+    """
+
+    def test_requires_staff(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_exposes_view_latency_and_cache_lookups(self):
+        self.alice.is_staff = True
+        self.alice.save()
+        wrap = self.create_wrap(self.alice)
+        self.client.get(reverse('display_selected_wrap', args=[wrap.id]))
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('# TYPE spotifywrapped_view_latency_seconds histogram', body)
+        self.assertIn('spotifywrapped_view_latency_seconds_bucket{view="display_selected_wrap",le="+Inf"}', body)
+        self.assertIn('spotifywrapped_cache_requests_total{cache="wrap_deck",result="miss"}', body)
+
+
+class SpotifyTransportTests(TestCase):
+    """
+    Checks recording Spotify responses as fixtures and replaying them offline.
+    """
+
+    def setUp(self):
+        fixture_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(fixture_dir.cleanup)
+        self.fixture_dir = fixture_dir.name
+
+    def test_record_then_replay(self):
+        response = mock.Mock(status_code=200, text='{"items": [{"name": "Song 0"}]}', headers={'Content-Type': 'application/json'})
+        with override_settings(SPOTIFY_TRANSPORT='record', SPOTIFY_FIXTURE_DIR=self.fixture_dir), \
+                mock.patch('spotifywrapped.spotify_client.request', return_value=response):
+            fetch_top_items('token', 'tracks', 'short_term', user_id=1)
+
+        with override_settings(SPOTIFY_TRANSPORT='replay', SPOTIFY_FIXTURE_DIR=self.fixture_dir), \
+                mock.patch('spotifywrapped.spotify_client.request') as live_request:
+            # The recording still replays once the user's token has been refreshed
+            self.assertEqual(fetch_top_items('refreshed-token', 'tracks', 'short_term', user_id=1), [{'name': 'Song 0'}])
+            # Other users and other parameters were never recorded
+            with self.assertLogs('spotifywrapped.spotify_client', 'WARNING'):
+                self.assertIsNone(fetch_top_items('token', 'tracks', 'short_term', user_id=2))
+                self.assertIsNone(fetch_top_items('token', 'tracks', 'long_term', user_id=1))
+        live_request.assert_not_called()
+
+    def test_fixture_path_does_not_contain_user_id(self):
+        with override_settings(SPOTIFY_FIXTURE_DIR=self.fixture_dir):
+            path = spotify_client.fixture_path(1234567, '/me/top/tracks', {'limit': 50})
+        self.assertNotIn('1234567', path)
+        self.assertTrue(path.startswith(self.fixture_dir))
+
+
+class AudioFeaturesTests(TestCase):
+    """
+    Checks the batched, shared audio features lookup and the mood summary built from it.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_features_are_fetched_in_batches_and_cached_for_every_user(self):
+        track_ids = [f'track{i}' for i in range(150)]
+
+        def audio_features(access_token, path, params=None, **options):
+            ids = params['ids'].split(',')
+            # Spotify has no features for track7
+            items = [None if track_id == 'track7' else {'id': track_id, 'danceability': 0.5, 'energy': 0.5,
+                                                          'valence': 0.5, 'tempo': 120.0} for track_id in ids]
+            return mock.Mock(status_code=200, json=mock.Mock(return_value={'audio_features': items}))
+
+        with mock.patch('spotifywrapped.spotify_client.api_get', side_effect=audio_features) as api_get:
+            features = fetch_audio_features('alice-token', track_ids)
+        self.assertEqual([len(call.kwargs['params']['ids'].split(',')) for call in api_get.call_args_list], [100, 50])
+        self.assertEqual(len(features), 149)
+        self.assertEqual(features['track0'], {'danceability': 0.5, 'energy': 0.5, 'valence': 0.5})
+
+        # Another user's overlapping tracks, including the one without features, come from the cache
+        with mock.patch('spotifywrapped.spotify_client.api_get') as api_get:
+            self.assertEqual(len(fetch_audio_features('bob-token', track_ids[:10])), 9)
+        api_get.assert_not_called()
+
+    def test_wrap_data_includes_audio_profile(self):
+        wrap_data = build_wrap_data(fake_tracks(), fake_artists(), fake_audio_features())
+        profile = wrap_data['audio_profile']
+        self.assertEqual((profile['tracks'], profile['mood']), (50, "Melancholic"))
+        self.assertEqual(profile['danceability']['mean'], 80)
+        self.assertEqual(profile['danceability']['distribution'], [0, 0, 0, 0, 100])
+        self.assertEqual(profile['valence']['highest']['name'], 'Song 49')
+        self.assertEqual(profile['valence']['lowest']['name'], 'Song 0')
+        self.assertNotIn('audio_profile', build_wrap_data(fake_tracks(), fake_artists(), {}))
+
+
+class ProfilingMiddlewareTests(QueryCountTestCase):
+    """
+    Checks the profiles written by ProfilingMiddleware.
+    """
+
+    def setUp(self):
+        super().setUp()
+        profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profile_dir.cleanup)
+        self.profile_dir = profile_dir.name
+
+    def test_sampled_request_is_profiled(self):
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_DIR=self.profile_dir):
+            self.client.get(reverse('profile'))
+        [name] = os.listdir(self.profile_dir)
+        self.assertRegex(name, r'-profile-\d+ms\.prof$')
+
+    def test_slow_request_stacks_are_kept_and_rotated(self):
+        with override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0, PROFILING_SLOW_THRESHOLD=0,
+                               PROFILING_SAMPLE_INTERVAL=0.001, PROFILING_MAX_FILES=2, PROFILING_DIR=self.profile_dir):
+            with mock.patch('spotifywrapped.views.render', side_effect=lambda *args, **kwargs: time.sleep(0.05) or HttpResponse()):
+                for _ in range(3):
+                    self.client.get(reverse('profile'))
+        names = os.listdir(self.profile_dir)
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith('.folded') for name in names))
+
+
+class TokenManagerTests(QueryCountTestCase):
+    """
+    Checks storing, refreshing and expiring Spotify tokens.
+    """
+
+    def store_token(self, expires_in):
+        return SpotifyToken.objects.create(
+            user=self.alice, access_token='old', refresh_token='refresh',
+            expires_at=timezone.now() + timedelta(seconds=expires_in),
+        )
+
+    def test_authorize_url_is_built_without_a_request(self):
+        with mock.patch('spotifywrapped.spotify_client.get_session') as get_session:
+            response = self.client.get(reverse('get_spotify_auth_url'))
+        get_session.assert_not_called()
+        self.assertTrue(response['Location'].startswith('https://accounts.spotify.com/authorize?client_id='))
+
+    def test_callback_stores_refresh_token_and_expiry(self):
+        token_response = mock.Mock(status_code=200)
+        token_response.json.return_value = {'access_token': 'new', 'refresh_token': 'refresh', 'expires_in': 3600}
+        with mock.patch('spotifywrapped.spotify_client.accounts_post', return_value=token_response):
+            self.client.get(reverse('spotify_callback'), {'code': 'code'})
+        token = SpotifyToken.objects.get(user=self.alice)
+        self.assertEqual((token.access_token, token.refresh_token), ('new', 'refresh'))
+        self.assertFalse(token.expires_within(3000))
+
+    def test_valid_token_is_not_refreshed(self):
+        self.store_token(3600)
+        with mock.patch('spotifywrapped.tokens.request_token') as request_token:
+            self.assertEqual(tokens.get_access_token(self.alice), 'old')
+        request_token.assert_not_called()
+
+    def test_token_is_refreshed_before_expiry_and_keeps_refresh_token(self):
+        self.store_token(60)
+        token_response = mock.Mock(status_code=200)
+        token_response.json.return_value = {'access_token': 'new', 'expires_in': 3600}
+        with mock.patch('spotifywrapped.tokens.request_token', return_value=token_response) as request_token:
+            self.assertEqual(tokens.get_access_token(self.alice), 'new')
+        self.assertEqual(request_token.call_args.args[0]['grant_type'], 'refresh_token')
+        self.assertEqual(SpotifyToken.objects.get(user=self.alice).refresh_token, 'refresh')
+
+    def test_revoked_refresh_token_requires_authorization(self):
+        self.store_token(-60)
+        with mock.patch('spotifywrapped.tokens.request_token', return_value=mock.Mock(status_code=400)):
+            self.assertIsNone(tokens.get_access_token(self.alice))
+        self.assertFalse(SpotifyToken.objects.filter(user=self.alice).exists())
+
+    def test_unreachable_spotify_keeps_unexpired_token(self):
+        self.store_token(60)
+        with mock.patch('spotifywrapped.tokens.request_token', return_value=None):
+            self.assertEqual(tokens.get_access_token(self.alice), 'old')
+        self.assertTrue(SpotifyToken.objects.filter(user=self.alice).exists())
+
+    def test_only_one_caller_claims_the_refresh(self):
+        token = self.store_token(60)
+        self.assertTrue(tokens.claim_refresh(token))
+        self.assertFalse(tokens.claim_refresh(token))
+
+        # A lease held past SPOTIFY_TOKEN_REFRESH_LEASE belongs to a refresh that died
+        SpotifyToken.objects.filter(pk=token.pk).update(refreshing_since=timezone.now() - timedelta(hours=1))
+        self.assertTrue(tokens.claim_refresh(token))
+
+    def test_caller_without_the_lease_uses_the_current_token(self):
+        token = self.store_token(60)
+        tokens.claim_refresh(token)
+        with mock.patch('spotifywrapped.tokens.request_token') as request_token:
+            self.assertEqual(tokens.get_access_token(self.alice), 'old')
+        request_token.assert_not_called()
+
+    @override_settings(WRAP_JOBS_ASYNC=True)
+    def test_spotify_wrapped_uses_stored_token(self):
+        SpotifyToken.objects.create(user=self.alice, access_token='stored', expires_at=timezone.now() + timedelta(hours=1))
+        with mock.patch('spotifywrapped.views.enqueue_wrap_job') as enqueue:
+            enqueue.return_value = (mock.Mock(id=1), True)
+            self.client.get(reverse('spotify_wrapped'))
+        self.assertEqual(enqueue.call_args.args[2], 'stored')
+
+
+class SingleFlightTests(QueryCountTestCase):
+    """
+    Checks that concurrent generations for the same user and time range share one job.
+    """
+
+    def test_second_request_joins_the_active_job(self):
+        leader, created = enqueue_wrap_job(self.alice, 'short_term', 'token')
+        self.assertTrue(created)
+        follower, created = enqueue_wrap_job(self.alice, 'short_term', 'token')
+        self.assertFalse(created)
+        self.assertEqual(follower.id, leader.id)
+
+        # Other time ranges and other users are independent
+        self.assertTrue(enqueue_wrap_job(self.alice, 'long_term', 'token')[1])
+        self.assertTrue(enqueue_wrap_job(self.bob, 'short_term', 'token')[1])
+
+    def test_finished_job_does_not_block_a_new_one(self):
+        job, _ = enqueue_wrap_job(self.alice, 'short_term', 'token')
+        WrapJob.objects.filter(id=job.id).update(status=WrapJob.STATUS_DONE)
+        self.assertNotEqual(enqueue_wrap_job(self.alice, 'short_term', 'token')[0].id, job.id)
+
+    @override_settings(WRAP_JOBS_ASYNC=False, WRAP_JOB_STALE_AFTER=300)
+    def test_job_left_running_by_a_crashed_process_is_replaced(self):
+        session = self.client.session
+        session['spotify_access_token'] = 'token'
+        session.save()
+        crashed, _ = enqueue_wrap_job(self.alice, 'medium_term', 'token')
+        WrapJob.objects.filter(id=crashed.id).update(
+            status=WrapJob.STATUS_RUNNING, updated_at=timezone.now() - timedelta(hours=1),
+        )
+
+        payloads = {'tracks': fake_tracks(), 'artists': fake_artists()}
+        with mock.patch('spotifywrapped.spotify_data.fetch_top_items',
+                        side_effect=lambda token, item_type, time_range, **options: payloads[item_type]) as fetch, \
+                mock.patch('spotifywrapped.spotify_data.fetch_audio_features', return_value={}):
+            response = self.client.get(reverse('spotify_wrapped'))
+
+        self.assertEqual(fetch.call_count, 2)
+        wrap = SpotifyWrap.objects.get(user=self.alice)
+        self.assertRedirects(response, reverse('display_selected_wrap', args=[wrap.id]), fetch_redirect_response=False)
+        crashed.refresh_from_db()
+        self.assertEqual(crashed.status, WrapJob.STATUS_FAILED)
+
+    def test_recently_updated_job_is_still_joined(self):
+        leader, _ = enqueue_wrap_job(self.alice, 'medium_term', 'token')
+        WrapJob.objects.filter(id=leader.id).update(status=WrapJob.STATUS_RUNNING, updated_at=timezone.now())
+        self.assertEqual(enqueue_wrap_job(self.alice, 'medium_term', 'token'), (leader, False))
+
+    @override_settings(WRAP_JOB_STALE_AFTER=300)
+    def test_job_queued_behind_a_backlog_is_still_joined(self):
+        queued, _ = enqueue_wrap_job(self.alice, 'medium_term', 'token')
+        WrapJob.objects.filter(id=queued.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(enqueue_wrap_job(self.alice, 'medium_term', 'token'), (queued, False))
+        self.assertEqual(WrapJob.objects.get(id=queued.id).status, WrapJob.STATUS_PENDING)
+
+    def test_insert_failing_for_another_reason_is_raised(self):
+        with mock.patch.object(WrapJob.objects, 'create', side_effect=IntegrityError("FOREIGN KEY constraint failed")) as create:
+            with self.assertRaises(IntegrityError):
+                enqueue_wrap_job(self.alice, 'medium_term', 'token')
+        self.assertEqual(create.call_count, 2)
+
+    @override_settings(WRAP_JOBS_ASYNC=False)
+    def test_follower_waits_for_the_leader_instead_of_fetching(self):
+        session = self.client.session
+        session['spotify_access_token'] = 'token'
+        session.save()
+        leader, _ = enqueue_wrap_job(self.alice, 'medium_term', 'token')
+        # The leader's result; there is no older medium_term wrap to serve in the meantime
+        wrap = self.create_wrap(self.alice, 'long_term')
+
+        def finish_leader(job, timeout=None, poll_interval=0.2):
+            WrapJob.objects.filter(id=job.id).update(status=WrapJob.STATUS_DONE, wrap=wrap)
+            job.refresh_from_db()
+            return True
+
+        with mock.patch('spotifywrapped.views.wait_for_job', side_effect=finish_leader), \
+                mock.patch('spotifywrapped.spotify_data.fetch_top_items') as fetch:
+            response = self.client.get(reverse('spotify_wrapped'))
+        fetch.assert_not_called()
+        self.assertRedirects(response, reverse('display_selected_wrap', args=[wrap.id]), fetch_redirect_response=False)
+        self.assertEqual(WrapJob.objects.filter(user=self.alice).count(), 1)
+
+
+class WrapJobQueueTests(QueryCountTestCase):
+    """
+    Checks claiming queued jobs, the worker that runs them and the status endpoint the progress page polls.
+    """
+
+    def test_jobs_are_claimed_oldest_first_and_only_once(self):
+        first, _ = enqueue_wrap_job(self.alice, 'short_term', 'token')
+        second, _ = enqueue_wrap_job(self.bob, 'short_term', 'token')
+        self.assertEqual(claim_next_job().id, first.id)
+        self.assertEqual(claim_next_job().id, second.id)
+        self.assertIsNone(claim_next_job())
+        self.assertEqual(WrapJob.objects.get(id=first.id).status, WrapJob.STATUS_RUNNING)
+
+    @override_settings(WRAP_JOB_STALE_AFTER=300)
+    def test_running_job_of_a_dead_worker_is_claimed_again(self):
+        job, _ = enqueue_wrap_job(self.alice, 'short_term', 'token')
+        WrapJob.objects.filter(id=job.id).update(
+            status=WrapJob.STATUS_RUNNING, updated_at=timezone.now() - timedelta(hours=1),
+        )
+        self.assertEqual(claim_next_job().id, job.id)
+
+    def test_worker_runs_queued_jobs(self):
+        job, _ = enqueue_wrap_job(self.alice, 'medium_term', 'token')
+        payloads = {'tracks': fake_tracks(), 'artists': fake_artists()}
+        with mock.patch('spotifywrapped.spotify_data.fetch_top_items',
+                        side_effect=lambda token, item_type, time_range, **options: payloads[item_type]), \
+                mock.patch('spotifywrapped.spotify_data.fetch_audio_features', return_value={}):
+            call_command('run_wrap_worker', '--once', stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, WrapJob.STATUS_DONE)
+        self.assertEqual(job.wrap.user, self.alice)
+        self.assertEqual(job.access_token, '')
+
+    def test_status_reports_progress_and_the_finished_wrap(self):
+        job, _ = enqueue_wrap_job(self.alice, 'medium_term', 'token')
+        url = reverse('wrap_job_status', args=[job.id])
+        self.assertEqual(self.client.get(url).json(), {'status': WrapJob.STATUS_PENDING, 'progress': 0, 'message': ''})
+
+        wrap = self.create_wrap(self.alice)
+        WrapJob.objects.filter(id=job.id).update(status=WrapJob.STATUS_DONE, progress=100, wrap=wrap)
+        data = self.client.get(url).json()
+        self.assertEqual(data['redirect_url'], reverse('display_selected_wrap', args=[wrap.id]))
+
+        # Other users' jobs are not found
+        other, _ = enqueue_wrap_job(self.bob, 'medium_term', 'token')
+        self.assertEqual(self.client.get(reverse('wrap_job_status', args=[other.id])).status_code, 404)
+
+
+class SpotifyRetryTests(TestCase):
+    """
+    Checks the rate limiter, the retries and the deadlines of requests to Spotify.
+    """
+
+    def setUp(self):
+        spotify_client.reset_circuit_breaker()
+        spotify_client.reset_rate_limiters()
+        self.addCleanup(spotify_client.reset_circuit_breaker)
+        self.addCleanup(spotify_client.reset_rate_limiters)
+        session = mock.patch('spotifywrapped.spotify_client.get_session')
+        self.session = session.start().return_value
+        self.addCleanup(session.stop)
+
+    def test_token_bucket_allows_a_burst_then_paces_requests(self):
+        bucket = spotify_client.TokenBucket(rate=20, capacity=2)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0))
+        started = time.monotonic()
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertGreater(time.monotonic() - started, 0.02)
+
+    def test_rate_limited_request_waits_for_retry_after(self):
+        self.session.request.side_effect = [
+            mock.Mock(status_code=429, headers={'Retry-After': '0.2'}),
+            mock.Mock(status_code=200, headers={}),
+        ]
+        started = time.monotonic()
+        self.assertEqual(spotify_client.api_get('token', '/me/top/tracks').status_code, 200)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(self.session.request.call_count, 2)
+
+    @override_settings(SPOTIFY_MAX_RETRY_WAIT=10)
+    def test_retry_after_beyond_the_wait_budget_is_not_waited_for(self):
+        self.session.request.return_value = mock.Mock(status_code=429, headers={'Retry-After': '60'})
+        self.assertEqual(spotify_client.api_get('token', '/me/top/tracks').status_code, 429)
+        self.assertEqual(self.session.request.call_count, 1)
+        # Rate limiting is not an outage
+        self.assertFalse(spotify_client.get_circuit_breaker().is_open())
+
+    @override_settings(SPOTIFY_MAX_RETRIES=2, SPOTIFY_BACKOFF_BASE=0.001)
+    def test_server_errors_are_retried_until_retries_run_out(self):
+        self.session.request.return_value = mock.Mock(status_code=503, headers={})
+        self.assertEqual(spotify_client.api_get('token', '/me/top/tracks').status_code, 503)
+        self.assertEqual(self.session.request.call_count, 3)
+
+        self.session.request.reset_mock()
+        self.session.request.return_value = None
+        self.session.request.side_effect = [mock.Mock(status_code=502, headers={}), mock.Mock(status_code=200, headers={})]
+        self.assertEqual(spotify_client.api_get('token', '/me/top/tracks').status_code, 200)
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_request_stops_at_the_callers_deadline(self):
+        self.session.request.return_value = mock.Mock(status_code=200, headers={})
+        spotify_client.api_get('token', '/me/top/tracks', until=time.monotonic() + 1)
+        self.assertLessEqual(self.session.request.call_args.kwargs['timeout'], 1)
+
+        self.session.request.reset_mock()
+        self.assertIsNone(spotify_client.api_get('token', '/me/top/tracks', until=time.monotonic() - 1))
+        self.session.request.assert_not_called()
+
+    def test_fetches_past_the_deadline_are_abandoned_with_it(self):
+        handed = {}
+
+        def slow(until):
+            handed['until'] = until
+            time.sleep(0.3)
+            return 'late'
+
+        started = time.monotonic()
+        results = fetch_concurrently({'fast': lambda until: 'done', 'slow': slow}, deadline=0.1)
+        self.assertEqual(results, {'fast': 'done', 'slow': None})
+        self.assertLess(time.monotonic() - started, 0.3)
+        # The slow task was told when it would be abandoned, to stop its requests by then
+        self.assertAlmostEqual(handed['until'], started + 0.1, delta=0.05)
+
+
+class CircuitBreakerTests(QueryCountTestCase):
+    """
+    Checks the Spotify circuit breaker and serving saved wraps while it is open.
+    """
+
+    def setUp(self):
+        super().setUp()
+        spotify_client.reset_circuit_breaker()
+        self.addCleanup(spotify_client.reset_circuit_breaker)
+
+    def test_opens_after_repeated_failures_and_retries_after_reset(self):
+        breaker = spotify_client.CircuitBreaker(threshold=2, reset_after=0.05)
+        breaker.record_failure()
+        self.assertFalse(breaker.is_open())
+        with self.assertLogs('spotifywrapped.spotify_client', 'WARNING'):
+            breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow_request())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        # Only one trial request while half-open
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertTrue(breaker.allow_request())
+
+    @override_settings(SPOTIFY_BREAKER_THRESHOLD=1, SPOTIFY_MAX_RETRIES=0)
+    def test_open_breaker_skips_the_network(self):
+        with mock.patch('spotifywrapped.spotify_client.get_session') as get_session:
+            get_session.return_value.request.return_value = mock.Mock(status_code=503, headers={})
+            with self.assertLogs('spotifywrapped.spotify_client', 'WARNING'):
+                self.assertEqual(spotify_client.api_get('token', '/me/top/tracks').status_code, 503)
+            self.assertIsNone(spotify_client.api_get('token', '/me/top/tracks'))
+        self.assertEqual(get_session.return_value.request.call_count, 1)
+
+    @override_settings(WRAP_JOBS_ASYNC=False)
+    def test_open_breaker_serves_latest_wrap_and_revalidates(self):
+        session = self.client.session
+        session['spotify_access_token'] = 'token'
+        session.save()
+        stale = self.create_wrap(self.alice, 'short_term')
+        with self.assertLogs('spotifywrapped.spotify_client', 'WARNING'):
+            for _ in range(5):
+                spotify_client.get_circuit_breaker().record_failure()
+
+        with mock.patch('spotifywrapped.views.run_wrap_job_in_background') as revalidate, \
+                mock.patch('spotifywrapped.spotify_data.fetch_top_items') as fetch:
+            response = self.client.get(reverse('spotify_wrapped'), {'time_range': 'short_term'})
+        self.assertRedirects(response, reverse('display_selected_wrap', args=[stale.id]), fetch_redirect_response=False)
+        fetch.assert_not_called()
+        self.assertEqual(revalidate.call_args.args[0].time_range, 'short_term')
+
+    @override_settings(WRAP_JOBS_ASYNC=True)
+    def test_worker_finding_spotify_down_sends_the_progress_page_to_the_latest_wrap(self):
+        session = self.client.session
+        session['spotify_access_token'] = 'token'
+        session.save()
+        stale = self.create_wrap(self.alice, 'short_term')
+
+        # The web process has not seen the outage, so the request queues a job as usual
+        response = self.client.get(reverse('spotify_wrapped'), {'time_range': 'short_term'})
+        job = WrapJob.objects.get(user=self.alice)
+        self.assertRedirects(response, reverse('wrap_job_progress', args=[job.id]), fetch_redirect_response=False)
+
+        # Only the worker's breaker is open
+        with self.assertLogs('spotifywrapped.spotify_client', 'WARNING'):
+            for _ in range(5):
+                spotify_client.get_circuit_breaker().record_failure()
+        with mock.patch('spotifywrapped.spotify_client.get_session') as get_session:
+            call_command('run_wrap_worker', '--once', stdout=io.StringIO())
+        get_session.return_value.request.assert_not_called()
+
+        data = self.client.get(reverse('wrap_job_status', args=[job.id])).json()
+        self.assertEqual(data['status'], WrapJob.STATUS_FAILED)
+        self.assertEqual(data['redirect_url'], reverse('display_selected_wrap', args=[stale.id]))
+        self.assertIn("Spotify is unavailable right now", data['message'])
+
+        # Without an earlier wrap there is nothing to fall back to
+        job, _ = enqueue_wrap_job(self.alice, 'long_term', 'token')
+        with mock.patch('spotifywrapped.spotify_client.get_session'):
+            call_command('run_wrap_worker', '--once', stdout=io.StringIO())
+        data = self.client.get(reverse('wrap_job_status', args=[job.id])).json()
+        self.assertEqual(data['status'], WrapJob.STATUS_FAILED)
+        self.assertNotIn('redirect_url', data)
+
+
+class ListeningHistoryTests(QueryCountTestCase):
+    """
+    Checks incremental ingestion of the recently played history and the statistics computed from it.
+    """
+
+    @staticmethod
+    def page(plays, after):
+        tracks = fake_tracks()
+        items = [
+            {'track': dict(tracks[index], duration_ms=180000), 'played_at': played_at}
+            for index, played_at in plays
+        ]
+        return mock.Mock(status_code=200, json=lambda: {'items': items, 'cursors': {'after': str(after), 'before': '1'}})
+
+    def test_polls_only_transfer_new_plays(self):
+        first = self.page([(1, '2026-10-18T10:06:00.000Z'), (0, '2026-10-18T10:03:00Z')], after=1792317960000)
+        # The second poll overlaps the first by one play
+        second = self.page([(0, '2026-10-18T10:09:00Z'), (1, '2026-10-18T10:06:00.000Z')], after=1792318140000)
+        with mock.patch('spotifywrapped.spotify_client.api_get', side_effect=[first, second]) as api_get:
+            self.assertEqual(ingest_recently_played(self.alice, 'token'), 2)
+            self.assertEqual(ingest_recently_played(self.alice, 'token'), 1)
+
+        self.assertEqual([call.kwargs['params']['after'] for call in api_get.call_args_list], [0, 1792317960000])
+        self.assertEqual(ListeningCursor.objects.get(user=self.alice).after, 1792318140000)
+        self.assertEqual(ListeningEvent.objects.filter(user=self.alice).count(), 3)
+
+        stats = listening_stats(self.alice)
+        self.assertEqual((stats['plays'], stats['minutes']), (3, 9))
+        self.assertEqual(stats['top_tracks'][0]['name'], 'Song 0')
+        self.assertEqual(stats['top_tracks'][0]['plays'], 2)
+        self.assertIsNone(listening_stats(self.bob))
+
+    def test_failed_poll_keeps_the_cursor(self):
+        with mock.patch('spotifywrapped.spotify_client.api_get', return_value=None):
+            self.assertIsNone(ingest_recently_played(self.alice, 'token'))
+        self.assertEqual(ListeningCursor.objects.get(user=self.alice).after, 0)
+
+
+class CatalogBackfillMigrationTests(TransactionTestCase):
+    """
+    Checks that migration 0005 moves the tracks and artists of saved wraps into the catalog, and
+    that reversing it puts them back into each wrap's JSON.
+    """
+    before = ('spotifywrapped', '0004_track_artist_catalog')
+    after = ('spotifywrapped', '0005_backfill_track_artist_catalog')
+
+    def migrate(self, target):
+        """
+        Migrates the test database to the given migrations and returns the models as of them.
+        """
+        executor = MigrationExecutor(connection)
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_backfill_and_reverse(self):
+        apps = self.migrate([self.before])
+        user = apps.get_model('auth', 'User').objects.create(username='alice')
+        wrap_data = fake_wrap_data()
+        wrap_id = apps.get_model('spotifywrapped', 'SpotifyWrap').objects.create(user=user, wrap_data=wrap_data).id
+
+        apps = self.migrate([self.after])
+        wrap = apps.get_model('spotifywrapped', 'SpotifyWrap').objects.get(id=wrap_id)
+        self.assertNotIn('tracks_game', wrap.wrap_data)
+        self.assertEqual(wrap.wrap_data['genres'], wrap_data['genres'])
+        self.assertEqual(apps.get_model('spotifywrapped', 'Track').objects.count(), 50)
+        self.assertEqual(apps.get_model('spotifywrapped', 'WrapTrack').objects.filter(section='tracks_game').count(), 50)
+        self.assertEqual(apps.get_model('spotifywrapped', 'WrapArtist').objects.filter(section='top_artists').count(), 10)
+
+        apps = self.migrate([self.before])
+        self.assertEqual(apps.get_model('spotifywrapped', 'SpotifyWrap').objects.get(id=wrap_id).wrap_data, wrap_data)
+        self.assertFalse(apps.get_model('spotifywrapped', 'WrapTrack').objects.exists())
+
+
+class SeasonWrapsCommandTests(TransactionTestCase):
+    """
+    Checks the offline season generator against the fake Spotify API. Wraps are generated on a worker
+    thread, which only sees committed data, hence TransactionTestCase. A single worker is used because
+    the in-memory test database fails concurrent writers outright instead of making them wait.
+    """
+
+    def setUp(self):
+        spotify_client.reset_circuit_breaker()
+        self.addCleanup(spotify_client.reset_circuit_breaker)
+        # Catalog rows cached by this test's commits are flushed with the database afterwards
+        self.addCleanup(catalog_cache.clear)
+        expires_at = timezone.now() + timedelta(hours=1)
+        for name in ('alice', 'bob', 'carol'):
+            user = User.objects.create_user(name, first_name=name.title())
+            SpotifyToken.objects.create(user=user, access_token=f'{name}-token', refresh_token='refresh', expires_at=expires_at)
+        User.objects.create_user('dave')  # Never connected Spotify
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'season.checkpoint')
+
+    def generate(self, *args):
+        out = io.StringIO()
+        call_command('generate_season_wraps', '--fake-spotify', '--latency', '0', '--workers', '1',
+                     '--checkpoint', self.checkpoint, *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_generates_every_connected_user_and_resumes_from_checkpoint(self):
+        self.generate('--limit', '2')
+        self.assertEqual(SpotifyWrap.objects.count(), 6)
+        self.assertEqual(set(SpotifyWrap.objects.values_list('user__username', flat=True)), {'alice', 'bob'})
+
+        # The resumed run only picks up the user left over
+        output = self.generate()
+        self.assertIn('1 users to process (2 already in the checkpoint)', output)
+        self.assertIn('Finished: 1/1 users (1 done, 0 failed, 0 unauthorized)', output)
+        self.assertEqual(SpotifyWrap.objects.filter(user__username='carol').count(), 3)
+        self.assertFalse(SpotifyWrap.objects.filter(user__username='dave').exists())
+
+    def test_resumed_run_fails_the_jobs_a_crashed_run_left_running(self):
+        alice = User.objects.get(username='alice')
+        crashed, _ = enqueue_wrap_job(alice, WrapJob.TIME_RANGE_ALL, 'alice-token')
+        WrapJob.objects.filter(id=crashed.id).update(status=WrapJob.STATUS_RUNNING)
+        with open(self.checkpoint, 'w', encoding='utf-8') as f:
+            f.write(f"{alice.id} started {crashed.id}\n")
+
+        output = self.generate('--limit', '1')
+        self.assertIn('Failed 1 jobs left active by the previous run.', output)
+        self.assertIn('Finished: 1/1 users (1 done, 0 failed, 0 unauthorized)', output)
+        crashed.refresh_from_db()
+        self.assertEqual(crashed.status, WrapJob.STATUS_FAILED)
+        self.assertEqual(SpotifyWrap.objects.filter(user=alice).count(), 3)
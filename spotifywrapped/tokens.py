@@ -0,0 +1,196 @@
+import time
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from app_secrets import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET
+
+from . import spotify_client
+from .models import SpotifyToken
+
+
+def redirect_uri():
+    """
+    Returns the callback URL registered with Spotify for this app.
+    """
+    return getattr(settings, 'SPOTIFY_REDIRECT_URI', 'http://localhost:8000/callback/')
+
+
+def build_authorize_url():
+    """
+    Builds the Spotify authorization URL locally, without a round trip to the Accounts service.
+
+    Returns:
+        str: The URL to redirect the user to.
+    """
+    params = {
+        "client_id": SPOTIFY_CLIENT_ID,
+        "response_type": "code",
+        "redirect_uri": redirect_uri(),
+        "scope": getattr(settings, 'SPOTIFY_SCOPES', "user-top-read user-read-recently-played"),
+        "show_dialog": "true",
+    }
+    return f"{spotify_client.SPOTIFY_ACCOUNTS_URL}/authorize?{urlencode(params)}"
+
+
+def request_token(payload):
+    """
+    Sends a token request to the Spotify Accounts service.
+
+    Args:
+        payload (dict): The grant-specific form fields.
+
+    Returns:
+        requests.Response or None: The response, or None if no response could be obtained.
+    """
+    return spotify_client.accounts_post('/api/token', {
+        **payload,
+        "client_id": SPOTIFY_CLIENT_ID,
+        "client_secret": SPOTIFY_CLIENT_SECRET,
+    })
+
+
+def exchange_code(code):
+    """
+    Exchanges an authorization code for an access token, refresh token and expiry.
+
+    Args:
+        code (str): The authorization code received from Spotify.
+
+    Returns:
+        dict or None: The token response, or None if the exchange failed.
+    """
+    response = request_token({"grant_type": "authorization_code", "code": code, "redirect_uri": redirect_uri()})
+    if response is None or response.status_code != 200:
+        return None
+    return response.json()
+
+
+def token_fields(token_data):
+    """
+    Returns the SpotifyToken field values carried by a token response. Spotify may omit the
+    refresh token and scope when refreshing, in which case they are left out and the stored ones kept.
+
+    Args:
+        token_data (dict): The token response from the Accounts service.
+
+    Returns:
+        dict: The field values to store.
+    """
+    fields = {
+        'access_token': token_data['access_token'],
+        'expires_at': timezone.now() + timedelta(seconds=token_data.get('expires_in', 3600)),
+    }
+    if token_data.get('refresh_token'):
+        fields['refresh_token'] = token_data['refresh_token']
+    if token_data.get('scope'):
+        fields['scope'] = token_data['scope']
+    return fields
+
+
+def save_token(user, token_data):
+    """
+    Stores a token response for a user, e.g. after they authorized the app again.
+
+    Args:
+        user (User): The user the token belongs to.
+        token_data (dict): The token response from the Accounts service.
+
+    Returns:
+        SpotifyToken: The stored token.
+    """
+    token, _ = SpotifyToken.objects.update_or_create(user=user, defaults={**token_fields(token_data), 'refreshing_since': None})
+    return token
+
+
+def claim_refresh(token):
+    """
+    Takes the refresh lease on a token with a compare-and-swap: the update only matches if nobody
+    refreshed the token since it was read (expires_at is unchanged) and no other refresh holds a
+    live lease. It is a single UPDATE, so it coordinates processes as well as threads.
+
+    Args:
+        token (SpotifyToken): The token as read by the caller.
+
+    Returns:
+        bool: True if the caller now holds the lease and must refresh the token.
+    """
+    now = timezone.now()
+    lease = getattr(settings, 'SPOTIFY_TOKEN_REFRESH_LEASE', 30)
+    return bool(SpotifyToken.objects.filter(
+        Q(refreshing_since__isnull=True) | Q(refreshing_since__lt=now - timedelta(seconds=lease)),
+        pk=token.pk, expires_at=token.expires_at,
+    ).update(refreshing_since=now))
+
+
+def wait_for_refresh(user, margin):
+    """
+    Waits for the refresh another thread or process holds the lease for, up to the lease length.
+
+    Args:
+        user (User): The user whose token is being refreshed.
+        margin (int): The refresh margin, in seconds.
+
+    Returns:
+        SpotifyToken or None: The token once refreshed, or as it stands when the refresh failed or
+        the lease ran out; None if it was deleted.
+    """
+    deadline = time.monotonic() + getattr(settings, 'SPOTIFY_TOKEN_REFRESH_LEASE', 30)
+    while True:
+        token = SpotifyToken.objects.filter(user=user).first()
+        if token is None or not token.expires_within(margin) or token.refreshing_since is None:
+            return token
+        if time.monotonic() >= deadline:
+            return token
+        time.sleep(0.1)
+
+
+def get_access_token(user):
+    """
+    Returns a usable access token for the user, refreshing it first if it expires within
+    settings.SPOTIFY_TOKEN_REFRESH_MARGIN seconds.
+
+    Concurrent refreshes are coalesced through a lease on the token row (see claim_refresh): only
+    its holder calls Spotify, outside any transaction, and stores the result with one UPDATE. Other
+    callers keep using the current token while it is still valid, and otherwise wait for the holder.
+
+    Args:
+        user (User): The user whose token is needed.
+
+    Returns:
+        str or None: The access token, or None if the user has not authorized the app or the
+        refresh failed and they must authorize again.
+    """
+    margin = getattr(settings, 'SPOTIFY_TOKEN_REFRESH_MARGIN', 300)
+    token = SpotifyToken.objects.filter(user=user).first()
+    if token is None:
+        return None
+    if not token.expires_within(margin):
+        return token.access_token
+
+    if not claim_refresh(token):
+        # Someone else is refreshing; the current token does until it actually expires
+        if not token.expires_within(0):
+            return token.access_token
+        token = wait_for_refresh(user, margin)
+        return None if token is None or token.expires_within(0) else token.access_token
+
+    response = None
+    if token.refresh_token:
+        response = request_token({"grant_type": "refresh_token", "refresh_token": token.refresh_token})
+    if response is not None and response.status_code == 200:
+        fields = token_fields(response.json())
+        SpotifyToken.objects.filter(pk=token.pk).update(refreshing_since=None, updated_at=timezone.now(), **fields)
+        return fields['access_token']
+
+    revoked = response is not None and response.status_code in (400, 401)
+    if revoked or (not token.refresh_token and token.expires_within(0)):
+        # The token can no longer be refreshed: the user has to authorize again
+        token.delete()
+        return None
+    # Spotify could not be reached; release the lease so the next caller tries again. The current
+    # token is still usable until it actually expires
+    SpotifyToken.objects.filter(pk=token.pk).update(refreshing_since=None)
+    return None if token.expires_within(0) else token.access_token
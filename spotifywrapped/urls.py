@@ -14,6 +14,8 @@ urlpatterns = [
     path("contact-us/", views.contact_us, name="contact_us"),
     path("callback/", views.spotify_callback, name="spotify_callback"),
     path("spotify_wrapped/", spotify_wrapped, name="spotify_wrapped"),
+    path("spotify_wrapped/jobs/<int:job_id>/", views.wrap_job_progress, name="wrap_job_progress"),
+    path("spotify_wrapped/jobs/<int:job_id>/status/", views.wrap_job_status, name="wrap_job_status"),
     path("get_spotify_auth_url/", views.get_spotify_auth_url, name="get_spotify_auth_url"),
     path('saved-wraps/', view_saved_wraps, name='view_saved_wraps'),
     path('saved-wraps/<int:wrap_id>/', display_selected_wrap, name='display_selected_wrap'),
@@ -21,7 +23,8 @@ urlpatterns = [
     path('accept-duo-invitation/<int:duo_id>/', accept_duo_invitation, name='accept_duo_invitation'),
     path('duo-wrapped/<int:duo_id>/', view_duo_wrapped, name='view_duo_wrapped'),
     path('validate_song_guess/', views.validate_song_guess, name='validate_song_guess'),
-    path('new_song_question/', views.new_song_question, name='new_song_question'),
+    path('song_questions/', views.song_questions, name='song_questions'),
     path('delete-wrap/<int:wrap_id>/', views.delete_saved_wrap, name='delete_saved_wrap'),
+    path('metrics/', views.metrics, name='metrics'),
 
 ]
@@ -4,19 +4,31 @@ from django.contrib.auth import logout
 from django.contrib.auth.models import User
 from spotifywrapped.forms import CustomUserCreationForm
 from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-import requests
+from django.conf import settings
 from django.http import HttpResponse
-from app_secrets import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET
-from .models import SpotifyWrap, DuoWrapped
+from .models import SpotifyWrap, DuoWrapped, WrapJob
+from .jobs import enqueue_wrap_job, latest_wrap_id, run_wrap_job, run_wrap_job_in_background, wait_for_job
+from . import spotify_client
 from django.shortcuts import get_object_or_404
-from collections import Counter
 import random
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
+from .instrumentation import phase
+from .tokens import build_authorize_url, exchange_code, get_access_token, save_token
+from .metrics import record_cache_lookup, registry
+
+GAME_SLIDE_TEMPLATE = 'slides/slide8.html'
 
 def register(request):
     """
@@ -134,7 +146,7 @@ def profile(request):
         HttpResponse: The rendered profile page with user details and invitations.
     """
     user = request.user
-    duo_invitations = DuoWrapped.objects.filter(invitee=user, is_accepted=False)
+    duo_invitations = DuoWrapped.objects.filter(invitee=user, is_accepted=False).select_related('inviter')
 
     context = {
         'first_name': user.first_name,
@@ -157,174 +169,6 @@ def contact_us(request):
     """
     return render(request, 'contact_us.html')
 
-def normalize_genre(genre):
-    """
-    Normalizes the genre string to a standard format. If the genre matches common categories,
-    it will be converted to a standard form. Otherwise, it returns a capitalized version of the genre.
-
-    Args:
-        genre (str): The genre to be normalized.
-
-    Returns:
-        str: The normalized genre.
-    """
-    if not genre:
-        return "Unknown Genre"
-    genre_lower = genre.lower()
-    if "hip hop" in genre_lower:
-        return "Hip Hop"
-    elif "r&b" in genre_lower or "rnb" in genre_lower:
-        return "R&B"
-    else:
-        return " ".join(word.capitalize() for word in genre.split())
-
-def top_genres(access_token, time_range):
-    """
-    Fetches the top genres from the user's top artists on Spotify based on the given time range.
-    Returns the top genres along with the percentage of each genre.
-
-    Args:
-        access_token (str): The Spotify access token to authenticate the API request.
-        time_range (str): The time range for fetching the top artists (e.g., 'short_term', 'medium_term', 'long_term').
-
-    Returns:
-        list: A list of dictionaries containing the top genres and their percentages.
-    """
-    top_artists_url = f"https://api.spotify.com/v1/me/top/artists?limit=50&time_range={time_range}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    response = requests.get(top_artists_url, headers=headers)
-    if response.status_code != 200:
-        return []  # Return an empty list if the request fails
-
-    genres = []
-    artist_data = response.json().get("items", [])
-    for artist in artist_data:
-        if artist.get('genres'):
-            first_genre = artist['genres'][0]
-            normalized_genre = normalize_genre(first_genre)
-            genres.append(normalized_genre)
-
-    genre_counts = Counter(genres)
-    top_genres = []
-    for genre, count in genre_counts.most_common(5):
-        percentage = int(round((count / 50) * 100, 1))
-        top_genres.append({'genre': genre, 'count': count, 'percentage': percentage})
-
-    return top_genres
-
-def get_least_popular(access_token, time_range):
-    """
-    Fetches the least popular song and artist based on popularity from the user's top tracks and artists.
-
-    Args:
-        access_token (str): The Spotify access token to authenticate the API request.
-        time_range (str): The time range for fetching the top tracks and artists.
-
-    Returns:
-        tuple: A tuple containing the least popular song and artist as dictionaries.
-    """
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    top_tracks_url = f"https://api.spotify.com/v1/me/top/tracks?limit=50&time_range={time_range}"
-    track_response = requests.get(top_tracks_url, headers=headers)
-    least_popular_song = None
-
-    if track_response.status_code == 200:
-        track_data = track_response.json().get("items", [])
-        if track_data:
-            least_popular_song = min(
-                track_data,
-                key=lambda track: track.get("popularity", 101),
-                default=None
-            )
-            if least_popular_song:
-                least_popular_song = {
-                    'name': least_popular_song['name'],
-                    'artist': least_popular_song['artists'][0]['name'] if least_popular_song['artists'] else "Unknown",
-                    'popularity': least_popular_song['popularity'],
-                    'image_url': least_popular_song['album']['images'][0]['url'] if least_popular_song['album']['images'] else None,
-                    'preview_url': least_popular_song['preview_url'],
-                }
-
-    top_artists_url = f"https://api.spotify.com/v1/me/top/artists?limit=50&time_range={time_range}"
-    artist_response = requests.get(top_artists_url, headers=headers)
-    least_popular_artist = None
-
-    if artist_response.status_code == 200:
-        artist_data = artist_response.json().get("items", [])
-        if artist_data:
-            least_popular_artist = min(
-                artist_data,
-                key=lambda artist: artist.get("popularity", 101),
-                default=None
-            )
-            if least_popular_artist:
-                least_popular_artist = {
-                    'name': least_popular_artist['name'],
-                    'genre': normalize_genre(least_popular_artist['genres'][0]) if least_popular_artist['genres'] else None,
-                    'popularity': least_popular_artist['popularity'],
-                    'image_url': least_popular_artist['images'][0]['url'] if least_popular_artist['images'] else None,
-                }
-
-    return least_popular_song, least_popular_artist
-
-def get_most_popular(access_token, time_range):
-    """
-    Fetches the most popular song and artist based on popularity from the user's top tracks and artists.
-
-    Args:
-        access_token (str): The Spotify access token to authenticate the API request.
-        time_range (str): The time range for fetching the top tracks and artists.
-
-    Returns:
-        tuple: A tuple containing the most popular song and artist as dictionaries.
-    """
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    top_tracks_url = f"https://api.spotify.com/v1/me/top/tracks?limit=50&time_range={time_range}"
-    track_response = requests.get(top_tracks_url, headers=headers)
-    most_popular_song = None
-
-    if track_response.status_code == 200:
-        track_data = track_response.json().get("items", [])
-        if track_data:
-            most_popular_song = max(
-                track_data,
-                key=lambda track: track.get("popularity", -1),
-                default=None
-            )
-            if most_popular_song:
-                most_popular_song = {
-                    'name': most_popular_song['name'],
-                    'artist': most_popular_song['artists'][0]['name'] if most_popular_song['artists'] else "Unknown",
-                    'popularity': most_popular_song['popularity'],
-                    'image_url': most_popular_song['album']['images'][0]['url'] if most_popular_song['album']['images'] else None,
-                    'preview_url': most_popular_song['preview_url'],
-                }
-
-    top_artists_url = f"https://api.spotify.com/v1/me/top/artists?limit=50&time_range={time_range}"
-    artist_response = requests.get(top_artists_url, headers=headers)
-    most_popular_artist = None
-
-    if artist_response.status_code == 200:
-        artist_data = artist_response.json().get("items", [])
-        if artist_data:
-            most_popular_artist = max(
-                artist_data,
-                key=lambda artist: artist.get("popularity", -1),
-                default=None
-            )
-            if most_popular_artist:
-                most_popular_artist = {
-                    'name': most_popular_artist['name'],
-                    'genre': normalize_genre(most_popular_artist['genres'][0]) if most_popular_artist['genres'] else "Unknown Genre",
-                    'popularity': most_popular_artist['popularity'],
-                    'image_url': most_popular_artist['images'][0]['url'] if most_popular_artist['images'] else None,
-                }
-
-    return most_popular_song, most_popular_artist
-
 def scramble_word(phrase):
     """
     Scrambles the characters in each word of the given phrase.
@@ -345,6 +189,30 @@ def scramble_word(phrase):
     scrambled_words = [scramble_word(word) for word in phrase.split()]
     return ' '.join(scrambled_words)
 
+def build_question_pool(tracks_game, size=None):
+    """
+    Builds a shuffled pool of scrambled song questions from the game tracks, so the client can play
+    a whole game from one batch instead of asking the server for each question.
+
+    Args:
+        tracks_game (list): The tracks available for the guessing game.
+        size (int, optional): The number of questions. Defaults to settings.SONG_QUESTION_POOL_SIZE.
+
+    Returns:
+        list: A list of questions, each with the album cover, scrambled name and correct name.
+    """
+    if size is None:
+        size = getattr(settings, 'SONG_QUESTION_POOL_SIZE', 20)
+    tracks = random.sample(tracks_game, min(size, len(tracks_game))) if tracks_game else []
+    return [
+        {
+            'album_cover': track['image_url'],
+            'scrambled_name': scramble_word(track['name']),
+            'correct_name': track['name'],
+        }
+        for track in tracks
+    ]
+
 def validate_song_guess(request):
     """
     Validates the user's guess for a song name. Compares the guess with the correct song name.
@@ -367,383 +235,177 @@ def validate_song_guess(request):
 
     return JsonResponse({'success': False, 'message': 'Invalid request method.'})
 
-def new_song_question(request):
+def spotify_access_token(request):
     """
-    Generates a new song guessing question by selecting a random song from the user's top tracks
-    and scrambling its name.
+    Returns the Spotify access token for this request: the logged-in user's stored token, refreshed
+    if it is about to expire, or else the token kept in the session.
 
     Args:
         request (HttpRequest): The HTTP request object.
 
     Returns:
-        JsonResponse: A response containing the scrambled song name and its album cover image.
+        str or None: The access token, or None if the user has to authorize with Spotify.
     """
-    time_range = request.GET.get('time_range', 'medium_term')
-    access_token = request.session.get('spotify_access_token')
-    headers = {"Authorization": f"Bearer {access_token}"}
-    tracks_game_other = []
-    tracks_game_url = f"https://api.spotify.com/v1/me/top/tracks?limit=50&time_range={time_range}"
-    tracks_game_response = requests.get(tracks_game_url, headers=headers)
-    if tracks_game_response.status_code == 200:
-        tracks_game_data = tracks_game_response.json().get("items", [])
-        for track_game in tracks_game_data:
-            tracks_game_other.append({
-                'name': track_game['name'],
-                'artist': track_game['artists'][0]['name'] if track_game['artists'] else "Unknown",
-                'image_url': track_game['album']['images'][0]['url'] if track_game['album']['images'] else None,
-            })
-    else:
-        messages.error(request, "Failed to fetch top tracks.")
-
-    if not tracks_game_other:
-        return JsonResponse({"error": "No tracks available"}, status=400)
-
-    random_track = random.choice(tracks_game_other)
-    scrambled_name = scramble_word(random_track['name'])
-
-    return JsonResponse({
-        "album_cover_other": random_track['image_url'],
-        "scrambled_name_other": scrambled_name,
-        "correct_name_other": random_track['name']
-    })
-
+    if request.user.is_authenticated:
+        access_token = get_access_token(request.user)
+        if access_token:
+            return access_token
+    return request.session.get('spotify_access_token')
 
+@login_required
+def song_questions(request):
+    """
+    Returns a batch of song guessing questions from the wrap's question pool. The pool is built the
+    first time the game asks for it, from the requested wrap (or the user's latest saved wrap when
+    no wrap is given), and kept in the session for the following rounds; showing a wrap does not
+    build it, so viewers who never play pay nothing for it.
 
+    Args:
+        request (HttpRequest): The HTTP request object. Accepts optional 'wrap_id' and 'count' query parameters.
 
+    Returns:
+        JsonResponse: A response containing the list of questions.
+    """
+    wrap_id = request.GET.get('wrap_id')
+    pool = request.session.get('song_question_pool')
+    if not pool or (wrap_id and str(pool['wrap_id']) != wrap_id):
+        wraps = SpotifyWrap.objects.filter(user=request.user).defer('wrap_data')
+        wrap = wraps.filter(id=wrap_id).first() if wrap_id and wrap_id.isdigit() else wraps.order_by('-created_at').first()
+        if wrap is None:
+            return JsonResponse({"error": "No tracks available"}, status=400)
+        _, tracks_game = get_wrap_deck(wrap, request.user.first_name)
+        pool = {'wrap_id': wrap.id, 'questions': build_question_pool(tracks_game)}
+        request.session['song_question_pool'] = pool
+
+    questions = pool['questions']
+    if not questions:
+        return JsonResponse({"error": "No tracks available"}, status=400)
 
+    try:
+        count = int(request.GET.get('count', len(questions)))
+    except ValueError:
+        count = len(questions)
+    random.shuffle(questions)
+    return JsonResponse({"questions": questions[:max(count, 1)]})
 
 @login_required
 def spotify_wrapped(request):
-    time_range = request.GET.get('time_range', 'medium_term')
-    # Fetch top track
-    access_token = request.session.get('spotify_access_token')
-    if not access_token:
-        messages.error(request, "Spotify access token is missing. Please reconnect.")
-        return redirect('get_spotify_auth_url')
-    user_first_name = request.user.first_name
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    # Fetch top track
-    top_tracks = []
-    top_tracks_url = f"https://api.spotify.com/v1/me/top/tracks?limit=10&time_range={time_range}"
-    track_response = requests.get(top_tracks_url, headers=headers)
-    if track_response.status_code == 200:
-        track_data = track_response.json().get("items", [])
-        for track in track_data:
-            top_tracks.append({
-                'name': track['name'],
-                'artist': track['artists'][0]['name'] if track['artists'] else "Unknown",
-                'image_url': track['album']['images'][0]['url'] if track['album']['images'] else None,
-                'preview_url': track['preview_url'],
-            })
-    else:
-        messages.error(request, "Failed to fetch top tracks.")
-
-    tracks_game = []
-    tracks_game_url = f"https://api.spotify.com/v1/me/top/tracks?limit=50&time_range={time_range}"
-    tracks_game_response = requests.get(tracks_game_url, headers=headers)
-    if tracks_game_response.status_code == 200:
-        tracks_game_data = tracks_game_response.json().get("items", [])
-        for track_game in tracks_game_data:
-            tracks_game.append({
-                'name': track_game['name'],
-                'artist': track_game['artists'][0]['name'] if track_game['artists'] else "Unknown",
-                'image_url': track_game['album']['images'][0]['url'] if track_game['album']['images'] else None,
-            })
-    else:
-        messages.error(request, "Failed to fetch top tracks.")
-
-    top_artists = []
-    top_artists_url = f"https://api.spotify.com/v1/me/top/artists?limit=10&time_range={time_range}"
-    artist_response = requests.get(top_artists_url, headers=headers)
-    if artist_response.status_code == 200:
-        artist_data = artist_response.json().get("items", [])
-        for artist in artist_data:
-            top_artists.append({
-                'name': artist['name'],
-                'genre': normalize_genre(artist['genres'][0]) if artist['genres'] else None,
-                'image_url': artist['images'][0]['url'] if artist['images'] else None,
-            })
-    else:
-        messages.error(request, "Failed to fetch top tracks.")
-
-    genres = top_genres(access_token, time_range)
+    """
+    Start generating the user's Spotify Wrapped, including top tracks, top artists, genres,
+    least and most popular songs, and a guessing game. The generation is queued as a background
+    job and the user is sent to a progress page that redirects to the finished wrap.
 
-    least_popular_song, least_popular_artist = get_least_popular(access_token, time_range)
-    most_popular_song, most_popular_artist = get_most_popular(access_token, time_range)
+    When settings.WRAP_JOBS_ASYNC is False, the job runs within the request instead and the user
+    is redirected straight to the finished wrap.
 
-    # Generate slides
-    slides = generate_wrapped_slides(
-        request.user.first_name,
-        top_track=top_tracks[0] if top_tracks else None,
-        top_artist=top_artists[0] if top_artists else None,
-        top_tracks=top_tracks,
-        top_artists=top_artists,
-        genres=genres,
-        least_popular_artist=least_popular_artist,
-        least_popular_song=least_popular_song,
-        most_popular_artist=most_popular_artist,
-        most_popular_song=most_popular_song,
-        tracks_game=tracks_game,
-    )
+    A request arriving while a generation for the same time range is already in flight (a double
+    click, a second tab) joins that job instead of starting another one. In that case, and whenever
+    this process's Spotify circuit breaker is open, the user's most recent wrap for the time range
+    is shown right away while the generation carries on in the background (stale-while-revalidate).
+    The breaker only sees this process's requests, so with a worker it rarely opens here; a job
+    that finds Spotify unavailable instead fails pointing at that latest wrap, which the progress
+    page then shows.
 
-    # Save wrap data to the database
-    wrap_data = {
-        'top_tracks': top_tracks,
-        'top_artists': top_artists,
-        'genres': genres,
-        'least_popular_song': least_popular_song,
-        'least_popular_artist': least_popular_artist,
-        'most_popular_song': most_popular_song,
-        'most_popular_artist': most_popular_artist,
-        'tracks_game': tracks_game,
-    }
-    SpotifyWrap.objects.create(
-        user=request.user,
-        wrap_data=wrap_data,  # Save all the wrap data as a dictionary
-        time_range = time_range
-    )
+    A time_range of 'all' builds the short, medium and long term wraps together in one batch, and
+    each of them gets a slide showing how the user's top tracks moved between the ranges.
 
-    # Render the wrapped page with dynamic slides
-    return render(request, 'base_slides.html', {'slides': slides})
+    Args:
+        request (HttpRequest): The HTTP request object.
 
-def generate_wrapped_slides(first_name, top_track=None, top_artist=None, top_tracks=None, top_artists=None, genres=None,
-                            least_popular_artist=None, least_popular_song=None, most_popular_artist=None,
-                            most_popular_song=None, tracks_game=None,):
-    slides = []
+    Returns:
+        HttpResponseRedirect: Redirects to the job's progress page, or to the finished wrap.
+    """
+    time_range = request.GET.get('time_range', 'medium_term')
+    access_token = spotify_access_token(request)
 
-    # Slide 1: Intro
-    slides.append({
-        'title': f"Welcome to your Spotify Wrapped, {first_name}!",
-        'template': 'slides/slide1.html'
-    })
-    #slide 2
-    slides.append({
-        'title': "Your Top Spotify Picks",
-        'template': 'slides/slide2.html',
-        'top_track': top_track,
-        'top_artist': top_artist,
-    })
-    # slide 3
-    slides.append({
-        'title': "Your Top 10 Tracks",
-        'template': 'slides/slide3.html',
-        'top_tracks': top_tracks,
-    })
-    # slide 4
-    slides.append({
-        'title': "Your Top 10 Artists",
-        'template': 'slides/slide4.html',
-        'top_artists': top_artists,
-    })
-    # Slide 5: Your Top Genres
-    slides.append({
-        'title': "Your Top 5 Genres",
-        'template': 'slides/slide5.html',
-        'top_genres': genres,
-    })
-    # Slide 6: Least Popular Picks
-    slides.append({
-        'title': "Your Hidden Gems",
-        'template': 'slides/slide6.html',
-        'least_popular_artist': least_popular_artist,
-        'least_popular_song': least_popular_song,
-    })
-    # Slide 7: Most Popular Artist and Song
-    slides.append({
-        'title': "Your Most Popular Picks",
-        'template': 'slides/slide7.html',
-        'most_popular_artist': most_popular_artist,  # Assuming top_artist is the most popular artist
-        'most_popular_song': most_popular_song,  # Assuming top_track is the most popular song
-    })
-    # Slide 8
-    if tracks_game:
-        random_track = random.choice(tracks_game)  # Randomly select a track for the game
-        scrambled_name = scramble_word(random_track['name'])
-        slides.append({
-            'title': "Guess the Song!",
-            'template': 'slides/slide8.html',
-            'album_cover': random_track['image_url'],
-            'scrambled_name': scrambled_name,
-            'correct_name': random_track['name'],  # Pass correct name to check user's input
-        })
-    # Slide 9: Outro
-    slides.append({
-        'title': "Thats's a Wrap!",
-        'template': 'slides/slide9.html',
-        'message': "We hope you enjoyed this journey through your music tastes. See you next year!",
-        'first_name': first_name
-    })
+    if not access_token:
+        messages.error(request, "Spotify access token is missing. Please reconnect.")
+        return redirect('get_spotify_auth_url')
 
-    return slides
+    spotify_down = spotify_client.get_circuit_breaker().is_open()
+    job, created = enqueue_wrap_job(request.user, time_range, access_token)
+    run_async = getattr(settings, 'WRAP_JOBS_ASYNC', True)
+
+    if spotify_down or not created:
+        stale_wrap_id = latest_wrap_id(request.user, time_range)
+        if stale_wrap_id is not None:
+            if created and not run_async:
+                run_wrap_job_in_background(job)
+            messages.info(request, "Showing your latest wrap while a fresh one is being built.")
+            return redirect('display_selected_wrap', wrap_id=stale_wrap_id)
+
+    if run_async:
+        return redirect('wrap_job_progress', job_id=job.id)
+
+    if created:
+        run_wrap_job(job)
+    elif not wait_for_job(job):
+        # The leading request is still working; follow its progress like an async job
+        return redirect('wrap_job_progress', job_id=job.id)
+    if job.wrap_id is None:
+        messages.error(request, job.message)
+        return redirect('home')
+    if job.status != WrapJob.STATUS_DONE:
+        messages.info(request, job.message)
+    return redirect('display_selected_wrap', wrap_id=job.wrap_id)
 
 @login_required
-def view_saved_wraps(request):
-    saved_wraps = SpotifyWrap.objects.filter(user=request.user).order_by('-created_at')
+def wrap_job_progress(request, job_id):
+    """
+    Render the "building your wrap" page, which polls the job status until the wrap is ready.
 
-    if not saved_wraps:
-        messages.info(request, "You don't have any saved wraps yet.")
-        return redirect('home')
+    Args:
+        request (HttpRequest): The HTTP request object.
+        job_id (int): The ID of the wrap generation job.
 
-    return render(request, 'select_wrap.html', {'saved_wraps': saved_wraps})
+    Returns:
+        HttpResponse: The rendered progress page.
+    """
+    job = get_object_or_404(WrapJob, id=job_id, user=request.user)
+    return render(request, 'wrap_progress.html', {'job': job})
 
 @login_required
-def display_selected_wrap(request, wrap_id):
-    try:
-        # Fetch the selected wrap for the logged-in user
-        selected_wrap = SpotifyWrap.objects.get(id=wrap_id, user=request.user)
-    except SpotifyWrap.DoesNotExist:
-        messages.error(request, "The selected wrap does not exist.")
-        return redirect('view_saved_wraps')
+def wrap_job_status(request, job_id):
+    """
+    Report the progress of a wrap generation job.
 
-    # Extract data from the wrap_data field
-    wrap_data = selected_wrap.wrap_data
-    top_tracks = wrap_data.get('top_tracks', [])
-    top_artists = wrap_data.get('top_artists', [])
-    genres = wrap_data.get('genres', [])
-    least_popular_song = wrap_data.get('least_popular_song', None)
-    least_popular_artist = wrap_data.get('least_popular_artist', None)
-    most_popular_song = wrap_data.get('most_popular_song', None)
-    most_popular_artist = wrap_data.get('most_popular_artist', None)
-    tracks_game = wrap_data.get('tracks_game', [])
-
-    # Generate slides using the stored wrap data
-    slides = generate_wrapped_slides(
-        first_name=request.user.first_name,
-        top_track=top_tracks[0] if top_tracks else None,
-        top_artist=top_artists[0] if top_artists else None,
-        top_tracks=top_tracks,
-        top_artists=top_artists,
-        genres=genres,
-        least_popular_artist=least_popular_artist,
-        least_popular_song=least_popular_song,
-        most_popular_artist=most_popular_artist,
-        most_popular_song=most_popular_song,
-        tracks_game=tracks_game,
-    )
+    Args:
+        request (HttpRequest): The HTTP request object.
+        job_id (int): The ID of the wrap generation job.
 
-    # Render the slides in the Spotify Wrapped template
-    context = {
-        'slides': slides,
+    Returns:
+        JsonResponse: The job's status, progress and message, plus the wrap's URL once it is done,
+        or the URL of the latest wrap shown instead when the job failed because Spotify was unavailable.
+    """
+    job = get_object_or_404(WrapJob, id=job_id, user=request.user)
+    data = {
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
     }
-    return render(request, 'base_slides.html', {'slides': slides})
-
+    if job.is_finished and job.wrap_id:
+        data['redirect_url'] = reverse('display_selected_wrap', args=[job.wrap_id])
+        if job.status == WrapJob.STATUS_FAILED:
+            messages.info(request, job.message)
+    return JsonResponse(data)
 
-
-@login_required
-def spotify_wrapped(request):
+@staff_member_required
+def metrics(request):
     """
-    Generate and display the user's Spotify Wrapped, including top tracks, top artists, genres,
-    least and most popular songs, and a guessing game. The data is fetched from the Spotify API
-    and displayed in dynamic slides.
+    Serve this process's metrics in the Prometheus text exposition format. Staff only.
 
     Args:
         request (HttpRequest): The HTTP request object.
 
     Returns:
-        HttpResponse: The rendered template containing the user's Spotify Wrapped slides.
+        HttpResponse: The metrics as plain text.
     """
-    time_range = request.GET.get('time_range', 'medium_term')
-    access_token = request.session.get('spotify_access_token')
-
-    if not access_token:
-        messages.error(request, "Spotify access token is missing. Please reconnect.")
-        return redirect('get_spotify_auth_url')
-
-    user_first_name = request.user.first_name
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    # Fetch top tracks
-    top_tracks = []
-    top_tracks_url = f"https://api.spotify.com/v1/me/top/tracks?limit=10&time_range={time_range}"
-    track_response = requests.get(top_tracks_url, headers=headers)
-    if track_response.status_code == 200:
-        track_data = track_response.json().get("items", [])
-        for track in track_data:
-            top_tracks.append({
-                'name': track['name'],
-                'artist': track['artists'][0]['name'] if track['artists'] else "Unknown",
-                'image_url': track['album']['images'][0]['url'] if track['album']['images'] else None,
-                'preview_url': track['preview_url'],
-            })
-    else:
-        messages.error(request, "Failed to fetch top tracks.")
-
-    # Fetch additional tracks for the game
-    tracks_game = []
-    tracks_game_url = f"https://api.spotify.com/v1/me/top/tracks?limit=50&time_range={time_range}"
-    tracks_game_response = requests.get(tracks_game_url, headers=headers)
-    if tracks_game_response.status_code == 200:
-        tracks_game_data = tracks_game_response.json().get("items", [])
-        for track_game in tracks_game_data:
-            tracks_game.append({
-                'name': track_game['name'],
-                'artist': track_game['artists'][0]['name'] if track_game['artists'] else "Unknown",
-                'image_url': track_game['album']['images'][0]['url'] if track_game['album']['images'] else None,
-            })
-    else:
-        messages.error(request, "Failed to fetch top tracks.")
-
-    # Fetch top artists
-    top_artists = []
-    top_artists_url = f"https://api.spotify.com/v1/me/top/artists?limit=10&time_range={time_range}"
-    artist_response = requests.get(top_artists_url, headers=headers)
-    if artist_response.status_code == 200:
-        artist_data = artist_response.json().get("items", [])
-        for artist in artist_data:
-            top_artists.append({
-                'name': artist['name'],
-                'genre': normalize_genre(artist['genres'][0]) if artist['genres'] else None,
-                'image_url': artist['images'][0]['url'] if artist['images'] else None,
-            })
-    else:
-        messages.error(request, "Failed to fetch top tracks.")
-
-    # Fetch top genres
-    genres = top_genres(access_token, time_range)
-
-    # Fetch least and most popular songs and artists
-    least_popular_song, least_popular_artist = get_least_popular(access_token, time_range)
-    most_popular_song, most_popular_artist = get_most_popular(access_token, time_range)
-
-    # Generate slides for the wrapped experience
-    slides = generate_wrapped_slides(
-        request.user.first_name,
-        top_track=top_tracks[0] if top_tracks else None,
-        top_artist=top_artists[0] if top_artists else None,
-        top_tracks=top_tracks,
-        top_artists=top_artists,
-        genres=genres,
-        least_popular_artist=least_popular_artist,
-        least_popular_song=least_popular_song,
-        most_popular_artist=most_popular_artist,
-        most_popular_song=most_popular_song,
-        tracks_game=tracks_game,
-    )
-
-    # Save the wrapped data to the database
-    wrap_data = {
-        'top_tracks': top_tracks,
-        'top_artists': top_artists,
-        'genres': genres,
-        'least_popular_song': least_popular_song,
-        'least_popular_artist': least_popular_artist,
-        'most_popular_song': most_popular_song,
-        'most_popular_artist': most_popular_artist,
-        'tracks_game': tracks_game,
-    }
-    SpotifyWrap.objects.create(
-        user=request.user,
-        wrap_data=wrap_data,  # Save all the wrap data as a dictionary
-        time_range=time_range
-    )
-
-    # Render the wrapped page with dynamic slides
-    return render(request, 'base_slides.html', {'slides': slides})
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 def generate_wrapped_slides(first_name, top_track=None, top_artist=None, top_tracks=None, top_artists=None, genres=None,
                             least_popular_artist=None, least_popular_song=None, most_popular_artist=None,
-                            most_popular_song=None, tracks_game=None):
+                            most_popular_song=None, tracks_game=None, rank_movement=None, listening_stats=None,
+                            audio_profile=None):
     """
     Generate the slides for the Spotify Wrapped experience. This function creates a series of slides
     based on the provided data, which includes top tracks, top artists, genres, and more.
@@ -760,6 +422,12 @@ def generate_wrapped_slides(first_name, top_track=None, top_artist=None, top_tra
         most_popular_artist (dict, optional): The user's most popular artist. Defaults to None.
         most_popular_song (dict, optional): The user's most popular song. Defaults to None.
         tracks_game (list, optional): List of tracks for the guessing game. Defaults to None.
+        rank_movement (list, optional): The user's top tracks with their rank in each time range,
+            only present on wraps generated for all time ranges at once. Defaults to None.
+        listening_stats (dict, optional): Play counts and listening minutes from the user's stored
+            listening history, if any was ingested. Defaults to None.
+        audio_profile (dict, optional): The mood, danceability, energy and valence of the user's top
+            tracks, if their audio features could be loaded. Defaults to None.
 
     Returns:
         list: A list of slides, each represented as a dictionary containing the title, template, and related data.
@@ -796,6 +464,17 @@ def generate_wrapped_slides(first_name, top_track=None, top_artist=None, top_tra
         'template': 'slides/slide5.html',
         'top_genres': genres,
     })
+    # Slide 12: Mood and Energy
+    if audio_profile:
+        slides.append({
+            'title': "Your Musical Mood",
+            'template': 'slides/slide12.html',
+            'mood': audio_profile['mood'],
+            'track_count': audio_profile['tracks'],
+            'features': [
+                {'label': name.title(), **audio_profile[name]} for name in ('danceability', 'energy', 'valence')
+            ],
+        })
     # Slide 6: Least Popular Picks
     slides.append({
         'title': "Your Hidden Gems",
@@ -810,16 +489,22 @@ def generate_wrapped_slides(first_name, top_track=None, top_artist=None, top_tra
         'most_popular_artist': most_popular_artist,
         'most_popular_song': most_popular_song,
     })
+    # Slide 11: Listening History
+    if listening_stats:
+        slides.append({
+            'title': "Your Listening, Counted",
+            'template': 'slides/slide11.html',
+            'listening_stats': listening_stats,
+        })
     # Slide 8: Guess the Song Game
     if tracks_game:
-        random_track = random.choice(tracks_game)  # Randomly select a track for the game
-        scrambled_name = scramble_word(random_track['name'])
+        slides.append(song_game_slide(tracks_game))
+    # Slide 10: Rank Movement across time ranges
+    if rank_movement:
         slides.append({
-            'title': "Guess the Song!",
-            'template': 'slides/slide8.html',
-            'album_cover': random_track['image_url'],
-            'scrambled_name': scrambled_name,
-            'correct_name': random_track['name'],
+            'title': "How Your Top Tracks Moved",
+            'template': 'slides/slide10.html',
+            'rank_movement': rank_movement,
         })
     # Slide 9: Outro
     slides.append({
@@ -831,10 +516,95 @@ def generate_wrapped_slides(first_name, top_track=None, top_artist=None, top_tra
 
     return slides
 
+def song_game_slide(tracks_game, wrap_id=None):
+    """
+    Build the "Guess the Song" slide from a randomly selected game track.
+
+    Args:
+        tracks_game (list): List of tracks for the guessing game.
+        wrap_id (int, optional): The saved wrap the game belongs to, used to fetch more questions. Defaults to None.
+
+    Returns:
+        dict: The game slide, with the album cover, scrambled name, and correct name.
+    """
+    random_track = random.choice(tracks_game)  # Randomly select a track for the game
+    return {
+        'title': "Guess the Song!",
+        'template': GAME_SLIDE_TEMPLATE,
+        'album_cover': random_track['image_url'],
+        'scrambled_name': scramble_word(random_track['name']),
+        'correct_name': random_track['name'],
+        'wrap_id': wrap_id,
+    }
+
+def slides_from_wrap_data(first_name, wrap_data):
+    """
+    Generate the slides for a saved wrap from its stored wrap data.
+
+    Args:
+        first_name (str): The wrap owner's first name.
+        wrap_data (dict): The wrap data, as saved on SpotifyWrap.wrap_data.
+
+    Returns:
+        list: A list of slides, as returned by generate_wrapped_slides.
+    """
+    top_tracks = wrap_data.get('top_tracks', [])
+    top_artists = wrap_data.get('top_artists', [])
+    return generate_wrapped_slides(
+        first_name=first_name,
+        top_track=top_tracks[0] if top_tracks else None,
+        top_artist=top_artists[0] if top_artists else None,
+        top_tracks=top_tracks,
+        top_artists=top_artists,
+        genres=wrap_data.get('genres', []),
+        least_popular_artist=wrap_data.get('least_popular_artist', None),
+        least_popular_song=wrap_data.get('least_popular_song', None),
+        most_popular_artist=wrap_data.get('most_popular_artist', None),
+        most_popular_song=wrap_data.get('most_popular_song', None),
+        tracks_game=wrap_data.get('tracks_game', []),
+        rank_movement=wrap_data.get('rank_movement', None),
+        listening_stats=wrap_data.get('listening_stats', None),
+        audio_profile=wrap_data.get('audio_profile', None),
+    )
+
+def get_wrap_deck(wrap, first_name):
+    """
+    Get the slides for a saved wrap, with every slide except the game pre-rendered to HTML.
+    A saved wrap never changes, so the rendered slides are cached per wrap; the game slide
+    is rebuilt on every call so each visit gets a fresh question.
+
+    Args:
+        wrap (SpotifyWrap): The saved wrap. Its data is only loaded on a cache miss.
+        first_name (str): The wrap owner's first name.
+
+    Returns:
+        tuple: The list of slides for base_slides.html and the wrap's game tracks.
+    """
+    deck = cache.get(wrap.deck_cache_key)
+    record_cache_lookup('wrap_deck', deck is not None)
+    if deck is None:
+        wrap_data = wrap.get_wrap_data()
+        deck = {
+            'slides': [
+                None if slide['template'] == GAME_SLIDE_TEMPLATE
+                else render_to_string(slide['template'], {'slide': slide})
+                for slide in slides_from_wrap_data(first_name, wrap_data)
+            ],
+            'tracks_game': wrap_data.get('tracks_game', []),
+        }
+        cache.set(wrap.deck_cache_key, deck, getattr(settings, 'WRAP_DECK_CACHE_TTL', 86400))
+
+    slides = [
+        song_game_slide(deck['tracks_game'], wrap_id=wrap.pk) if html is None else {'html': mark_safe(html)}
+        for html in deck['slides']
+    ]
+    return slides, deck['tracks_game']
+
 @login_required
 def view_saved_wraps(request):
     """
-    View the list of saved Spotify Wrapped experiences for the logged-in user.
+    View the list of saved Spotify Wrapped experiences for the logged-in user, one page at a time.
+    Only the summary columns are loaded, so the cost does not depend on the size of each wrap's data.
 
     Args:
         request (HttpRequest): The HTTP request object.
@@ -842,15 +612,68 @@ def view_saved_wraps(request):
     Returns:
         HttpResponse: The rendered template displaying saved wraps, or a redirect if no saved wraps exist.
     """
-    saved_wraps = SpotifyWrap.objects.filter(user=request.user).order_by('-created_at')
+    saved_wraps = SpotifyWrap.objects.filter(user=request.user).only(*SpotifyWrap.SUMMARY_FIELDS).order_by('-created_at')
+    paginator = Paginator(saved_wraps, getattr(settings, 'SAVED_WRAPS_PER_PAGE', 20))
 
-    if not saved_wraps:
+    if paginator.count == 0:
         messages.info(request, "You don't have any saved wraps yet.")
         return redirect('home')
 
-    return render(request, 'select_wrap.html', {'saved_wraps': saved_wraps})
+    page = paginator.get_page(request.GET.get('page'))
+    return render(request, 'select_wrap.html', {'saved_wraps': page.object_list, 'page': page})
+
+def wrap_validators(request, wrap_id):
+    """
+    Compute the ETag and Last-Modified validators of a saved wrap page. A saved wrap never changes,
+    so its id, owner and creation time identify the page content. The result is memoized on the
+    request so the ETag and Last-Modified checks share one query.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        wrap_id (int): The ID of the saved wrap.
+
+    Returns:
+        tuple: The ETag and the last-modified datetime, or (None, None) if the wrap does not exist.
+    """
+    if not hasattr(request, '_wrap_validators'):
+        created_at = SpotifyWrap.objects.filter(id=wrap_id, user=request.user).values_list('created_at', flat=True).first()
+        if created_at is None:
+            request._wrap_validators = (None, None)
+        else:
+            request._wrap_validators = (f'"wrap-{wrap_id}-{request.user.pk}-{created_at.timestamp()}"', created_at)
+    return request._wrap_validators
+
+def duo_validators(request, duo_id):
+    """
+    Compute the ETag and Last-Modified validators of a Duo Wrapped page. The page changes only when
+    the invitation is accepted or the inviter saves a newer wrap, so those identify its content.
+    The result is memoized on the request so the ETag and Last-Modified checks share the queries.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        duo_id (int): The ID of the Duo Wrapped experience.
+
+    Returns:
+        tuple: The ETag and the last-modified datetime, or (None, None) if there is nothing to show.
+    """
+    if not hasattr(request, '_duo_validators'):
+        request._duo_validators = (None, None)
+        duo = DuoWrapped.objects.filter(id=duo_id).values('inviter_id', 'created_at', 'is_accepted').first()
+        if duo and duo['is_accepted']:
+            inviter_wrap = SpotifyWrap.objects.filter(user_id=duo['inviter_id']).order_by('created_at').values('id', 'created_at').last()
+            if inviter_wrap:
+                request._duo_validators = (
+                    f'"duo-{duo_id}-accepted-{inviter_wrap["id"]}"',
+                    max(duo['created_at'], inviter_wrap['created_at']),
+                )
+    return request._duo_validators
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(
+    etag_func=lambda request, wrap_id: wrap_validators(request, wrap_id)[0],
+    last_modified_func=lambda request, wrap_id: wrap_validators(request, wrap_id)[1],
+)
 def display_selected_wrap(request, wrap_id):
     """
     Display a selected saved Spotify Wrapped experience for the logged-in user.
@@ -863,39 +686,16 @@ def display_selected_wrap(request, wrap_id):
         HttpResponse: The rendered template displaying the selected wrap slides, or a redirect if the wrap does not exist.
     """
     try:
-        selected_wrap = SpotifyWrap.objects.get(id=wrap_id, user=request.user)
+        selected_wrap = SpotifyWrap.objects.defer('wrap_data').get(id=wrap_id, user=request.user)
     except SpotifyWrap.DoesNotExist:
         messages.error(request, "The selected wrap does not exist.")
         return redirect('view_saved_wraps')
 
-    wrap_data = selected_wrap.wrap_data
-    top_tracks = wrap_data.get('top_tracks', [])
-    top_artists = wrap_data.get('top_artists', [])
-    genres = wrap_data.get('genres', [])
-    least_popular_song = wrap_data.get('least_popular_song', None)
-    least_popular_artist = wrap_data.get('least_popular_artist', None)
-    most_popular_song = wrap_data.get('most_popular_song', None)
-    most_popular_artist = wrap_data.get('most_popular_artist', None)
-    tracks_game = wrap_data.get('tracks_game', [])
-
-    slides = generate_wrapped_slides(
-        first_name=request.user.first_name,
-        top_track=top_tracks[0] if top_tracks else None,
-        top_artist=top_artists[0] if top_artists else None,
-        top_tracks=top_tracks,
-        top_artists=top_artists,
-        genres=genres,
-        least_popular_artist=least_popular_artist,
-        least_popular_song=least_popular_song,
-        most_popular_artist=most_popular_artist,
-        most_popular_song=most_popular_song,
-        tracks_game=tracks_game,
-    )
+    with phase('slides'):
+        slides, _ = get_wrap_deck(selected_wrap, request.user.first_name)
 
-    context = {
-        'slides': slides,
-    }
-    return render(request, 'base_slides.html', {'slides': slides})
+    with phase('render'):
+        return render(request, 'base_slides.html', {'slides': slides})
 
 
 @login_required
@@ -941,13 +741,13 @@ def invite_duo_wrapped(request):
                 return redirect('profile')
 
             # Check for an existing pending invitation
-            existing_invitation = DuoWrapped.objects.filter(
+            has_pending_invitation = DuoWrapped.objects.filter(
                 inviter=request.user,
                 invitee=invitee,
                 is_accepted=False
-            ).first()
+            ).exists()
 
-            if existing_invitation:
+            if has_pending_invitation:
                 messages.error(request, f"You already have a pending invitation to {invitee_username}.")
             else:
                 # Create a new invitation if no pending one exists
@@ -976,7 +776,7 @@ def accept_duo_invitation(request, duo_id):
     # Fetch the invitee's latest wrap data and save it to the invitation
     latest_wrap = SpotifyWrap.objects.filter(user=request.user).order_by('-created_at').first()
     if latest_wrap:
-        duo_invitation.invitee_wrap_data = latest_wrap.wrap_data
+        duo_invitation.invitee_wrap_data = latest_wrap.get_wrap_data()
         duo_invitation.is_accepted = True
         duo_invitation.save()
         messages.success(request, "You have accepted the Duo Wrapped invitation.")
@@ -989,6 +789,11 @@ def accept_duo_invitation(request, duo_id):
     return redirect('home')
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(
+    etag_func=lambda request, duo_id: duo_validators(request, duo_id)[0],
+    last_modified_func=lambda request, duo_id: duo_validators(request, duo_id)[1],
+)
 def view_duo_wrapped(request, duo_id):
     """
     Display the combined Duo Wrapped slides for both inviter and invitee.
@@ -1000,69 +805,23 @@ def view_duo_wrapped(request, duo_id):
     Returns:
         HttpResponse: The rendered Duo Wrapped page showing slides for both inviter and invitee.
     """
-    duo_wrapped = get_object_or_404(DuoWrapped, id=duo_id, is_accepted=True)
+    duo_wrapped = get_object_or_404(DuoWrapped.objects.select_related('inviter', 'invitee'), id=duo_id, is_accepted=True)
 
     # Fetch the latest wrap for the inviter
-    inviter_wrap = SpotifyWrap.objects.filter(user=duo_wrapped.inviter).last()
+    inviter_wrap = SpotifyWrap.objects.filter(user=duo_wrapped.inviter).order_by('created_at').last()
     invitee_wrap_data = duo_wrapped.invitee_wrap_data  # Get invitee's wrap data from the saved DuoWrapped model
 
     if inviter_wrap and invitee_wrap_data:
-        # Extract data for inviter
-        inviter_wrap_data = inviter_wrap.wrap_data
-        inviter_top_tracks = inviter_wrap_data.get('top_tracks', [])
-        inviter_top_artists = inviter_wrap_data.get('top_artists', [])
-        inviter_genres = inviter_wrap_data.get('genres', [])
-        inviter_least_popular_song = inviter_wrap_data.get('least_popular_song', None)
-        inviter_least_popular_artist = inviter_wrap_data.get('least_popular_artist', None)
-        inviter_most_popular_song = inviter_wrap_data.get('most_popular_song', None)
-        inviter_most_popular_artist = inviter_wrap_data.get('most_popular_artist', None)
-        inviter_tracks_game = inviter_wrap_data.get('tracks_game', [])
-
-        # Generate slides for inviter
-        inviter_slides = generate_wrapped_slides(
-            first_name=duo_wrapped.inviter.first_name,
-            top_track=inviter_top_tracks[0] if inviter_top_tracks else None,
-            top_artist=inviter_top_artists[0] if inviter_top_artists else None,
-            top_tracks=inviter_top_tracks,
-            top_artists=inviter_top_artists,
-            genres=inviter_genres,
-            least_popular_artist=inviter_least_popular_artist,
-            least_popular_song=inviter_least_popular_song,
-            most_popular_artist=inviter_most_popular_artist,
-            most_popular_song=inviter_most_popular_song,
-            tracks_game=inviter_tracks_game,
-        )
-
-        # Extract data for invitee
-        invitee_top_tracks = invitee_wrap_data.get('top_tracks', [])
-        invitee_top_artists = invitee_wrap_data.get('top_artists', [])
-        invitee_genres = invitee_wrap_data.get('genres', [])
-        invitee_least_popular_song = invitee_wrap_data.get('least_popular_song', None)
-        invitee_least_popular_artist = invitee_wrap_data.get('least_popular_artist', None)
-        invitee_most_popular_song = invitee_wrap_data.get('most_popular_song', None)
-        invitee_most_popular_artist = invitee_wrap_data.get('most_popular_artist', None)
-        invitee_tracks_game = invitee_wrap_data.get('tracks_game', [])
-
-        # Generate slides for invitee
-        invitee_slides = generate_wrapped_slides(
-            first_name=duo_wrapped.invitee.first_name,
-            top_track=invitee_top_tracks[0] if invitee_top_tracks else None,
-            top_artist=invitee_top_artists[0] if invitee_top_artists else None,
-            top_tracks=invitee_top_tracks,
-            top_artists=invitee_top_artists,
-            genres=invitee_genres,
-            least_popular_artist=invitee_least_popular_artist,
-            least_popular_song=invitee_least_popular_song,
-            most_popular_artist=invitee_most_popular_artist,
-            most_popular_song=invitee_most_popular_song,
-            tracks_game=invitee_tracks_game,
-        )
+        with phase('slides'):
+            inviter_slides = slides_from_wrap_data(duo_wrapped.inviter.first_name, inviter_wrap.get_wrap_data())
+            invitee_slides = slides_from_wrap_data(duo_wrapped.invitee.first_name, invitee_wrap_data)
 
         context = {
             'inviter_slides': inviter_slides,
             'invitee_slides': invitee_slides,
         }
-        return render(request, 'duo_wrapped.html', context)
+        with phase('render'):
+            return render(request, 'duo_wrapped.html', context)
     else:
         messages.error(request, "Wrap data is missing for one or both users.")
         return redirect('home')
@@ -1070,7 +829,8 @@ def view_duo_wrapped(request, duo_id):
 
 def get_spotify_auth_url(request):
     """
-    Generate the URL for Spotify authentication to request access to the user's top tracks and artists.
+    Redirect the user to Spotify to authorize access to their top tracks and artists.
+    The authorization URL is built locally, so no request to Spotify is needed.
 
     Args:
         request (HttpRequest): The HTTP request object.
@@ -1078,20 +838,13 @@ def get_spotify_auth_url(request):
     Returns:
         HttpResponseRedirect: Redirects to Spotify's authentication URL.
     """
-    auth_url = "https://accounts.spotify.com/authorize"
-    params = {
-        "client_id": SPOTIFY_CLIENT_ID,
-        "response_type": "code",
-        "redirect_uri": 'http://localhost:8000/callback/',  # Ensure this matches
-        "scope": "user-top-read user-read-recently-played",
-        "show_dialog": True
-    }
-    response = requests.get(auth_url, params=params)
-    return redirect(response.url)
+    return redirect(build_authorize_url())
 
 def spotify_callback(request):
     """
-    Handle the callback from Spotify after the user authorizes the app. Retrieves the access token.
+    Handle the callback from Spotify after the user authorizes the app. Exchanges the code for an
+    access token; for a logged-in user the access token, refresh token and expiry are stored so the
+    token can be refreshed later, otherwise the access token is kept in the session.
 
     Args:
         request (HttpRequest): The HTTP request object.
@@ -1101,40 +854,16 @@ def spotify_callback(request):
     """
     code = request.GET.get('code')
     if code:
-        # Attempt to get the access token
-        access_token = get_access_token(code)
-        if access_token:
-            # Store the access token in the session
-            request.session['spotify_access_token'] = access_token
+        token_data = exchange_code(code)
+        if token_data:
+            if request.user.is_authenticated:
+                save_token(request.user, token_data)
+                request.session.pop('spotify_access_token', None)
+            else:
+                request.session['spotify_access_token'] = token_data['access_token']
             # Redirect to the Spotify Wrapped page
             return redirect('spotify_wrapped')
         else:
             return HttpResponse("Failed to retrieve access token.")
     else:
         return HttpResponse("No authorization code received.")
-
-
-def get_access_token(code):
-    """
-    Exchange the authorization code for an access token from Spotify's API.
-
-    Args:
-        code (str): The authorization code received from Spotify.
-
-    Returns:
-        str or None: The access token if successful, or None if an error occurs.
-    """
-    token_url = "https://accounts.spotify.com/api/token"
-    payload = {
-        "grant_type": "authorization_code",
-        "code": code,
-        "redirect_uri": 'http://localhost:8000/callback/',  # Updated URI
-        "client_id": SPOTIFY_CLIENT_ID,
-        "client_secret": SPOTIFY_CLIENT_SECRET,
-    }
-
-    response = requests.post(token_url, data=payload)
-    if response.status_code == 200:
-        return response.json().get("access_token")
-    else:
-        return None